@@ -0,0 +1,559 @@
+"""
+In-memory availability index.
+
+Each technician and client gets a per-day bitmap of the time they are
+available and the time they are booked, with one bit per `SLOT_MINUTES` slot.
+"Who is free Monday 09:00-12:00" then becomes a few bitwise ANDs instead of
+joins against `Availability` through its generic foreign key.
+
+One index is kept per schedule, per process.  It is built lazily from the
+database, updated incrementally when rows are written in this process (see
+`signals.py`), and rebuilt whenever its fingerprint, the schedule's revisions
+(see revisions.py), no longer matches the database.  That covers writes made
+by other processes and bulk writes, which bump the revisions without updating
+the index.
+
+Indexes are read by several threads at once, so a person's slots are never
+changed once they're in an index: writes swap in an updated copy instead.
+"""
+
+import copy
+import threading
+from datetime import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from .models import (
+    Appointment,
+    Availability,
+    Client,
+    Schedule,
+    Technician,
+    resolve_schedule,
+)
+from .revisions import SHARED, get_revisions
+
+# NOTE: The frontend works on a 15 minute grid, so 5 minute slots represent
+# every time it can produce exactly.  Times off the grid are rounded so that a
+# technician is never reported free when they are not.
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+AVAILABILITY = "availability"
+APPOINTMENT = "appointment"
+TECHNICIAN = "technician"
+
+
+def to_time(value: str | time) -> time:
+    """
+    Convert a "HH:MM[:SS]" string to a `datetime.time`.
+    """
+    if isinstance(value, str):
+        return time.fromisoformat(value)
+    return value
+
+
+def to_minutes(value: int | str | time) -> float:
+    """
+    Convert a `datetime.time` or "HH:MM[:SS]" string to minutes since midnight.
+    Stored minutes of the day (see `MinuteRangeMixin`) are returned as is.
+    """
+    if isinstance(value, int):
+        return value
+    value = to_time(value)
+    return value.hour * 60 + value.minute + value.second / 60
+
+
+def slot_mask(
+    start_time: int | str | time, end_time: int | str | time, inner=False
+) -> int:
+    """
+    Return a bitmap of the slots between `start_time` and `end_time`.
+
+    By default every slot the range touches is set.  With `inner=True` only the
+    slots the range fully covers are set.
+    """
+    start = to_minutes(start_time) / SLOT_MINUTES
+    end = to_minutes(end_time) / SLOT_MINUTES
+
+    if inner:
+        start_slot, end_slot = -int(-start // 1), int(end // 1)
+    else:
+        start_slot, end_slot = int(start // 1), -int(-end // 1)
+
+    if end_slot <= start_slot:
+        return 0
+    return ((1 << (end_slot - start_slot)) - 1) << start_slot
+
+
+class PersonSlots:
+    """
+    Availability and booked time for one technician or client.
+    """
+
+    def __init__(self):
+        # id -> (day, mask, is_sub)
+        self.availabilities = {}
+        # id -> (day, mask, duration in minutes)
+        self.appointments = {}
+        self.refresh()
+
+    def copy(self):
+        slots = copy.copy(self)
+        slots.availabilities = dict(self.availabilities)
+        slots.appointments = dict(self.appointments)
+        return slots
+
+    def refresh(self):
+        """
+        Recompute the per-day bitmaps from the individual rows.
+        """
+        # Availabilities are kept as one mask per row, because an appointment
+        # has to fit inside a single availability, not across two adjacent ones
+        self.available = [[] for _ in range(7)]
+        self.sub_available = [[] for _ in range(7)]
+        self.booked = [0] * 7
+        self.minutes_by_day = [0] * 7
+        self.total_minutes = 0
+
+        for day, mask, is_sub in self.availabilities.values():
+            if is_sub:
+                self.sub_available[day].append(mask)
+            else:
+                self.available[day].append(mask)
+
+        for day, mask, minutes in self.appointments.values():
+            self.booked[day] |= mask
+            self.minutes_by_day[day] += minutes
+            self.total_minutes += minutes
+
+    @property
+    def total_hours(self):
+        # NOTE: Mirrors `Client.total_hours` / `Technician.total_hours`
+        return round(self.total_minutes / 60, 2)
+
+    @property
+    def total_hours_by_day(self):
+        return [round(minutes / 60, 2) for minutes in self.minutes_by_day]
+
+    def is_available(self, day: int, mask: int, include_sub=False) -> bool:
+        masks = self.available[day]
+        if include_sub:
+            masks = masks + self.sub_available[day]
+        return any(mask & ~available == 0 for available in masks)
+
+    def is_booked(self, day: int, mask: int, exclude=None) -> bool:
+        """
+        Return True if any appointment, other than `exclude`, overlaps `mask`.
+        """
+        if exclude not in self.appointments:
+            return bool(self.booked[day] & mask)
+        return any(
+            appointment_day == day and appointment_mask & mask
+            for pk, (appointment_day, appointment_mask, _) in self.appointments.items()
+            if pk != exclude
+        )
+
+    def has_appointment_within(self, day: int, mask: int) -> bool:
+        """
+        Return True if any appointment on the given day fits inside `mask`.
+        """
+        return any(
+            appointment_day == day
+            and appointment_mask
+            and appointment_mask & ~mask == 0
+            for appointment_day, appointment_mask, _ in self.appointments.values()
+        )
+
+
+class TechnicianSlots(PersonSlots):
+    def __init__(
+        self,
+        skill_level=1,
+        spanish_speaking=False,
+        requested_hours=40,
+        is_manually_maxed_out=False,
+    ):
+        super().__init__()
+        self.skill_level = skill_level
+        self.spanish_speaking = spanish_speaking
+        self.requested_hours = requested_hours
+        self.is_manually_maxed_out = is_manually_maxed_out
+
+    def meets_requirements(self, client: Client) -> bool:
+        if self.skill_level < client.req_skill_level:
+            return False
+        if client.req_spanish_speaking and not self.spanish_speaking:
+            return False
+        return True
+
+    def is_maxed_on_sessions(self) -> bool:
+        # NOTE: Mirrors `Technician.is_maxed_on_sessions`
+        if self.is_manually_maxed_out:
+            return True
+        return self.total_hours >= self.requested_hours
+
+
+class AvailabilityIndex:
+    """
+    Slot bitmaps for every technician and client in one schedule.
+    """
+
+    def __init__(self, schedule: Schedule, fingerprint):
+        self.schedule = schedule
+        self.schedule_id = schedule.pk
+        self.fingerprint = fingerprint
+        # held by writes, and by reads that iterate over everyone
+        self.lock = threading.RLock()
+        self.technician_content_type_id = ContentType.objects.get_for_model(
+            Technician
+        ).pk
+        self.technicians = {}
+        self.clients = {}
+        # appointment id -> (client id, technician id)
+        self.appointments = {}
+
+    @classmethod
+    def build(cls, schedule: Schedule, fingerprint):
+        index = cls(schedule, fingerprint)
+
+        for technician in Technician.objects.order_by().values(
+            "id",
+            "skill_level",
+            "spanish_speaking",
+            "requested_hours",
+            "is_manually_maxed_out",
+        ):
+            technician_id = technician.pop("id")
+            index.technicians[technician_id] = TechnicianSlots(**technician)
+
+        for availability in (
+            Availability.objects.in_schedule(schedule)
+            .order_by()
+            .values(
+                "id",
+                "content_type_id",
+                "object_id",
+                "day",
+                "start_minute",
+                "end_minute",
+                "is_sub",
+            )
+        ):
+            index._add_availability(**availability)
+
+        for appointment in (
+            Appointment.objects.in_schedule(schedule)
+            .order_by()
+            .values(
+                "id",
+                "client_id",
+                "technician_id",
+                "day",
+                "start_minute",
+                "end_minute",
+                "duration_minutes",
+            )
+        ):
+            index._add_appointment(**appointment)
+
+        for person in [*index.technicians.values(), *index.clients.values()]:
+            person.refresh()
+
+        return index
+
+    def _person(self, content_type_id, object_id):
+        if content_type_id == self.technician_content_type_id:
+            return self.technicians.setdefault(object_id, TechnicianSlots())
+        return self.clients.setdefault(object_id, PersonSlots())
+
+    def _add_availability(
+        self, id, content_type_id, object_id, day, start_minute, end_minute, is_sub
+    ):
+        person = self._person(content_type_id, object_id)
+        person.availabilities[id] = (
+            int(day),
+            slot_mask(start_minute, end_minute, inner=True),
+            is_sub,
+        )
+        return person
+
+    def _add_appointment(
+        self,
+        id,
+        client_id,
+        technician_id,
+        day,
+        start_minute,
+        end_minute,
+        duration_minutes,
+    ):
+        booking = (int(day), slot_mask(start_minute, end_minute), duration_minutes)
+        self.appointments[id] = (client_id, technician_id)
+        self.clients.setdefault(client_id, PersonSlots()).appointments[id] = booking
+        technician = self.technicians.setdefault(technician_id, TechnicianSlots())
+        technician.appointments[id] = booking
+        return [self.clients[client_id], technician]
+
+    # Incremental updates
+
+    def _update(self, people, pk, update, factory=PersonSlots):
+        """
+        Swap in an updated copy of a person's slots, so that a reader holding
+        the old ones never sees them change.
+        """
+        slots = people[pk].copy() if pk in people else factory()
+        update(slots)
+        slots.refresh()
+        people[pk] = slots
+
+    def _people(self, content_type_id):
+        if content_type_id == self.technician_content_type_id:
+            return self.technicians, TechnicianSlots
+        return self.clients, PersonSlots
+
+    def contains(self, kind, pk) -> bool:
+        with self.lock:
+            if kind == APPOINTMENT:
+                return pk in self.appointments
+            return any(
+                pk in person.availabilities
+                for person in [*self.technicians.values(), *self.clients.values()]
+            )
+
+    def save_availability(self, availability: Availability):
+        booking = (
+            int(availability.day),
+            slot_mask(availability.start_minute, availability.end_minute, inner=True),
+            availability.is_sub,
+        )
+        people, factory = self._people(availability.content_type_id)
+        with self.lock:
+            self.delete_availability(availability.pk)
+            self._update(
+                people,
+                availability.object_id,
+                lambda slots: slots.availabilities.update({availability.pk: booking}),
+                factory,
+            )
+
+    def delete_availability(self, pk):
+        with self.lock:
+            for people in [self.technicians, self.clients]:
+                for person_id in [
+                    person_id
+                    for person_id, person in people.items()
+                    if pk in person.availabilities
+                ]:
+                    self._update(
+                        people,
+                        person_id,
+                        lambda slots: slots.availabilities.pop(pk),
+                    )
+
+    def save_appointment(self, appointment: Appointment):
+        booking = (
+            int(appointment.day),
+            slot_mask(appointment.start_minute, appointment.end_minute),
+            appointment.duration_minutes,
+        )
+        with self.lock:
+            self.delete_appointment(appointment.pk)
+            self.appointments[appointment.pk] = (
+                appointment.client_id,
+                appointment.technician_id,
+            )
+            for people, person_id, factory in [
+                (self.clients, appointment.client_id, PersonSlots),
+                (self.technicians, appointment.technician_id, TechnicianSlots),
+            ]:
+                self._update(
+                    people,
+                    person_id,
+                    lambda slots: slots.appointments.update({appointment.pk: booking}),
+                    factory,
+                )
+
+    def delete_appointment(self, pk):
+        with self.lock:
+            if pk not in self.appointments:
+                return
+            client_id, technician_id = self.appointments.pop(pk)
+            for people, person_id in [
+                (self.clients, client_id),
+                (self.technicians, technician_id),
+            ]:
+                self._update(
+                    people, person_id, lambda slots: slots.appointments.pop(pk)
+                )
+
+    def save_technician(self, technician: Technician):
+        def update(slots):
+            slots.skill_level = technician.skill_level
+            slots.spanish_speaking = technician.spanish_speaking
+            slots.requested_hours = technician.requested_hours
+            slots.is_manually_maxed_out = technician.is_manually_maxed_out
+
+        with self.lock:
+            self._update(self.technicians, technician.pk, update, TechnicianSlots)
+
+    def delete_technician(self, pk):
+        with self.lock:
+            self.technicians.pop(pk, None)
+
+    def expect_revision(self, key: str):
+        """
+        Advance the fingerprint past a revision bump whose write has been
+        applied to the index, or doesn't change it.
+        """
+        with self.lock:
+            schedule_key, revision, shared = self.fingerprint
+            if key == SHARED:
+                shared += 1
+            else:
+                revision += 1
+            self.fingerprint = (schedule_key, revision, shared)
+
+    # Queries
+
+    def client_slots(self, client_id) -> PersonSlots:
+        return self.clients.get(client_id) or PersonSlots()
+
+    def technician_slots(self, technician_id) -> TechnicianSlots:
+        return self.technicians.get(technician_id) or TechnicianSlots()
+
+    def find_available_technicians(
+        self,
+        client: Client,
+        day: int,
+        start_time: str | time,
+        end_time: str | time,
+    ) -> set:
+        """
+        Return the ids of the technicians who meet the client's requirements,
+        are not maxed out on sessions, are available (not as a sub) and are not
+        already booked on the given day and time.
+        """
+        mask = slot_mask(start_time, end_time)
+        with self.lock:
+            technicians = list(self.technicians.items())
+        return {
+            technician_id
+            for technician_id, technician in technicians
+            if technician.meets_requirements(client)
+            and not technician.is_maxed_on_sessions()
+            and technician.is_available(day, mask)
+            and not technician.is_booked(day, mask)
+        }
+
+    def find_substitute_technicians(self, appointment: Appointment) -> set:
+        """
+        Return the ids of the technicians, other than the one booked, who meet
+        the client's requirements and are free (regular or as a sub) during the
+        given appointment.
+        """
+        mask = slot_mask(appointment.start_minute, appointment.end_minute)
+        with self.lock:
+            technicians = list(self.technicians.items())
+        return {
+            technician_id
+            for technician_id, technician in technicians
+            if technician_id != appointment.technician_id
+            and technician.meets_requirements(appointment.client)
+            and technician.is_available(appointment.day, mask, include_sub=True)
+            and not technician.is_booked(appointment.day, mask)
+        }
+
+    def current_technician_ids(self, client_id) -> set:
+        """
+        Return the ids of the technicians the client has appointments with.
+        """
+        with self.lock:
+            appointments = list(self.appointments.values())
+        return {
+            technician_id
+            for appointment_client_id, technician_id in appointments
+            if appointment_client_id == client_id
+        }
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_fingerprint(schedule: Schedule | None) -> tuple[str, int, int]:
+    """
+    Return the revisions of everything an index is built from, in a single
+    query.
+    """
+    return get_revisions(schedule)
+
+
+def get_built_index(schedule: Schedule | None = None) -> AvailabilityIndex | None:
+    """
+    Return the index of the given schedule if this process has built it and it
+    is up to date, without building it.
+    """
+    schedule = resolve_schedule(schedule)
+    with _lock:
+        index = _indexes.get(schedule.pk)
+    if index is None or index.fingerprint != get_fingerprint(schedule):
+        return None
+    return index
+
+
+def get_index(schedule: Schedule | None = None) -> AvailabilityIndex:
+    """
+    Return an up to date index for the given schedule (by default, the current
+    one), building it if needed.
+    """
+    schedule = resolve_schedule(schedule)
+    schedule_id = schedule.pk
+    fingerprint = get_fingerprint(schedule)
+
+    with _lock:
+        index = _indexes.get(schedule_id)
+    if index is not None and index.fingerprint == fingerprint:
+        return index
+
+    index = AvailabilityIndex.build(schedule, fingerprint)
+
+    def keep():
+        with _lock:
+            _indexes[schedule_id] = index
+
+    # NOTE: Revisions go back down when a transaction is rolled back, so an
+    # index that may hold its writes is only kept once they're committed
+    transaction.on_commit(keep)
+    return index
+
+
+def get_built_indexes() -> list[AvailabilityIndex]:
+    with _lock:
+        return list(_indexes.values())
+
+
+def discard_index(schedule_id):
+    with _lock:
+        _indexes.pop(schedule_id, None)
+
+
+def clear_indexes():
+    with _lock:
+        _indexes.clear()
+
+
+def expect_revision(key: str):
+    """
+    Keep the built indexes through a bump of revision `key` by a write made in
+    this process, once the transaction commits.
+
+    Only bumps of an index's own schedule (whose writes are applied to it, see
+    signals.py) and of the shared rows are expected.  Anything else, I.E. a
+    write to the parent of an overlay, a bulk write or a write made by another
+    process, leaves the index behind the database, so it's rebuilt on next use.
+    """
+    for index in get_built_indexes():
+        if key in (str(index.schedule_id), SHARED):
+            transaction.on_commit(lambda index=index: index.expect_revision(key))
@@ -0,0 +1,187 @@
+"""
+Blind indexes of encrypted names.
+
+Client and technician names are encrypted with a random IV, so the database
+can't compare, order or search them.  Next to each name a keyed HMAC of it
+(normalized) is stored, which the database can compare for exact lookups
+without learning the name, and HMACs of the prefixes of each of its words
+for searches as the user types.  The HMACs are keyed with `BLIND_INDEX_KEY`,
+so they can't be recomputed from guessed names without it.
+
+Rows are also numbered in name order (`name_rank`), so lists are ordered and
+paginated in SQL.  The rank only reveals the order of the names, which
+anyone who can list them sees anyway.  Saving a row with a new name only
+moves the rows ranked between its old and new place, and rankings of a model
+take turns under an advisory lock rather than locking its rows.  Deleting a
+row leaves a gap in the ranks, which only `rank` closes.
+
+NOTE: A prefix's HMAC is the same in every row, so the database can tell
+which rows share a prefix (and exact HMACs, which share a name).  Prefix
+HMACs are truncated, which makes a few false matches possible but tells even
+less.
+"""
+
+import base64
+import hashlib
+import hmac
+import unicodedata
+from functools import cache
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+
+# Hex digits kept of the HMAC of a whole name, and of a prefix
+EXACT_DIGITS = 32
+PREFIX_DIGITS = 12
+
+NAME_FIELDS = ["first_name", "last_name"]
+INDEX_FIELDS = ["first_name_index", "last_name_index", "name_prefixes"]
+
+
+@cache
+def get_key(key: str) -> bytes:
+    return base64.urlsafe_b64decode(key)
+
+
+def normalize(value: str) -> str:
+    """
+    Compare names regardless of case, accents' encoding and spacing.
+    """
+    return " ".join(unicodedata.normalize("NFKC", value or "").casefold().split())
+
+
+def get_hmac(value: str, digits: int = EXACT_DIGITS) -> str:
+    key = get_key(settings.BLIND_INDEX_KEY)
+    return hmac.new(key, value.encode(), hashlib.sha256).hexdigest()[:digits]
+
+
+def get_exact_index(name: str) -> str:
+    return get_hmac(normalize(name))
+
+
+def get_prefix_token(prefix: str) -> str:
+    return get_hmac(f"prefix:{normalize(prefix)}", PREFIX_DIGITS)
+
+
+def get_prefix_index(*names: str) -> str:
+    """
+    The tokens of every prefix of every word of the names, space separated and
+    surrounded, so a token is matched with `contains=f" {token} "`.  They are
+    sorted, so their order says nothing about the words.
+    """
+    words = normalize(" ".join(names)).split()
+    tokens = {
+        get_prefix_token(word[:length])
+        for word in words
+        for length in range(1, len(word) + 1)
+    }
+    return f" {' '.join(sorted(tokens))} "
+
+
+def get_search_tokens(query: str) -> list[str]:
+    """
+    The prefix tokens a row must have to match every word of a search.
+    """
+    return [get_prefix_token(word) for word in normalize(query).split()]
+
+
+def set_index(instance):
+    instance.first_name_index = get_exact_index(instance.first_name)
+    instance.last_name_index = get_exact_index(instance.last_name)
+    instance.name_prefixes = get_prefix_index(instance.first_name, instance.last_name)
+
+
+def get_sort_key(instance) -> tuple:
+    return (
+        normalize(instance.first_name),
+        normalize(instance.last_name),
+        str(instance.pk),
+    )
+
+
+def lock(model, using: str):
+    """
+    Wait for the other rankings of a model's rows, until the transaction ends.
+    SQLite only has one writer at a time anyway.
+    """
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return
+    digest = hashlib.sha256(f"rank:{model._meta.label}".encode()).digest()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_advisory_xact_lock(%s)",
+            [int.from_bytes(digest[:8], "big", signed=True)],
+        )
+
+
+def place(instance, using=None):
+    """
+    Rank a row about to be saved with a new name, and move the rows ranked
+    between its old and new place by one.  Call it in the transaction that
+    saves the row.
+
+    Positions are worked out from the ranks the rows have, rather than from
+    how many there are, so the gaps deleted rows leave don't matter.
+    """
+    model = type(instance)
+    manager = model._base_manager.db_manager(using)
+    lock(model, manager.db)
+
+    old = 0
+    key = get_sort_key(instance)
+    # the highest rank of the rows named before it
+    before = 0
+    for row in manager.only(*NAME_FIELDS, "name_rank").order_by():
+        if row.pk == instance.pk:
+            old = row.name_rank
+        elif get_sort_key(row) < key:
+            before = max(before, row.name_rank)
+
+    ranks = manager.exclude(pk=instance.pk)
+    if not old:
+        new = before + 1
+        ranks.filter(name_rank__gte=new).update(name_rank=F("name_rank") + 1)
+    elif old > before:
+        new = before + 1
+        ranks.filter(name_rank__gte=new, name_rank__lt=old).update(
+            name_rank=F("name_rank") + 1
+        )
+    else:
+        new = before
+        ranks.filter(name_rank__gt=old, name_rank__lte=new).update(
+            name_rank=F("name_rank") - 1
+        )
+    instance.name_rank = new
+
+
+def rank(model, using=None):
+    """
+    Number a model's rows in name order.  Every row is renumbered, so call it
+    once after a batch of writes.
+    """
+    manager = model._base_manager.db_manager(using)
+    with transaction.atomic(using=manager.db):
+        lock(model, manager.db)
+        rows = list(manager.only(*NAME_FIELDS, "name_rank").order_by())
+        rows.sort(key=get_sort_key)
+        changed = []
+        for position, row in enumerate(rows, 1):
+            if row.name_rank != position:
+                row.name_rank = position
+                changed.append(row)
+        manager.bulk_update(changed, ["name_rank"], batch_size=500)
+
+
+def reindex(model, using=None):
+    """
+    Recompute the indexes and ranks of all of a model's rows, E.G. after
+    changing `BLIND_INDEX_KEY`.
+    """
+    manager = model._base_manager.db_manager(using)
+    rows = list(manager.only(*NAME_FIELDS).order_by())
+    for row in rows:
+        set_index(row)
+    manager.bulk_update(rows, INDEX_FIELDS, batch_size=500)
+    rank(model, using)
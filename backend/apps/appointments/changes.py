@@ -0,0 +1,216 @@
+"""
+Schedule change feed.
+
+Every create, update and delete of a schedule's rows is recorded as a
+`ScheduleChange` (see signals.py).  Their IDs increase, so a reader keeps the
+ID of the last change it has seen as a cursor and asks for the changes after
+it: only the rows changed since, and tombstones for the deleted ones.  An
+idle poll is a single indexed query.
+
+NOTE: IDs are handed out when a change is recorded, not when its transaction
+commits, so a change can become visible after changes with higher IDs.  The
+cursor returned therefore only moves past changes older than
+`SETTLE_SECONDS`; newer ones are sent again on the next poll, which is
+harmless since applying a change twice has the same result.
+
+Old entries are deleted by `prune_changes`.  The newest of them is kept as a
+reset in every schedule's feed, so readers whose cursor is older reload the
+schedule rather than miss the pruned changes.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import (
+    Appointment,
+    Availability,
+    Client,
+    Schedule,
+    ScheduleChange,
+    Technician,
+    TherapyAppointment,
+    resolve_schedule,
+)
+from .serializers import (
+    AppointmentBasicSerializer,
+    AvailabilitySerializer,
+    ClientBasicSerializer,
+    TechnicianBasicSerializer,
+    TherapyAppointmentSerializer,
+)
+
+SETTLE_SECONDS = 30
+
+# Feed name (as in the schedule snapshot) of each model, and its serializer
+FEED_MODELS = {
+    Appointment: ("appointments", AppointmentBasicSerializer),
+    Availability: ("availabilities", AvailabilitySerializer),
+    TherapyAppointment: ("therapy_appointments", TherapyAppointmentSerializer),
+    Client: ("clients", ClientBasicSerializer),
+    Technician: ("technicians", TechnicianBasicSerializer),
+}
+# Models that aren't part of a schedule
+SHARED_MODELS = [Client, Technician]
+
+
+def record_change(instance, action: str):
+    """
+    Record that a row was created / updated or deleted.
+    """
+    name, _ = FEED_MODELS[type(instance)]
+    ScheduleChange.objects.create(
+        schedule_id=getattr(instance, "schedule_id", None),
+        model=name,
+        object_id=instance.pk,
+        action=action,
+    )
+
+
+def record_upserts(model, instances):
+    """
+    Record that rows were created or updated in bulk, E.G. by `bulk_create`,
+    which doesn't send signals.
+    """
+    name, _ = FEED_MODELS[model]
+    ScheduleChange.objects.bulk_create(
+        ScheduleChange(
+            schedule_id=getattr(instance, "schedule_id", None),
+            model=name,
+            object_id=instance.pk,
+            action=ScheduleChange.UPSERT,
+        )
+        for instance in instances
+    )
+
+
+def record_reset(schedule: Schedule):
+    """
+    Tell readers of a schedule's feed to reload it, after changes too large
+    or too indirect (E.G. queryset updates) to record row by row.
+    """
+    ScheduleChange.objects.create(schedule=schedule, action=ScheduleChange.RESET)
+
+
+def prune_changes(retention: timedelta | None = None) -> int:
+    """
+    Delete the changes older than the retention window (by default
+    `SCHEDULE_CHANGE_RETENTION_DAYS`), and return how many were deleted.
+
+    The newest of them becomes a reset without a schedule, which is in every
+    feed, so a cursor from before it resets the reader.
+    """
+    if retention is None:
+        retention = timedelta(days=settings.SCHEDULE_CHANGE_RETENTION_DAYS)
+    cutoff = timezone.now() - retention
+
+    with transaction.atomic():
+        last = ScheduleChange.objects.filter(created_at__lt=cutoff).aggregate(
+            last=Max("id")
+        )["last"]
+        if last is None:
+            return 0
+        deleted, _ = ScheduleChange.objects.filter(id__lt=last).delete()
+        ScheduleChange.objects.filter(id=last).update(
+            schedule=None, model="", object_id=None, action=ScheduleChange.RESET
+        )
+    return deleted
+
+
+def get_feed(schedule: Schedule | None):
+    schedule = resolve_schedule(schedule)
+    shared = [FEED_MODELS[model][0] for model in SHARED_MODELS]
+    feed = (
+        Q(schedule=schedule)
+        | Q(schedule=None, model__in=shared)
+        # where the pruned changes end, see `prune_changes`
+        | Q(schedule=None, action=ScheduleChange.RESET)
+    )
+    if schedule.is_overlay:
+        # the rows it reads from its parent
+        feed |= Q(schedule=schedule.parent_id)
+    return ScheduleChange.objects.filter(feed)
+
+
+def get_cursor(schedule: Schedule | None) -> int:
+    """
+    The cursor to read a schedule's feed from, for a reader that loads the
+    whole schedule now.
+    """
+    settled = timezone.now() - timedelta(seconds=SETTLE_SECONDS)
+    latest = (
+        get_feed(schedule)
+        .filter(created_at__lte=settled)
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+    )
+    return latest or 0
+
+
+def get_changes(schedule: Schedule | None, cursor: int, context=None) -> dict:
+    """
+    Return the rows changed in a schedule since the cursor, grouped by feed
+    name, the IDs of the deleted ones, and the cursor to read from next.
+
+    If the feed was reset since the cursor, only `"reset": True` is returned
+    and the reader should reload the whole schedule.
+    """
+    changes = list(
+        get_feed(schedule)
+        .filter(id__gt=cursor)
+        .order_by("id")
+        .values_list("id", "model", "object_id", "action", "created_at")
+    )
+    result = {"cursor": cursor, "reset": False, "changes": {}, "deleted": {}}
+    if not changes:
+        return result
+
+    # the last action on each row is what counts
+    latest = {}
+    for _, name, object_id, action, _ in changes:
+        if action == ScheduleChange.RESET:
+            return {"cursor": None, "reset": True, "changes": {}, "deleted": {}}
+        latest[name, object_id] = action
+
+    # move past the changes that have settled, up to the first one that hasn't
+    settled = timezone.now() - timedelta(seconds=SETTLE_SECONDS)
+    for change_id, _, _, _, created_at in changes:
+        if created_at > settled:
+            break
+        result["cursor"] = change_id
+
+    for model, (name, serializer_class) in FEED_MODELS.items():
+        upserted = [
+            object_id
+            for (change_name, object_id), action in latest.items()
+            if change_name == name and action == ScheduleChange.UPSERT
+        ]
+        deleted = {
+            object_id
+            for (change_name, object_id), action in latest.items()
+            if change_name == name and action == ScheduleChange.DELETE
+        }
+
+        if upserted:
+            queryset = model.objects.filter(pk__in=upserted)
+            if model is Client:
+                queryset = queryset.prefetch_related("past_technicians")
+            if model not in SHARED_MODELS:
+                queryset = queryset.in_schedule(schedule)
+            instances = list(queryset)
+            # rows that are gone since (or moved to another schedule, or
+            # hidden by an overlay) are tombstones too
+            deleted.update(set(upserted) - {instance.pk for instance in instances})
+            if instances:
+                result["changes"][name] = serializer_class(
+                    instances, many=True, context=context
+                ).data
+
+        if deleted:
+            result["deleted"][name] = [str(object_id) for object_id in deleted]
+
+    return result
@@ -0,0 +1,117 @@
+"""
+Schedule copies.
+
+A schedule's availabilities, appointments and therapy appointments are copied
+to another schedule with one `INSERT ... SELECT` per table, so the rows never
+leave the database: encrypted columns are copied as they are, without being
+decrypted and encrypted again.  An overlay (see overlays.py) is copied with
+the rows it reads from its parent.
+
+Bulk copies don't send signals, so they're audited with a single log entry
+on the schedule, and readers of the schedule they're copied to should be
+told to reload it (see changes.record_reset).
+"""
+
+from auditlog.models import LogEntry
+from django.db import connection
+from django.utils import timezone
+
+from .models import (
+    Appointment,
+    Availability,
+    HiddenRow,
+    Schedule,
+    TherapyAppointment,
+)
+
+# Models copied with a schedule, by name
+SCHEDULE_MODELS = {
+    "availabilities": Availability,
+    "appointments": Appointment,
+    "therapy_appointments": TherapyAppointment,
+}
+
+# A random (version 4) UUID, as stored by each database
+NEW_UUID_SQL = {
+    "postgresql": "gen_random_uuid()",
+    # UUIDs are stored as 32 hex digits (and "%" is escaped for the params)
+    "sqlite": (
+        "lower(hex(randomblob(6)) || '4' || substr(hex(randomblob(2)), 2)"
+        " || substr('89ab', 1 + abs(random()) %% 4, 1)"
+        " || substr(hex(randomblob(2)), 2) || hex(randomblob(6)))"
+    ),
+}
+
+
+def copy_rows(model, source_id, target_id, hidden_by=None) -> int:
+    """
+    Copy the rows of a model from one schedule to another, with new IDs and
+    timestamps, skipping the rows hidden by the `hidden_by` overlay.  Returns
+    the number of rows copied.
+    """
+    quote_name = connection.ops.quote_name
+    now = timezone.now()
+    columns, values, params = [], [], []
+    for field in model._meta.concrete_fields:
+        columns.append(quote_name(field.column))
+        if field.primary_key:
+            values.append(NEW_UUID_SQL[connection.vendor])
+        elif field.name == "schedule":
+            values.append("%s")
+            params.append(field.get_db_prep_value(target_id, connection))
+        elif field.name in ("created_at", "updated_at"):
+            values.append("%s")
+            params.append(field.get_db_prep_value(now, connection))
+        else:
+            values.append(quote_name(field.column))
+
+    schedule_field = model._meta.get_field("schedule")
+    where = f"{quote_name(schedule_field.column)} = %s"
+    params.append(schedule_field.get_db_prep_value(source_id, connection))
+    if hidden_by is not None:
+        where += (
+            f" AND {quote_name(model._meta.pk.column)} NOT IN"
+            f" (SELECT object_id FROM {quote_name(HiddenRow._meta.db_table)}"
+            f" WHERE schedule_id = %s)"
+        )
+        params.append(schedule_field.get_db_prep_value(hidden_by, connection))
+
+    table = quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"SELECT {', '.join(values)} FROM {table} WHERE {where}",
+            params,
+        )
+        return cursor.rowcount
+
+
+def copy_schedule(source: Schedule, target: Schedule) -> dict:
+    """
+    Copy the rows of a schedule to another, which should be empty.  Returns
+    the number of rows copied, by name.
+    """
+    copied = {}
+    for name, model in SCHEDULE_MODELS.items():
+        copied[name] = copy_rows(model, source.pk, target.pk)
+        if source.is_overlay:
+            copied[name] += copy_rows(
+                model, source.parent_id, target.pk, hidden_by=source.pk
+            )
+
+    log_copy(target, source.pk, target.pk, copied)
+    return copied
+
+
+def log_copy(schedule: Schedule, source_id, target_id, copied: dict):
+    LogEntry.objects.log_create(
+        schedule,
+        force_log=True,
+        action=LogEntry.Action.UPDATE,
+        changes={},
+        additional_data={
+            "copied_from": str(source_id),
+            "copied_to": str(target_id),
+            **copied,
+        },
+    )
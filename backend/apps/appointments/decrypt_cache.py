@@ -0,0 +1,88 @@
+"""
+Decrypted field cache.
+
+Encrypted fields (see fields.py) are decrypted every time a row is loaded,
+and the same rows are loaded over and over: every appointment in a list
+loads its client and technician, every request loads the roster.  A value's
+ciphertext never changes until the value does, so the decrypted values are
+memoized by the SHA-256 digest of their ciphertext, in an LRU of at most
+`DECRYPT_CACHE_MAX_ENTRIES` entries that expire after
+`DECRYPT_CACHE_SECONDS`.
+
+NOTE: The cache lives in the process's memory only: plaintext is never sent
+to a shared cache, and the ciphertext isn't kept either.  Hits and misses are
+therefore counted per process.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import cache
+
+from django.conf import settings
+from encrypted_model_fields.fields import decrypt_str
+
+
+class DecryptCache:
+    """
+    Decrypted values by ciphertext digest, least recently used first.
+    """
+
+    def __init__(self, max_entries: int, timeout: float):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # digest -> (plaintext, expiry)
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def decrypt(self, ciphertext: str) -> str:
+        """
+        Decrypt a value, or raise `cryptography.fernet.InvalidToken` if it
+        isn't encrypted.
+        """
+        if self.max_entries <= 0:
+            return decrypt_str(ciphertext)
+
+        digest = hashlib.sha256(ciphertext.encode()).digest()
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(digest)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        plaintext = decrypt_str(ciphertext)
+        with self.lock:
+            self.entries[digest] = (plaintext, now + self.timeout)
+            self.entries.move_to_end(digest)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return plaintext
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            hits, misses = self.hits, self.misses
+            return {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else None,
+                "size": len(self.entries),
+                "evictions": self.evictions,
+            }
+
+
+@cache
+def get_decrypt_cache() -> DecryptCache:
+    return DecryptCache(
+        settings.DECRYPT_CACHE_MAX_ENTRIES, settings.DECRYPT_CACHE_SECONDS
+    )
@@ -0,0 +1,272 @@
+"""
+Schedule change events.
+
+Every create, update and delete of a schedule's appointments, availabilities
+and therapy appointments is published as a compact event to the readers of
+the schedule's event stream (see `views.schedule_events`), so they can fetch
+the changes (see changes.py) as soon as they happen instead of polling.
+
+Streams of the current schedule also get an event when another schedule is
+promoted to be current, and are then closed: readers reconnect (as they do
+when a stream is closed for any other reason) and get the new one's events.
+The same event makes every process forget its cached current schedule (see
+`LocalHub.watch`).
+
+Events are fanned out by a hub, chosen by the `SCHEDULE_EVENTS_HUB` setting:
+
+- `LocalHub` delivers them to the streams served by the same process, so
+  only works when writes and streams are served by a single process.
+- `PostgresHub` sends them with NOTIFY, and each process LISTENs for them
+  and delivers them to its own streams.
+"""
+
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+from functools import cache
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.utils.module_loading import import_string
+
+from .changes import FEED_MODELS
+from .models import ScheduleChange
+
+logger = logging.getLogger(__name__)
+
+# Events a stream can fall behind by before it's sent a reset instead
+MAX_PENDING_EVENTS = 100
+# Seconds between comments that keep idle streams from being closed
+KEEPALIVE_SECONDS = 15
+# Milliseconds a reader should wait before reconnecting a closed stream
+RETRY_MILLISECONDS = 5000
+
+RESET_EVENT = {"action": ScheduleChange.RESET}
+CURRENT_MOVED_EVENT = {"action": ScheduleChange.RESET, "current_moved": True}
+
+# Key of the events for the streams of the current schedule
+CURRENT = "current"
+
+MISSING = object()
+
+
+def get_key(schedule_id) -> str:
+    return str(schedule_id)
+
+
+class Subscription:
+    """
+    The events of schedules for one stream, queued in its event loop.
+    """
+
+    def __init__(self, keys: list[str]):
+        self.keys = keys
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=MAX_PENDING_EVENTS)
+
+    def put(self, event: dict):
+        # called from the thread that committed the write
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # the loop is closed, the stream will be unsubscribed
+            pass
+
+    def _put(self, event: dict):
+        if self.queue.full():
+            # too far behind to follow event by event
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = RESET_EVENT
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float) -> dict:
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class LocalHub:
+    """
+    Fans events out to the subscriptions of this process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+        self.watchers = defaultdict(set)
+
+    def subscribe(self, keys: list[str]) -> Subscription:
+        subscription = Subscription(keys)
+        with self.lock:
+            for key in keys:
+                self.subscriptions[key].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            for key in subscription.keys:
+                self.subscriptions[key].discard(subscription)
+                if not self.subscriptions[key]:
+                    del self.subscriptions[key]
+
+    def watch(self, key: str, callback):
+        """
+        Call `callback()` in this process after every event of a key, and
+        whenever its events may have been missed.  Watching twice with the
+        same callback calls it once.
+        """
+        with self.lock:
+            self.watchers[key].add(callback)
+
+    def publish(self, key: str, event: dict):
+        transaction.on_commit(lambda: self.dispatch(key, event))
+
+    def dispatch(self, key: str, event: dict):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(key, ()))
+            watchers = list(self.watchers.get(key, ()))
+        for callback in watchers:
+            callback()
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def dispatch_all(self, event: dict):
+        with self.lock:
+            subscriptions = set().union(*self.subscriptions.values())
+            watchers = set().union(*self.watchers.values())
+        for callback in watchers:
+            callback()
+        for subscription in subscriptions:
+            subscription.put(event)
+
+
+class PostgresHub(LocalHub):
+    """
+    Fans events out to the subscriptions of every process, with Postgres
+    NOTIFY / LISTEN.  Notifications are sent when the transaction commits, and
+    a process only listens once something in it subscribes or watches.
+    """
+
+    CHANNEL = "schedule_events"
+    RECONNECT_SECONDS = 5
+
+    def __init__(self):
+        super().__init__()
+        self.listener = None
+
+    def start_listening(self):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen, daemon=True)
+                self.listener.start()
+
+    def subscribe(self, keys: list[str]) -> Subscription:
+        self.start_listening()
+        return super().subscribe(keys)
+
+    def watch(self, key: str, callback):
+        self.start_listening()
+        super().watch(key, callback)
+
+    def publish(self, key: str, event: dict):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_notify(%s, %s)",
+                [self.CHANNEL, json.dumps({"key": key, "event": event})],
+            )
+
+    def listen(self):
+        while True:
+            try:
+                self.listen_until_disconnected()
+            except Exception:
+                logger.exception("Listening for schedule events failed")
+            time.sleep(self.RECONNECT_SECONDS)
+
+    def listen_until_disconnected(self):
+        database = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            database.ensure_connection()
+            database.set_autocommit(True)
+            raw = database.connection
+            with raw.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.CHANNEL}")
+            # events sent while not listening are lost
+            self.dispatch_all(RESET_EVENT)
+
+            while True:
+                if select.select([raw], [], [], KEEPALIVE_SECONDS) == ([], [], []):
+                    continue
+                raw.poll()
+                while raw.notifies:
+                    message = json.loads(raw.notifies.pop(0).payload)
+                    self.dispatch(message["key"], message["event"])
+        finally:
+            database.close()
+
+
+@cache
+def get_hub() -> LocalHub:
+    return import_string(settings.SCHEDULE_EVENTS_HUB)()
+
+
+def publish_change(instance, action: str, schedule_id=MISSING):
+    """
+    Publish that a row of a schedule (by default, the row's) was created /
+    updated or deleted.
+    """
+    if schedule_id is MISSING:
+        schedule_id = instance.schedule_id
+    name, _ = FEED_MODELS[type(instance)]
+    get_hub().publish(
+        get_key(schedule_id),
+        {"model": name, "id": str(instance.pk), "action": action},
+    )
+
+
+def publish_reset(schedule_id):
+    """
+    Publish that a schedule changed too much to send row by row, E.G. after
+    bulk writes.
+    """
+    get_hub().publish(get_key(schedule_id), RESET_EVENT)
+
+
+def publish_current_moved():
+    """
+    Publish that another schedule was promoted to be the current one.
+    """
+    get_hub().publish(CURRENT, CURRENT_MOVED_EVENT)
+
+
+def watch_current_moved(callback):
+    """
+    Call `callback()` in this process when another schedule is promoted to be
+    the current one, or when that may have been missed.
+    """
+    get_hub().watch(CURRENT, callback)
+
+
+async def stream_events(keys: list[str]):
+    """
+    Server-sent events of schedules (an overlay's and its parent's), as a
+    stream's chunks.  The stream ends after a `CURRENT_MOVED_EVENT`.
+    """
+    hub = get_hub()
+    subscription = hub.subscribe(keys)
+    try:
+        yield f"retry: {RETRY_MILLISECONDS}\n\n"
+        while True:
+            try:
+                event = await subscription.get(KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"data: {json.dumps(event)}\n\n"
+            if event.get("current_moved"):
+                break
+    finally:
+        hub.unsubscribe(subscription)
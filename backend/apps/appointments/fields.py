@@ -0,0 +1,31 @@
+import cryptography.fernet
+from encrypted_model_fields import fields
+
+from .decrypt_cache import get_decrypt_cache
+
+
+class CachedDecryptMixin:
+    """
+    Decrypt values through the process's decrypt cache (see decrypt_cache.py)
+    instead of on every load.
+    """
+
+    def to_python(self, value):
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        if isinstance(value, str):
+            try:
+                value = get_decrypt_cache().decrypt(value)
+            except cryptography.fernet.InvalidToken:
+                # not encrypted (yet), E.G. a value assigned to an instance
+                pass
+        # skip `EncryptedMixin.to_python`, which decrypts
+        return super(fields.EncryptedMixin, self).to_python(value)
+
+
+class EncryptedCharField(CachedDecryptMixin, fields.EncryptedCharField):
+    pass
+
+
+class EncryptedTextField(CachedDecryptMixin, fields.EncryptedTextField):
+    pass
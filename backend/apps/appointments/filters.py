@@ -0,0 +1,35 @@
+from django_filters import rest_framework as filters
+
+from apps.appointments.models import Client, Technician
+
+
+class PersonFilter(filters.FilterSet):
+    """
+    Look clients and technicians up by name, through the blind indexes of
+    their encrypted names.
+    """
+
+    search = filters.CharFilter(method="search_filter", label="Search")
+    first_name = filters.CharFilter(method="first_name_filter", label="First name")
+    last_name = filters.CharFilter(method="last_name_filter", label="Last name")
+
+    def search_filter(self, queryset, name, value):
+        return queryset.search(value)
+
+    def first_name_filter(self, queryset, name, value):
+        return queryset.named(first_name=value)
+
+    def last_name_filter(self, queryset, name, value):
+        return queryset.named(last_name=value)
+
+
+class ClientFilter(PersonFilter):
+    class Meta:
+        model = Client
+        fields = ("search", "first_name", "last_name")
+
+
+class TechnicianFilter(PersonFilter):
+    class Meta:
+        model = Technician
+        fields = ("search", "first_name", "last_name")
@@ -0,0 +1,186 @@
+"""
+Min-cost flow.
+
+A small primal-dual solver: Dijkstra with potentials finds the cheapest
+augmenting path length, then a blocking flow (as in Dinic's algorithm) pushes
+as much flow as possible along every path of that length.  The number of
+Dijkstra runs is bounded by the number of distinct path costs rather than the
+amount of flow, which keeps it fast when costs take few distinct values.
+
+Edge costs may be negative as long as the initial graph has no negative
+cycle.  Flow is only pushed while it lowers the total cost, so the result is
+a minimum cost flow of any value, not a maximum flow.
+"""
+
+import heapq
+
+INFINITY = float("inf")
+
+
+class MinCostFlow:
+    def __init__(self, node_count: int = 0):
+        self.node_count = node_count
+        self.edges = [[] for _ in range(node_count)]
+        # edge arrays, edge `e ^ 1` is the reverse of edge `e`
+        self.to = []
+        self.capacity = []
+        self.cost = []
+
+    def add_node(self) -> int:
+        self.edges.append([])
+        self.node_count += 1
+        return self.node_count - 1
+
+    def add_edge(self, u: int, v: int, capacity: int, cost: int) -> int:
+        """
+        Add an edge and return its index, to read its flow afterwards.
+        """
+        e = len(self.to)
+        self.to += [v, u]
+        self.capacity += [capacity, 0]
+        self.cost += [cost, -cost]
+        self.edges[u].append(e)
+        self.edges[v].append(e + 1)
+        return e
+
+    def flow(self, e: int) -> int:
+        return self.capacity[e ^ 1]
+
+    def _initial_potentials(self, source: int) -> list:
+        """
+        Shortest distances from the source with negative costs allowed
+        (Bellman-Ford, queue based).
+        """
+        to, capacity, cost = self.to, self.capacity, self.cost
+        distance = [INFINITY] * self.node_count
+        distance[source] = 0
+        queue = [source]
+        queued = [False] * self.node_count
+        queued[source] = True
+
+        while queue:
+            next_queue = []
+            for u in queue:
+                queued[u] = False
+                for e in self.edges[u]:
+                    if capacity[e] > 0:
+                        v = to[e]
+                        d = distance[u] + cost[e]
+                        if d < distance[v]:
+                            distance[v] = d
+                            if not queued[v]:
+                                queued[v] = True
+                                next_queue.append(v)
+            queue = next_queue
+
+        return distance
+
+    def _dijkstra(self, source: int, potential: list) -> list:
+        to, capacity, cost = self.to, self.capacity, self.cost
+        distance = [INFINITY] * self.node_count
+        distance[source] = 0
+        heap = [(0, source)]
+
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > distance[u]:
+                continue
+            pu = potential[u]
+            for e in self.edges[u]:
+                if capacity[e] > 0:
+                    v = to[e]
+                    nd = d + cost[e] + pu - potential[v]
+                    if nd < distance[v]:
+                        distance[v] = nd
+                        heapq.heappush(heap, (nd, v))
+
+        return distance
+
+    def _blocking_flow(self, source: int, sink: int, potential: list) -> int:
+        """
+        Push flow along every shortest (zero reduced cost) path.
+        """
+        to, capacity, cost = self.to, self.capacity, self.cost
+
+        # Only zero reduced cost edges can be on a shortest path, and that
+        # doesn't change while pushing flow, so work on that subgraph alone
+        admissible = [
+            [e for e in edges if cost[e] + potential[u] - potential[to[e]] == 0]
+            for u, edges in enumerate(self.edges)
+        ]
+        total = 0
+
+        while True:
+            # level graph
+            level = [-1] * self.node_count
+            level[source] = 0
+            queue = [source]
+            for u in queue:
+                for e in admissible[u]:
+                    v = to[e]
+                    if level[v] < 0 and capacity[e] > 0:
+                        level[v] = level[u] + 1
+                        queue.append(v)
+            if level[sink] < 0:
+                return total
+
+            # iterative DFS with a current edge pointer per node
+            pointer = [0] * self.node_count
+            while True:
+                path = []
+                u = source
+                while u != sink:
+                    edges = admissible[u]
+                    while pointer[u] < len(edges):
+                        e = edges[pointer[u]]
+                        v = to[e]
+                        if level[v] == level[u] + 1 and capacity[e] > 0:
+                            break
+                        pointer[u] += 1
+                    else:
+                        # dead end, retreat
+                        if not path:
+                            break
+                        level[u] = -1
+                        e = path.pop()
+                        u = to[e ^ 1]
+                        pointer[u] += 1
+                        continue
+                    path.append(e)
+                    u = v
+                if u != sink:
+                    break
+
+                pushed = min(capacity[e] for e in path)
+                for e in path:
+                    capacity[e] -= pushed
+                    capacity[e ^ 1] += pushed
+                total += pushed
+
+    def solve(self, source: int, sink: int) -> tuple[int, int]:
+        """
+        Push flow from source to sink while it lowers the total cost.
+        Return the (flow, cost) pushed.
+        """
+        potential = self._initial_potentials(source)
+        potential = [0 if p == INFINITY else p for p in potential]
+        total_flow = total_cost = 0
+
+        while True:
+            distance = self._dijkstra(source, potential)
+            if distance[sink] == INFINITY:
+                break
+            for v in range(self.node_count):
+                if distance[v] < INFINITY:
+                    potential[v] += distance[v]
+
+            # cost of a unit of flow along the shortest path
+            path_cost = potential[sink] - potential[source]
+            if path_cost >= 0:
+                break
+
+            pushed = self._blocking_flow(source, sink, potential)
+            total_flow += pushed
+            total_cost += pushed * path_cost
+
+        return total_flow, total_cost
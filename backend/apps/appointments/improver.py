@@ -0,0 +1,542 @@
+"""
+Schedule improvement.
+
+`improve_schedule` takes the appointments of an existing schedule and
+improves them with a local search:
+- move: put an appointment in another block and / or with another technician
+- swap: exchange the technicians of two appointments
+- add: book another block for a client who is short of their prescribed hours
+
+Only appointments that fill exactly one `Block` on a weekday are moved, the
+others are left where they are.  Every changed or added appointment satisfies
+the same hard constraints as the auto scheduler's, and a move is only kept if
+it improves the score: fewer split blocks, fewer hours over technicians' max
+hours per day, and more clients at their prescribed hours.
+
+A move only touches a couple of clients, technicians and days, so its score
+delta is computed from those alone, which allows tens of thousands of moves
+per second.
+
+Nothing is saved: the result is a diff of the changes, for review, which
+`apply_changes` then applies.
+"""
+
+import random
+import time as timer
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from . import overlays
+from .availability_index import to_minutes
+from .models import Appointment, Schedule, resolve_schedule
+from .scheduler import (
+    FULLY_SCHEDULED_WEIGHT,
+    HOUR_WEIGHT,
+    SPLIT_BLOCK_PENALTY,
+    WEEKDAYS,
+    ScheduleProblem,
+    build_snapshot,
+    random_bit,
+)
+
+# Per hour over a technician's max hours per day
+OVERRUN_PENALTY = 80
+
+# Share of each kind of move tried
+MOVE, SWAP, ADD = "move", "swap", "add"
+MOVE_KINDS = [MOVE, MOVE, SWAP, ADD]
+
+
+class StaleChangeError(Exception):
+    """
+    The schedule changed since the changes were computed.
+    """
+
+
+def is_split(block_counts: list[int]) -> bool:
+    """
+    The split block rule of `get_appointment_warnings`, on the number of
+    appointments in each block of a day.
+    """
+    return (
+        len(block_counts) >= 3
+        and block_counts[0] > 0
+        and block_counts[-1] > 0
+        and block_counts[1] == 0
+    )
+
+
+def format_minutes(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+class ImprovementState:
+    """
+    The appointments of a schedule, with everything needed to score a change
+    locally.  Movable appointments are stored as `[client, technician, day,
+    block]` and referenced by their position; added ones are appended.
+    """
+
+    def __init__(self, problem: ScheduleProblem):
+        snapshot = problem.snapshot
+        self.problem = problem
+        block_count = problem.block_count
+
+        # slots each client is booked in, and technicians booked in each slot
+        self.client_busy = [0] * problem.client_count
+        self.technicians_busy = [0] * len(problem.slots)
+        # booked minutes, and per day the number of appointments in each block
+        self.client_minutes = [0] * problem.client_count
+        self.technician_minutes = [0] * problem.technician_count
+        self.technician_day_minutes = [[0] * 7 for _ in snapshot.technicians]
+        self.client_block_counts = [
+            [[0] * block_count for _ in WEEKDAYS] for _ in snapshot.clients
+        ]
+        self.technician_block_counts = [
+            [[0] * block_count for _ in WEEKDAYS] for _ in snapshot.technicians
+        ]
+
+        self.ids = []
+        self.appointments = []
+        blocks = {(block.start, block.end): b for b, block in enumerate(problem.blocks)}
+        movable = []
+        for appointment in snapshot.appointments:
+            block = blocks.get((appointment.start, appointment.end))
+            if appointment.day in WEEKDAYS and block is not None:
+                movable.append((appointment, block))
+            else:
+                self.book_fixed(appointment)
+        for appointment, block in movable:
+            c, t, day = appointment.client, appointment.technician, appointment.day
+            slot = problem.slot_index(day, block)
+            # leave double bookings alone
+            if self.client_busy[c] >> slot & 1 or self.technicians_busy[slot] >> t & 1:
+                self.book_fixed(appointment)
+                continue
+            self.book(c, t, day, block)
+            self.ids.append(appointment.id)
+            self.appointments.append([c, t, day, block])
+
+        self.original = [tuple(appointment) for appointment in self.appointments]
+        # Appointments only move to slots where their client had nothing
+        # booked, so the changes can be saved in any order without breaking
+        # the unique (client, day, start time) constraint.
+        self.client_original_busy = list(self.client_busy)
+
+    def book_fixed(self, appointment):
+        problem = self.problem
+        c, t, day = appointment.client, appointment.technician, appointment.day
+        minutes = appointment.end - appointment.start
+
+        self.client_minutes[c] += minutes
+        self.technician_minutes[t] += minutes
+        self.technician_day_minutes[t][day] += minutes
+        if day in WEEKDAYS:
+            for block in problem.overlapping_blocks(appointment.start, appointment.end):
+                slot = problem.slot_index(day, block)
+                self.client_busy[c] |= 1 << slot
+                self.technicians_busy[slot] |= 1 << t
+            block = problem.containing_block(appointment.start, appointment.end)
+            if block is not None:
+                self.client_block_counts[c][day][block] += 1
+                self.technician_block_counts[t][day][block] += 1
+
+    def book(self, c: int, t: int, day: int, block: int, sign: int = 1):
+        """
+        Book (or with `sign=-1` unbook) an appointment that fills a block.
+        """
+        slot = self.problem.slot_index(day, block)
+        minutes = sign * self.problem.block_minutes(block)
+
+        self.client_busy[c] ^= 1 << slot
+        self.technicians_busy[slot] ^= 1 << t
+        self.client_minutes[c] += minutes
+        self.technician_minutes[t] += minutes
+        self.technician_day_minutes[t][day] += minutes
+        self.client_block_counts[c][day][block] += sign
+        self.technician_block_counts[t][day][block] += sign
+
+    def can_book(self, c: int, t: int, day: int, block: int, limits: dict) -> bool:
+        """
+        Whether an appointment can be booked without breaking a hard
+        constraint.  Hours may not exceed the larger of the limit and what
+        they were before the change, as given in `limits`.
+        """
+        problem = self.problem
+        slot = problem.slot_index(day, block)
+        minutes = problem.block_minutes(block)
+        if not (
+            problem.eligible[c] >> t & 1
+            and problem.client_available[c] >> slot & 1
+            and problem.technicians_available[slot] >> t & 1
+            and not self.client_busy[c] >> slot & 1
+            and not self.technicians_busy[slot] >> t & 1
+        ):
+            return False
+
+        client = problem.snapshot.clients[c]
+        tech = problem.snapshot.technicians[t]
+        return (
+            self.fits(
+                self.client_minutes[c] + minutes,
+                client.prescribed_minutes,
+                limits["client", c],
+            )
+            and self.fits(
+                self.technician_minutes[t] + minutes,
+                tech.requested_minutes,
+                limits["technician", t],
+            )
+            and self.fits(
+                self.technician_day_minutes[t][day] + minutes,
+                tech.max_minutes_per_day,
+                limits["day", t, day],
+            )
+        )
+
+    @staticmethod
+    def fits(minutes: int, limit: int, before: int) -> bool:
+        # a negative limit means there is none
+        return limit < 0 or minutes <= max(limit, before)
+
+    def client_score(self, c: int) -> float:
+        prescribed = self.problem.snapshot.clients[c].prescribed_minutes
+        minutes = self.client_minutes[c]
+        if prescribed < 0:
+            return HOUR_WEIGHT * minutes / 60
+        return HOUR_WEIGHT * min(minutes, prescribed) / 60 + FULLY_SCHEDULED_WEIGHT * (
+            prescribed > 0 and minutes >= prescribed
+        )
+
+    def client_day_score(self, c: int, day: int) -> float:
+        return -SPLIT_BLOCK_PENALTY * is_split(self.client_block_counts[c][day])
+
+    def technician_day_score(self, t: int, day: int) -> float:
+        max_minutes = self.problem.snapshot.technicians[t].max_minutes_per_day
+        overrun = 0
+        if max_minutes >= 0:
+            overrun = max(0, self.technician_day_minutes[t][day] - max_minutes)
+        split = day in WEEKDAYS and is_split(self.technician_block_counts[t][day])
+        return -SPLIT_BLOCK_PENALTY * split - OVERRUN_PENALTY * overrun / 60
+
+    def local_score(self, clients, client_days, technician_days) -> float:
+        return (
+            sum(self.client_score(c) for c in clients)
+            + sum(self.client_day_score(c, day) for c, day in client_days)
+            + sum(self.technician_day_score(t, day) for t, day in technician_days)
+        )
+
+    def score(self) -> float:
+        problem = self.problem
+        return self.local_score(
+            range(problem.client_count),
+            [(c, day) for c in range(problem.client_count) for day in WEEKDAYS],
+            [(t, day) for t in range(problem.technician_count) for day in range(7)],
+        )
+
+    def try_change(self, changes: list[tuple[int | None, tuple]]) -> float | None:
+        """
+        Apply a change if it's feasible and improves the score, and return the
+        score delta.  `changes` holds `(position, appointment)` pairs, with
+        position None for an appointment to add.
+        """
+        old = [self.appointments[i] for i, _ in changes if i is not None]
+        new = [appointment for _, appointment in changes]
+
+        clients = {c for c, _, _, _ in old + new}
+        client_days = {(c, day) for c, _, day, _ in old + new}
+        technician_days = {(t, day) for _, t, day, _ in old + new}
+        limits = {("client", c): self.client_minutes[c] for c in clients}
+        for t, day in technician_days:
+            limits["technician", t] = self.technician_minutes[t]
+            limits["day", t, day] = self.technician_day_minutes[t][day]
+
+        before = self.local_score(clients, client_days, technician_days)
+        for appointment in old:
+            self.book(*appointment, sign=-1)
+
+        booked = []
+        for i, appointment in changes:
+            c, _, day, block = appointment
+            slot = 1 << self.problem.slot_index(day, block)
+            reserved = self.client_original_busy[c] & ~self.original_slot(i)
+            if slot & reserved or not self.can_book(*appointment, limits):
+                break
+            self.book(*appointment)
+            booked.append(appointment)
+        else:
+            delta = self.local_score(clients, client_days, technician_days) - before
+            if delta > 0:
+                for i, appointment in changes:
+                    if i is None:
+                        self.ids.append(None)
+                        self.appointments.append(list(appointment))
+                    else:
+                        self.appointments[i] = list(appointment)
+                return delta
+
+        # revert
+        for appointment in booked:
+            self.book(*appointment, sign=-1)
+        for appointment in old:
+            self.book(*appointment)
+        return None
+
+    def original_slot(self, i: int | None) -> int:
+        """
+        A bitmap of the slot an appointment was originally in, if any.
+        """
+        if i is None or i >= len(self.original):
+            return 0
+        _, _, day, block = self.original[i]
+        return 1 << self.problem.slot_index(day, block)
+
+    def random_change(self, rng: random.Random) -> list[tuple[int | None, tuple]]:
+        """
+        Pick a random move, swap or add.  Return an empty list if there is
+        nothing to try.
+        """
+        problem = self.problem
+        kind = rng.choice(MOVE_KINDS)
+
+        if kind == SWAP and len(self.appointments) > 1:
+            i, j = rng.sample(range(len(self.appointments)), 2)
+            ci, ti, day_i, block_i = self.appointments[i]
+            cj, tj, day_j, block_j = self.appointments[j]
+            if ti == tj:
+                return []
+            return [(i, (ci, tj, day_i, block_i)), (j, (cj, ti, day_j, block_j))]
+
+        if kind == ADD or not self.appointments:
+            if not problem.client_count:
+                return []
+            i = None
+            c = rng.randrange(problem.client_count)
+            slots = problem.client_available[c] & ~self.client_busy[c]
+            slots &= ~self.client_original_busy[c]
+        else:
+            i = rng.randrange(len(self.appointments))
+            c, _, day, block = self.appointments[i]
+            # a free slot, or the same one with another technician
+            slots = problem.client_available[c] & ~self.client_busy[c]
+            slots &= ~self.client_original_busy[c] | self.original_slot(i)
+            slots |= 1 << problem.slot_index(day, block)
+
+        if not slots:
+            return []
+        slot = random_bit(slots, rng)
+        technicians = (
+            problem.eligible[c]
+            & problem.technicians_available[slot]
+            & ~self.technicians_busy[slot]
+        )
+        if not technicians:
+            return []
+        day, block = problem.slots[slot]
+        return [(i, (c, random_bit(technicians, rng), day, block))]
+
+    def metrics(self) -> dict:
+        problem = self.problem
+        snapshot = problem.snapshot
+        split_blocks = sum(
+            is_split(block_counts)
+            for by_day in self.client_block_counts + self.technician_block_counts
+            for block_counts in by_day
+        )
+        overrun_minutes = sum(
+            max(0, minutes - tech.max_minutes_per_day)
+            for tech, by_day in zip(snapshot.technicians, self.technician_day_minutes)
+            if tech.max_minutes_per_day >= 0
+            for minutes in by_day
+        )
+        at_prescribed_hours = sum(
+            1
+            for client, minutes in zip(snapshot.clients, self.client_minutes)
+            if client.prescribed_minutes > 0 and minutes >= client.prescribed_minutes
+        )
+        return {
+            "split_blocks": split_blocks,
+            "max_hours_per_day_overrun": overrun_minutes / 60,
+            "clients_at_prescribed_hours": at_prescribed_hours,
+            "hours": sum(self.client_minutes) / 60,
+        }
+
+
+def local_search(
+    state: ImprovementState,
+    time_budget: float,
+    seed: int | None = None,
+    max_moves: int | None = None,
+) -> tuple[int, int]:
+    """
+    Try random changes on the state for the time budget (in seconds), keeping
+    those that improve the score.  Return the number of changes tried and
+    kept.
+    """
+    rng = random.Random(seed)
+    deadline = timer.monotonic() + time_budget
+    tried = kept = 0
+
+    while max_moves is None or tried < max_moves:
+        # checking the clock is slower than a move
+        if tried % 256 == 0 and timer.monotonic() > deadline:
+            break
+        tried += 1
+        changes = state.random_change(rng)
+        if changes and state.try_change(changes) is not None:
+            kept += 1
+
+    return tried, kept
+
+
+def get_changes(state: ImprovementState) -> list[dict]:
+    """
+    The diff between the original and the improved appointments.
+    """
+    snapshot = state.problem.snapshot
+    blocks = state.problem.blocks
+
+    def describe(appointment):
+        c, t, day, block = appointment
+        return {
+            "technician_id": snapshot.technicians[t].id,
+            "day": day,
+            "start_time": format_minutes(blocks[block].start),
+            "end_time": format_minutes(blocks[block].end),
+        }
+
+    changes = []
+    for i, appointment in enumerate(state.appointments):
+        if i < len(state.original) and tuple(appointment) == state.original[i]:
+            continue
+        c = appointment[0]
+        changes.append(
+            {
+                "action": "update" if state.ids[i] else "create",
+                "appointment_id": state.ids[i],
+                "client_id": snapshot.clients[c].id,
+                "before": (
+                    describe(state.original[i]) if i < len(state.original) else None
+                ),
+                "after": describe(appointment),
+            }
+        )
+    return changes
+
+
+def improve_schedule(
+    schedule: Schedule | None,
+    time_budget: float = 5,
+    seed: int | None = None,
+    max_moves: int | None = None,
+) -> dict:
+    """
+    Look for improvements to a schedule's appointments and return them as a
+    diff, with the score and metrics before and after.  Nothing is saved.
+    """
+    started = timer.monotonic()
+    problem = ScheduleProblem(build_snapshot(schedule))
+    state = ImprovementState(problem)
+
+    score_before = state.score()
+    metrics_before = state.metrics()
+    tried, kept = local_search(state, time_budget, seed, max_moves)
+
+    return {
+        "changes": get_changes(state),
+        "score_before": round(score_before, 2),
+        "score_after": round(state.score(), 2),
+        "metrics_before": metrics_before,
+        "metrics_after": state.metrics(),
+        "moves_tried": tried,
+        "moves_kept": kept,
+        "elapsed": round(timer.monotonic() - started, 2),
+    }
+
+
+def apply_changes(schedule: Schedule | None, changes: list[dict]) -> dict:
+    """
+    Save a diff from `improve_schedule`, all or nothing.
+
+    Each updated appointment must still be as described in its "before", and
+    no saved appointment may overlap another of its client or technician,
+    otherwise `StaleChangeError` is raised.  The changes depend on each other
+    (a swap is two updates), so review them as a whole.
+    """
+    schedule = resolve_schedule(schedule)
+    updated = created = 0
+    saved = []
+
+    with transaction.atomic():
+        for change in changes:
+            after = change["after"]
+
+            if change["action"] == "create":
+                try:
+                    with transaction.atomic():
+                        appointment = Appointment.objects.create(
+                            client_id=change["client_id"],
+                            schedule=schedule,
+                            **after,
+                        )
+                except IntegrityError:
+                    raise StaleChangeError(
+                        f"Client {change['client_id']} was booked at "
+                        f"{after['start_time']} on day {after['day']} since the "
+                        "improvements were computed."
+                    )
+                saved.append(appointment)
+                created += 1
+                continue
+
+            appointment = (
+                Appointment.objects.select_for_update()
+                .in_schedule(schedule)
+                .filter(id=change["appointment_id"])
+                .first()
+            )
+            before = change["before"]
+            if (
+                appointment is None
+                or str(appointment.client_id) != str(change["client_id"])
+                or str(appointment.technician_id) != str(before["technician_id"])
+                or appointment.day != before["day"]
+                or to_minutes(appointment.start_time)
+                != to_minutes(before["start_time"])
+                or to_minutes(appointment.end_time) != to_minutes(before["end_time"])
+            ):
+                raise StaleChangeError(
+                    f"Appointment {change['appointment_id']} has changed since "
+                    "the improvements were computed."
+                )
+
+            appointment = overlays.copy_on_write(schedule, appointment)
+            appointment.technician_id = after["technician_id"]
+            appointment.day = after["day"]
+            appointment.start_time = after["start_time"]
+            appointment.end_time = after["end_time"]
+            appointment.save()
+            saved.append(appointment)
+            updated += 1
+
+        # only checked once all the changes are saved, since a swap overlaps
+        # half way through
+        for appointment in saved:
+            if (
+                Appointment.objects.in_schedule(schedule)
+                .filter(day=appointment.day)
+                .filter(
+                    Q(client_id=appointment.client_id)
+                    | Q(technician_id=appointment.technician_id)
+                )
+                .exclude(pk=appointment.pk)
+                .overlapping(appointment.start_minute, appointment.end_minute)
+                .exists()
+            ):
+                raise StaleChangeError(
+                    f"Appointment {appointment.pk} overlaps an appointment "
+                    "booked since the improvements were computed."
+                )
+
+    return {"updated": updated, "created": created}
@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.appointments.models import Schedule
+from apps.appointments.scheduler import GREEDY, MODES, auto_schedule
+
+
+class Command(BaseCommand):
+    help = "Automatically fill a sandbox schedule with appointments."
+
+    def add_arguments(self, parser):
+        parser.add_argument("schedule_id", help="ID of the sandbox schedule to fill")
+        parser.add_argument(
+            "--time-budget",
+            type=float,
+            default=60,
+            help="Seconds to spend searching for a better schedule (default: 60)",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=None,
+            help="Random seed, for reproducible results",
+        )
+        parser.add_argument(
+            "--mode",
+            choices=MODES,
+            default=GREEDY,
+            help="greedy: randomized restarts until the time budget is used up; "
+            "flow: min-cost flow assignments, block by block (default: greedy)",
+        )
+
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Processes to spread greedy restarts over "
+            "(default: the AUTO_SCHEDULE_WORKERS setting)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            schedule = Schedule.objects.get(id=options["schedule_id"])
+        except (Schedule.DoesNotExist, ValueError):
+            raise CommandError(f"Schedule {options['schedule_id']} not found.")
+
+        best_score = None
+
+        def progress(status):
+            # report every run when verbose, otherwise only improvements
+            nonlocal best_score
+            if options["verbosity"] > 1 or (
+                options["verbosity"] > 0 and status["best_score"] != best_score
+            ):
+                self.stdout.write(
+                    "Run {runs} ({elapsed}s): score {score}, best {best_score}".format(
+                        **status
+                    )
+                )
+            best_score = status["best_score"]
+
+        self.stdout.write(
+            f"Filling '{schedule.name}' for up to {options['time_budget']}s..."
+        )
+        result = auto_schedule(
+            schedule,
+            time_budget=options["time_budget"],
+            seed=options["seed"],
+            progress=progress,
+            mode=options["mode"],
+            workers=options["workers"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Created {created} appointments ({hours:.2f} hours), "
+                "score {score} after {runs} runs in {elapsed}s.".format(**result)
+            )
+        )
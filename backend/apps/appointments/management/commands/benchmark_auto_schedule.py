@@ -0,0 +1,137 @@
+import os
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.appointments.scheduler import (
+    ScheduleSnapshot,
+    SnapshotAvailability,
+    SnapshotBlock,
+    SnapshotClient,
+    SnapshotTechnician,
+    solve,
+)
+
+
+def random_snapshot(
+    client_count: int, technician_count: int, seed: int
+) -> ScheduleSnapshot:
+    """
+    A synthetic snapshot with three 3 hour blocks a day and clients /
+    technicians available for about 10 / 12 of the 15 weekly blocks.
+    """
+    rng = random.Random(seed)
+    blocks = [
+        SnapshotBlock(9 * 60, 12 * 60),
+        SnapshotBlock(12 * 60 + 30, 15 * 60 + 30),
+        SnapshotBlock(16 * 60, 19 * 60),
+    ]
+
+    def availabilities(count):
+        slots = rng.sample(
+            [(day, block) for day in range(5) for block in blocks], count
+        )
+        return [
+            SnapshotAvailability(day, block.start, block.end, rng.random() < 0.1)
+            for day, block in slots
+        ]
+
+    technicians = [
+        SnapshotTechnician(
+            id=str(t),
+            skill_level=rng.randint(1, 3),
+            spanish_speaking=rng.random() < 0.25,
+            requested_minutes=rng.randint(20, 40) * 60,
+            max_minutes_per_day=rng.randint(3, 9) * 60,
+            is_manually_maxed_out=False,
+        )
+        for t in range(technician_count)
+    ]
+    clients = [
+        SnapshotClient(
+            id=str(c),
+            req_skill_level=rng.randint(1, 3),
+            req_spanish_speaking=rng.random() < 0.1,
+            prescribed_minutes=rng.randint(8, 40) * 60,
+            is_manually_maxed_out=False,
+            past_technicians=frozenset(
+                rng.sample(range(technician_count), min(3, technician_count))
+            ),
+        )
+        for c in range(client_count)
+    ]
+
+    return ScheduleSnapshot(
+        schedule_id="benchmark",
+        blocks=blocks,
+        technicians=technicians,
+        clients=clients,
+        technician_availabilities=[availabilities(12) for _ in technicians],
+        client_availabilities=[availabilities(10) for _ in clients],
+        appointments=[],
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the auto scheduler's parallel restarts on a synthetic "
+        "schedule: how many greedy runs fit in the time budget per worker count."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=400)
+        parser.add_argument("--technicians", type=int, default=160)
+        parser.add_argument(
+            "--time-budget",
+            type=float,
+            default=10,
+            help="Seconds per worker count (default: 10)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            nargs="+",
+            default=None,
+            help="Worker counts to compare "
+            "(default: powers of two up to the number of CPUs)",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        if workers is None:
+            cpu_count = os.cpu_count() or 1
+            workers = [2**i for i in range(cpu_count.bit_length())]
+            if workers[-1] != cpu_count:
+                workers.append(cpu_count)
+        if min(workers) < 1:
+            raise CommandError("Worker counts must be at least 1.")
+
+        snapshot = random_snapshot(
+            options["clients"], options["technicians"], options["seed"]
+        )
+        self.stdout.write(
+            f"{options['clients']} clients, {options['technicians']} technicians, "
+            f"{options['time_budget']}s per worker count, {os.cpu_count()} CPUs"
+        )
+        self.stdout.write(
+            f"{'workers':>8} {'runs':>8} {'runs/s':>8} {'speedup':>8} {'score':>10}"
+        )
+
+        baseline = None
+        for count in workers:
+            status = {}
+            solution = solve(
+                snapshot,
+                time_budget=options["time_budget"],
+                seed=options["seed"],
+                progress=status.update,
+                workers=count,
+            )
+            rate = status["runs"] / status["elapsed"]
+            if baseline is None:
+                baseline = rate
+            self.stdout.write(
+                f"{count:>8} {status['runs']:>8} {rate:>8.2f} "
+                f"{rate / baseline:>7.2f}x {solution.score:>10.0f}"
+            )
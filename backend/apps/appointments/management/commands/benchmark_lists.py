@@ -0,0 +1,131 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from apps.appointments.management.commands.explain_queries import create_dataset
+from apps.appointments.models import Client, Technician
+from apps.appointments.serializers import ClientSerializer, TechnicianSerializer
+from apps.appointments.values_lists import ValuesList
+
+# Name, queryset (as the viewset's) and serializer of each list
+LISTS = [
+    ("clients", Client.objects.prefetch_related("past_technicians"), ClientSerializer),
+    ("technicians", Technician.objects.all(), TechnicianSerializer),
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+def get_context(schedule, params: dict) -> dict:
+    django_request = APIRequestFactory().get("/", params)
+    django_request.schedule = schedule
+    return {"request": Request(django_request)}
+
+
+def render_serializer(serializer_class, queryset, context) -> bytes:
+    # a fresh queryset, not the results of the previous run
+    data = serializer_class(queryset.all(), many=True, context=context).data
+    return JSONRenderer().render(data)
+
+
+def render_values(serializer_class, queryset, context) -> bytes:
+    values_list = ValuesList(serializer_class, context)
+    rows = list(values_list.get_queryset(queryset))
+    return JSONRenderer().render(values_list.represent(rows))
+
+
+def best_time(render, repeat: int) -> tuple[float, bytes]:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        content = render()
+        best = min(best, time.perf_counter() - start)
+    return best, content
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the client and technician list representations built by "
+        "their serializers and from `.values()` rows (see values_lists.py), "
+        "which must be byte-identical, on a synthetic dataset.  The dataset "
+        "is created in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--clients",
+            type=int,
+            default=1000,
+            help="Number of synthetic clients (default: 1000)",
+        )
+        parser.add_argument(
+            "--technicians",
+            type=int,
+            default=400,
+            help="Number of synthetic technicians (default: 400)",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Runs per path, of which the best is shown (default: 5)",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1:
+            raise CommandError("Repeat must be at least 1.")
+
+        try:
+            with transaction.atomic():
+                self.benchmark(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def benchmark(self, options):
+        (schedule,) = create_dataset(
+            options["clients"], options["technicians"], 0, options["seed"]
+        )
+        Through = Client.past_technicians.through
+        Through.objects.bulk_create(
+            Through(client_id=client_id, technician_id=technician_id)
+            for client_id in Client.objects.values_list("pk", flat=True)
+            for technician_id in Technician.objects.values_list("pk", flat=True)[:3]
+        )
+
+        self.stdout.write(
+            f"{'list':<20} {'rows':>6} {'serializers':>12} {'values':>10} "
+            f"{'speedup':>8}"
+        )
+        for params in [{}, {"expand_properties": "true"}]:
+            for name, queryset, serializer_class in LISTS:
+                context = get_context(schedule, params)
+                if params:
+                    queryset = queryset.with_hours(schedule)
+                    name = f"{name} + hours"
+
+                serializer_time, expected = best_time(
+                    lambda: render_serializer(serializer_class, queryset, context),
+                    options["repeat"],
+                )
+                values_time, content = best_time(
+                    lambda: render_values(serializer_class, queryset, context),
+                    options["repeat"],
+                )
+                if content != expected:
+                    raise CommandError(
+                        f"The {name} list differs between the two paths."
+                    )
+                self.stdout.write(
+                    f"{name:<20} {queryset.count():>6} "
+                    f"{serializer_time * 1000:>10.1f}ms "
+                    f"{values_time * 1000:>8.1f}ms "
+                    f"{serializer_time / values_time:>7.2f}x"
+                )
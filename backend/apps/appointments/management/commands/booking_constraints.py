@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from apps.appointments.models import Appointment
+
+# Constraint name -> column that can't be booked twice at the same time
+CONSTRAINTS = {
+    "appointment_technician_no_overlap": "technician_id",
+    "appointment_client_no_overlap": "client_id",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Add Postgres exclusion constraints that make double booking a "
+        "technician or client impossible, or remove them with --drop.  "
+        "Existing double bookings are listed, and have to be fixed first.  "
+        "The constraints are checked on commit, so a transaction can swap "
+        "appointments."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--drop",
+            action="store_true",
+            help="Remove the constraints",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Exclusion constraints need Postgres.")
+
+        table = Appointment._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            for name, column in CONSTRAINTS.items():
+                cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}")
+                if options["drop"]:
+                    continue
+
+                cursor.execute(f"""
+                    SELECT a.id, b.id FROM {table} a JOIN {table} b
+                    ON a.{column} = b.{column}
+                    AND a.schedule_id = b.schedule_id
+                    AND a.day = b.day
+                    AND a.id < b.id
+                    AND int4range(a.start_minute, a.end_minute)
+                        && int4range(b.start_minute, b.end_minute)
+                    """)
+                conflicts = cursor.fetchall()
+                for first_id, second_id in conflicts:
+                    self.stderr.write(f"{first_id} overlaps {second_id}")
+                if conflicts:
+                    raise CommandError(
+                        f"{len(conflicts)} double bookings ({column}) "
+                        "have to be fixed first."
+                    )
+
+                cursor.execute(f"""
+                    ALTER TABLE {table} ADD CONSTRAINT {name} EXCLUDE USING gist (
+                        schedule_id WITH =,
+                        {column} WITH =,
+                        day WITH =,
+                        int4range(start_minute, end_minute) WITH &&
+                    ) DEFERRABLE INITIALLY DEFERRED
+                    """)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Booking constraints removed."
+                if options["drop"]
+                else "Booking constraints added."
+            )
+        )
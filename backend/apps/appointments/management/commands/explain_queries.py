@@ -0,0 +1,227 @@
+import random
+import re
+from datetime import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+
+from apps.appointments.models import (
+    Appointment,
+    Availability,
+    Client,
+    Schedule,
+    Technician,
+    TherapyAppointment,
+    get_current_schedule,
+)
+
+# Start and end times of the synthetic dataset's blocks
+BLOCKS = [
+    (time(9), time(12)),
+    (time(12, 30), time(15, 30)),
+    (time(16), time(19)),
+]
+
+
+def create_dataset(
+    client_count: int, technician_count: int, schedule_count: int, seed: int
+) -> list[Schedule]:
+    """
+    Fill the current schedule and `schedule_count` new sandboxes, with clients /
+    technicians available for about 10 / 12 of the 15 weekly blocks, and
+    every technician booked in every block.  Returns the schedules.
+    """
+    rng = random.Random(seed)
+    slots = [(day, block) for day in range(5) for block in BLOCKS]
+    schedules = [get_current_schedule()] + [
+        Schedule.objects.create(name=f"Explain {i}") for i in range(schedule_count)
+    ]
+    technicians = Technician.objects.bulk_create(
+        Technician(
+            first_name="Technician",
+            last_name=str(t),
+            skill_level=rng.randint(1, 3),
+        )
+        for t in range(technician_count)
+    )
+    clients = Client.objects.bulk_create(
+        Client(first_name="Client", last_name=str(c), prescribed_hours=20)
+        for c in range(client_count)
+    )
+    technician_type = ContentType.objects.get_for_model(Technician)
+    client_type = ContentType.objects.get_for_model(Client)
+
+    for schedule in schedules:
+        availabilities = []
+        for content_type, people, count in [
+            (technician_type, technicians, 12),
+            (client_type, clients, 10),
+        ]:
+            for person in people:
+                for day, (start_time, end_time) in rng.sample(slots, count):
+                    availabilities.append(
+                        Availability(
+                            content_type=content_type,
+                            object_id=person.pk,
+                            day=day,
+                            start_time=start_time,
+                            end_time=end_time,
+                            is_sub=rng.random() < 0.1,
+                            schedule=schedule,
+                        )
+                    )
+        Availability.objects.bulk_create(availabilities)
+
+        # one appointment per technician and block, so nobody is double booked
+        appointments = []
+        for day, (start_time, end_time) in slots:
+            booked = rng.sample(clients, min(len(clients), len(technicians)))
+            for client, technician in zip(booked, technicians):
+                appointments.append(
+                    Appointment(
+                        client=client,
+                        technician=technician,
+                        day=day,
+                        start_time=start_time,
+                        end_time=end_time,
+                        schedule=schedule,
+                    )
+                )
+        Appointment.objects.bulk_create(appointments)
+
+        TherapyAppointment.objects.bulk_create(
+            TherapyAppointment(
+                client=client,
+                day=rng.randrange(5),
+                start_time=time(8),
+                end_time=time(9),
+                schedule=schedule,
+            )
+            for client in clients
+        )
+
+    return schedules
+
+
+def get_queries(schedule: Schedule) -> dict:
+    """
+    The querysets of the hot read paths, as they filter a schedule.
+    """
+    # people booked in the schedule, which other data may not be
+    appointment = (
+        Appointment.objects.filter(schedule=schedule)
+        .select_related("client", "technician")
+        .order_by("pk")
+        .first()
+    )
+    client, technician = appointment.client, appointment.technician
+    return {
+        # availability_index.AvailabilityIndex.build, the snapshot and the
+        # list endpoints
+        "schedule availabilities": Availability.objects.filter(schedule=schedule),
+        "schedule appointments": Appointment.objects.filter(schedule=schedule),
+        # ClientSerializer / TechnicianSerializer
+        "client availabilities": client.availabilities.filter(schedule=schedule),
+        "client appointments": client.appointments.filter(schedule=schedule),
+        "client therapy appointments": client.therapy_appointments.filter(
+            schedule=schedule
+        ),
+        "technician availabilities": technician.availabilities.filter(
+            schedule=schedule
+        ),
+        "technician appointments": technician.appointments.filter(schedule=schedule),
+        # HoursMixin.minutes_by_day
+        "technician minutes by day": technician.appointments.filter(schedule=schedule)
+        .order_by()
+        .values("day")
+        .annotate(total=Sum("duration_minutes")),
+        # HoursQuerySet.with_hours, for the list endpoints
+        "technicians with hours": Technician.objects.with_hours(schedule),
+        # improver.apply_changes
+        "overlapping appointments": Appointment.objects.filter(
+            schedule=schedule, day=appointment.day
+        )
+        .filter(
+            Q(client_id=appointment.client_id)
+            | Q(technician_id=appointment.technician_id)
+        )
+        .exclude(pk=appointment.pk)
+        .overlapping(appointment.start_minute, appointment.end_minute),
+    }
+
+
+def is_sequential_scan(plan: str) -> bool:
+    # Postgres says "Seq Scan", SQLite "SCAN <table>" without an index
+    return "Seq Scan" in plan or bool(re.search(r"\bSCAN \w+$", plan, re.MULTILINE))
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the hot read queries against a synthetic dataset, to check "
+        "which indexes they use.  The dataset is created in a transaction "
+        "that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--clients",
+            type=int,
+            default=600,
+            help="Number of synthetic clients (default: 600)",
+        )
+        parser.add_argument(
+            "--technicians",
+            type=int,
+            default=200,
+            help="Number of synthetic technicians (default: 200)",
+        )
+        parser.add_argument(
+            "--schedules",
+            type=int,
+            default=3,
+            help="Number of sandbox schedules besides the current one (default: 3)",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Random seed (default: 0)",
+        )
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="Run the queries and show their actual timings (Postgres only)",
+        )
+
+    def handle(self, *args, **options):
+        explain_options = {}
+        if options["analyze"] and connection.vendor == "postgresql":
+            explain_options = {"analyze": True, "buffers": True}
+
+        with transaction.atomic():
+            schedules = create_dataset(
+                options["clients"],
+                options["technicians"],
+                options["schedules"],
+                options["seed"],
+            )
+            with connection.cursor() as cursor:
+                # so the planner knows how the rows are distributed
+                cursor.execute("ANALYZE")
+
+            # the current schedule and a sandbox
+            for schedule in schedules[:2]:
+                self.stdout.write(self.style.MIGRATE_HEADING(schedule.name))
+                for query, queryset in get_queries(schedule).items():
+                    plan = queryset.explain(**explain_options)
+                    if is_sequential_scan(plan):
+                        outcome = self.style.WARNING("sequential scan")
+                    else:
+                        outcome = self.style.SUCCESS("indexed")
+                    self.stdout.write(f"{query}: {outcome}")
+                    self.stdout.write(plan)
+                    self.stdout.write("")
+
+            transaction.set_rollback(True)
@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.appointments.improver import apply_changes, improve_schedule
+from apps.appointments.models import Schedule
+
+
+class Command(BaseCommand):
+    help = (
+        "Look for improvements to a schedule's appointments and print them. "
+        "Nothing is saved unless --apply is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "schedule_id",
+            nargs="?",
+            default=None,
+            help="ID of the schedule to improve (default: the current schedule)",
+        )
+        parser.add_argument(
+            "--time-budget",
+            type=float,
+            default=10,
+            help="Seconds to spend looking for improvements (default: 10)",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=None,
+            help="Random seed, for reproducible results",
+        )
+        parser.add_argument(
+            "--apply",
+            action="store_true",
+            help="Save the changes",
+        )
+
+    def handle(self, *args, **options):
+        schedule = None
+        if options["schedule_id"]:
+            try:
+                schedule = Schedule.objects.get(id=options["schedule_id"])
+            except (Schedule.DoesNotExist, ValueError):
+                raise CommandError(f"Schedule {options['schedule_id']} not found.")
+
+        result = improve_schedule(
+            schedule, time_budget=options["time_budget"], seed=options["seed"]
+        )
+
+        for change in result["changes"]:
+            after = "{technician_id} D{day} {start_time} - {end_time}".format(
+                **change["after"]
+            )
+            if change["action"] == "create":
+                self.stdout.write(f"+ {change['client_id']}: {after}")
+            else:
+                before = "{technician_id} D{day} {start_time} - {end_time}".format(
+                    **change["before"]
+                )
+                self.stdout.write(f"~ {change['client_id']}: {before} -> {after}")
+
+        before, after = result["metrics_before"], result["metrics_after"]
+        for metric in before:
+            self.stdout.write(f"{metric}: {before[metric]} -> {after[metric]}")
+        self.stdout.write(
+            "Score {score_before} -> {score_after}, {moves_kept} of {moves_tried} "
+            "moves kept in {elapsed}s.".format(**result)
+        )
+
+        if options["apply"]:
+            saved = apply_changes(schedule, result["changes"])
+            self.stdout.write(
+                self.style.SUCCESS(
+                    "Updated {updated} and created {created} appointments.".format(
+                        **saved
+                    )
+                )
+            )
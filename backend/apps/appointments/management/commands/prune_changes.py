@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.appointments.changes import prune_changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the schedule change feed entries older than the retention "
+        "window.  Readers with an older cursor reload the schedule."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.SCHEDULE_CHANGE_RETENTION_DAYS,
+            help="Days of changes to keep "
+            "(default: SCHEDULE_CHANGE_RETENTION_DAYS, currently %(default)s)",
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_changes(timedelta(days=options["days"]))
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} changes."))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from apps.appointments.blind_index import reindex
+from apps.appointments.models import Client, Technician
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the blind indexes and name order of clients and "
+        "technicians, E.G. after changing BLIND_INDEX_KEY."
+    )
+
+    def handle(self, *args, **options):
+        for model in [Client, Technician]:
+            reindex(model)
+            self.stdout.write(
+                f"{model._meta.verbose_name_plural}: {model.objects.count()}"
+            )
+        self.stdout.write(self.style.SUCCESS("Names reindexed."))
@@ -1,8 +1,91 @@
-from datetime import datetime
+from datetime import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Exists, F, OuterRef, Q, QuerySet, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .availability_index import (
+    AvailabilityIndex,
+    get_built_index,
+    get_index,
+    slot_mask,
+    to_time,
+)
+from .models import (
+    Appointment,
+    Availability,
+    Block,
+    Client,
+    Schedule,
+    Technician,
+    resolve_schedule,
+)
+from .utils import get_difference_in_minutes, get_minute_of_day
+
+
+def get_available_technicians_query(
+    client: Client,
+    day: int,
+    start_time: str | time,
+    end_time: str | time,
+    schedule: Schedule | None = None,
+) -> tuple[QuerySet, Q]:
+    """
+    The technicians annotated with their booked minutes for the week, and the
+    condition `AvailabilityIndex.find_available_technicians` checks, as SQL:
+    weekly hours are an aggregate subquery, and availability / overlapping
+    appointments are `EXISTS` / `NOT EXISTS` subqueries.
+    """
+    schedule = resolve_schedule(schedule)
+    start_minute = get_minute_of_day(start_time)
+    end_minute = get_minute_of_day(end_time)
+
+    # total booked minutes for the week, per technician
+    booked_minutes = (
+        Appointment.objects.in_schedule(schedule)
+        .filter(technician=OuterRef("pk"))
+        .order_by()
+        .values("technician")
+        .annotate(total=Sum("duration_minutes"))
+        .values("total")
+    )
 
-from django.db.models import Q
+    # technicians who are available on the given day and time
+    is_available = Exists(
+        Availability.objects.in_schedule(schedule).filter(
+            content_type=ContentType.objects.get_for_model(Technician),
+            object_id=OuterRef("pk"),
+            day=day,
+            start_minute__lte=start_minute,
+            end_minute__gte=end_minute,
+            is_sub=False,
+        )
+    )
 
-from .models import Appointment, Block, Client, Schedule, Technician
+    # technicians who are already booked on the given day and time
+    is_booked = Exists(
+        Appointment.objects.in_schedule(schedule)
+        .filter(technician=OuterRef("pk"), day=day)
+        .overlapping(start_minute, end_minute)
+    )
+
+    # meets the client's skill and language requirements
+    condition = Q(skill_level__gte=client.req_skill_level)
+    if client.req_spanish_speaking:
+        condition &= Q(spanish_speaking=True)
+
+    # not maxed out on sessions for the week (see `is_maxed_on_sessions`)
+    condition &= Q(
+        is_manually_maxed_out=False,
+        booked_minutes__lt=F("requested_hours") * 60,
+    )
+
+    condition &= is_available & ~is_booked
+
+    queryset = Technician.objects.annotate(
+        booked_minutes=Coalesce(Subquery(booked_minutes), 0),
+    )
+    return queryset, condition
 
 
 def find_available_technicians(
@@ -16,52 +99,40 @@ def find_available_technicians(
     """
     Filter out technicians who:
     - don't meet the clients skill and language requirements
+    - are maxed out on sessions for the week
     - are not available on the given day and time
     - are already booked on the given day and time
 
+    The filtering is done against the schedule's in-memory availability index
+    when this process has it up to date, and otherwise in a single set-based
+    query (see `get_available_technicians_query`) rather than building it.
+    Either way it costs the same number of queries no matter how many
+    technicians there are.
+
     NOTE: If an appointment is passed in, it will always return the technician
     associated with that appointment, even if they're filtered out by the
     above criteria.
     This is done to allow the user to update the appointment without having to
     reselect the technician.
     """
-
-    # filter out technicians who don't meet the client's skill and language
-    # requirements
-    qs = Technician.objects.prefetch_related("appointments", "availabilities").filter(
-        skill_level__gte=client.req_skill_level
-    )
-    if client.req_spanish_speaking:
-        qs = qs.filter(spanish_speaking=True)
-
-    # filter out technicians who are maxed out on appointments for the week
-    for tech in qs:
-        if tech.is_maxed_on_sessions(schedule):
-            qs = qs.exclude(pk=tech.pk)
-
-    # filter out technicians who are not available on the given day and time
-    qs = qs.filter(
-        availabilities__schedule=schedule,
-        availabilities__day=day,
-        availabilities__start_time__lte=start_time,
-        availabilities__end_time__gte=end_time,
-        availabilities__is_sub=False,
-    )
-
-    # filter out technicians who are already booked on the given day and time
-    for tech in qs:
-        appointments = tech.appointments.filter(schedule=schedule, day=day)
-
-        if appointments.filter(
-            start_time__lt=end_time, end_time__gt=start_time
-        ).exists():
-            qs = qs.exclude(pk=tech.pk)
+    index = get_built_index(schedule)
+    if index is not None:
+        queryset = Technician.objects.all()
+        condition = Q(
+            pk__in=index.find_available_technicians(
+                client, int(day), start_time, end_time
+            )
+        )
+    else:
+        queryset, condition = get_available_technicians_query(
+            client, int(day), start_time, end_time, schedule
+        )
 
     # Add the existing appointment technician to the queryset
     if instance:
-        qs = qs | Technician.objects.filter(pk=instance.technician.pk)
+        condition |= Q(pk=instance.technician_id)
 
-    return qs.distinct()
+    return queryset.filter(condition)
 
 
 def find_repeatable_appointment_days(
@@ -76,30 +147,26 @@ def find_repeatable_appointment_days(
     Return an array of days (int) that the given technician
     is able to repeat this appointment.
     """
+    index = get_index(schedule)
+    client_slots = index.client_slots(client.pk)
+    mask = slot_mask(start_time, end_time)
     days = []
 
     for i in range(5):
         # skip today
-        if i == day:
+        if i == int(day):
             continue
 
         # skip if the client is not available on the given day
-        if not client.availabilities.filter(
-            schedule=schedule,
-            day=i,
-            start_time__lte=start_time,
-            end_time__gte=end_time,
-        ).exists():
+        if not client_slots.is_available(i, mask, include_sub=True):
             continue
 
         # add the day to the list if the technician is still a good fit
-        if tech in find_available_technicians(
+        if tech.pk in index.find_available_technicians(
             client,
             i,
             start_time,
             end_time,
-            None,
-            schedule,
         ):
             days.append(i)
 
@@ -115,15 +182,97 @@ def get_appointment_warnings(
     instance: Appointment | None = None,
     schedule: Schedule | None = None,
 ) -> list[str]:
+    return evaluate_appointment_warnings(
+        get_index(schedule),
+        list(Block.objects.order_by("start_time")),
+        client,
+        tech,
+        day,
+        start_time,
+        end_time,
+        instance,
+    )
+
+
+def get_batch_appointment_warnings(
+    placements: list[dict],
+    schedule: Schedule | None = None,
+) -> list[list[str]]:
+    """
+    Return the warnings for each of the given candidate placements, in order.
+
+    Each placement is a dict with `client_id`, `tech_id`, `day`, `start_time`,
+    `end_time` and an optional `appointment_id` (the appointment being edited).
+    Clients, technicians, appointments, blocks and the schedule's availability
+    index are loaded once for the whole batch and the rules are evaluated in
+    memory.
+    """
+    clients = Client.objects.in_bulk({p["client_id"] for p in placements})
+    technicians = Technician.objects.in_bulk({p["tech_id"] for p in placements})
+    appointments = Appointment.objects.in_bulk(
+        {p["appointment_id"] for p in placements if p.get("appointment_id")}
+    )
+    index = get_index(schedule)
+    blocks = list(Block.objects.order_by("start_time"))
+
+    results = []
+    for placement in placements:
+        if placement["client_id"] not in clients:
+            raise Client.DoesNotExist("Client not found")
+        if placement["tech_id"] not in technicians:
+            raise Technician.DoesNotExist("Technician not found")
+        instance = None
+        if placement.get("appointment_id"):
+            instance = appointments.get(placement["appointment_id"])
+            if instance is None:
+                raise Appointment.DoesNotExist("Appointment not found")
+
+        results.append(
+            evaluate_appointment_warnings(
+                index,
+                blocks,
+                clients[placement["client_id"]],
+                technicians[placement["tech_id"]],
+                placement["day"],
+                placement["start_time"],
+                placement["end_time"],
+                instance,
+            )
+        )
+
+    return results
+
+
+def evaluate_appointment_warnings(
+    index: AvailabilityIndex,
+    blocks: list[Block],
+    client: Client,
+    tech: Technician,
+    day: int,
+    start_time: str | time,
+    end_time: str | time,
+    instance: Appointment | None = None,
+) -> list[str]:
+    """
+    Evaluate the appointment warning rules against an availability index,
+    without touching the database.
+    """
     warnings = []
 
     # Parse string times into datetime.time objects
     day_int = int(day)
-    parsed_start_time = datetime.strptime(start_time, "%H:%M:%S").time()
-    parsed_end_time = datetime.strptime(end_time, "%H:%M:%S").time()
-    start_as_datetime = datetime.combine(datetime.today(), parsed_start_time)
-    end_as_datetime = datetime.combine(datetime.today(), parsed_end_time)
-    new_appt_seconds = (end_as_datetime - start_as_datetime).total_seconds()
+    parsed_start_time = to_time(start_time)
+    parsed_end_time = to_time(end_time)
+    new_appt_hours = get_difference_in_minutes(parsed_start_time, parsed_end_time) / 60
+    mask = slot_mask(parsed_start_time, parsed_end_time)
+
+    client_slots = index.client_slots(client.pk)
+    tech_slots = index.technician_slots(tech.pk)
+
+    # hours of the existing appointment, which is replaced by this one
+    existing_appt_hours = 0
+    if instance:
+        existing_appt_hours = instance.duration_minutes / 60
 
     day_display = [
         "Monday",
@@ -142,20 +291,8 @@ def get_appointment_warnings(
 
     # check if this appointment will exceed the client's prescribed hours
     if client.prescribed_hours >= 0:
-        total_hours = client.total_hours(schedule)
-        if instance:
-            # subtract the existing appointment time from the total hours
-            existing_start_as_datetime = datetime.combine(
-                datetime.today(), instance.start_time
-            )
-            existing_end_as_datetime = datetime.combine(
-                datetime.today(), instance.end_time
-            )
-            total_hours -= (
-                existing_end_as_datetime - existing_start_as_datetime
-            ).total_seconds() / 3600
-
-        total_with_appointment = total_hours + (new_appt_seconds / 3600)
+        total_hours = client_slots.total_hours - existing_appt_hours
+        total_with_appointment = total_hours + new_appt_hours
         exceeds_by = total_with_appointment - client.prescribed_hours
 
         if exceeds_by > 0:
@@ -165,20 +302,8 @@ def get_appointment_warnings(
 
     # check if this appointment will exceed the technician's requested hours
     if tech.requested_hours >= 0:
-        total_hours = tech.total_hours(schedule)
-        if instance:
-            # subtract the existing appointment time from the total hours
-            existing_start_as_datetime = datetime.combine(
-                datetime.today(), instance.start_time
-            )
-            existing_end_as_datetime = datetime.combine(
-                datetime.today(), instance.end_time
-            )
-            total_hours -= (
-                existing_end_as_datetime - existing_start_as_datetime
-            ).total_seconds() / 3600
-
-        total_with_appointment = total_hours + (new_appt_seconds / 3600)
+        total_hours = tech_slots.total_hours - existing_appt_hours
+        total_with_appointment = total_hours + new_appt_hours
         exceeds_by = total_with_appointment - tech.requested_hours
 
         if exceeds_by > 0:
@@ -188,19 +313,8 @@ def get_appointment_warnings(
 
     # check if this appointment will exceed the technician's max hours per day
     if tech.max_hours_per_day >= 0:
-        total_hours_today = tech.total_hours_by_day(schedule)[day_int]
-        if instance:
-            # subtract the existing appointment time from the total hours
-            existing_start_as_datetime = datetime.combine(
-                datetime.today(), instance.start_time
-            )
-            existing_end_as_datetime = datetime.combine(
-                datetime.today(), instance.end_time
-            )
-            total_hours_today -= (
-                existing_end_as_datetime - existing_start_as_datetime
-            ).total_seconds() / 3600
-        total_with_appointment = total_hours_today + (new_appt_seconds / 3600)
+        total_hours_today = tech_slots.total_hours_by_day[day_int] - existing_appt_hours
+        total_with_appointment = total_hours_today + new_appt_hours
         exceeds_by = total_with_appointment - tech.max_hours_per_day
         if exceeds_by > 0:
             warnings.append(
@@ -218,61 +332,38 @@ def get_appointment_warnings(
         warnings.append(f"{tech} does not speak Spanish")
 
     # check if the client is available
-    if not client.availabilities.filter(
-        schedule=schedule,
-        day=day,
-        start_time__lte=start_time,
-        end_time__gte=end_time,
-    ).exists():
+    if not client_slots.is_available(day_int, mask, include_sub=True):
         warnings.append(
             f"{client} is not available on {day_display[day_int]} during this time"
         )
 
     # check if the technician is available
-    if not tech.availabilities.filter(
-        schedule=schedule,
-        day=day,
-        start_time__lte=start_time,
-        end_time__gte=end_time,
-        is_sub=False,
-    ).exists():
+    if not tech_slots.is_available(day_int, mask):
         warnings.append(
             f"{tech} is not available on {day_display[day_int]} during this time"
         )
 
     # check if the client is already booked
-    client_appointments = client.appointments.filter(
-        schedule=schedule,
-        day=day,
-        start_time__lt=end_time,
-        end_time__gt=start_time,
-    )
-    if instance:
-        client_appointments = client_appointments.exclude(pk=instance.pk)
-    if client_appointments.exists():
+    exclude = instance.pk if instance else None
+    if client_slots.is_booked(day_int, mask, exclude=exclude):
         warnings.append(
             f"{client} is already booked on {day_display[day_int]} during this time"
         )
 
     # check if the technician is already booked
-    tech_appointments = tech.appointments.filter(
-        schedule=schedule,
-        day=day,
-        start_time__lt=end_time,
-        end_time__gt=start_time,
-    )
-    if instance:
-        tech_appointments = tech_appointments.exclude(pk=instance.pk)
-    if tech_appointments.exists():
+    if tech_slots.is_booked(day_int, mask, exclude=exclude):
         warnings.append(
             f"{tech} is already booked on {day_display[day_int]} during this time"
         )
 
     # check if this appointment will create a split block for the client or the technician
     # NOTE: This assumes that there are only 3 blocks in the system
-    block_1 = Block.objects.order_by("start_time").first()
-    block_2 = Block.objects.order_by("start_time")[1]
-    block_3 = Block.objects.order_by("start_time").last()
+    block_1 = blocks[0]
+    block_2 = blocks[1]
+    block_3 = blocks[-1]
+    block_1_mask = slot_mask(block_1.start_time, block_1.end_time)
+    block_2_mask = slot_mask(block_2.start_time, block_2.end_time)
+    block_3_mask = slot_mask(block_3.start_time, block_3.end_time)
 
     new_appt_is_block_1 = (
         parsed_start_time >= block_1.start_time and parsed_end_time <= block_1.end_time
@@ -280,48 +371,18 @@ def get_appointment_warnings(
     new_appt_is_block_3 = (
         parsed_start_time >= block_3.start_time and parsed_end_time <= block_3.end_time
     )
-    client_has_block_1_appt = client.appointments.filter(
-        schedule=schedule,
-        day=day,
-        start_time__gte=block_1.start_time,
-        end_time__lte=block_1.end_time,
-    ).exists()
-    client_has_block_2_appt = client.appointments.filter(
-        schedule=schedule,
-        day=day,
-        start_time__gte=block_2.start_time,
-        end_time__lte=block_2.end_time,
-    ).exists()
-    client_has_block_3_appt = client.appointments.filter(
-        schedule=schedule,
-        day=day,
-        start_time__gte=block_3.start_time,
-        end_time__lte=block_3.end_time,
-    ).exists()
+    client_has_block_1_appt = client_slots.has_appointment_within(day_int, block_1_mask)
+    client_has_block_2_appt = client_slots.has_appointment_within(day_int, block_2_mask)
+    client_has_block_3_appt = client_slots.has_appointment_within(day_int, block_3_mask)
 
     if new_appt_is_block_1 and client_has_block_3_appt and not client_has_block_2_appt:
         warnings.append(f"This appointment will create a split block for {client}")
     if new_appt_is_block_3 and client_has_block_1_appt and not client_has_block_2_appt:
         warnings.append(f"This appointment will create a split block for {client}")
 
-    tech_has_block_1_appt = tech.appointments.filter(
-        schedule=schedule,
-        day=day,
-        start_time__gte=block_1.start_time,
-        end_time__lte=block_1.end_time,
-    ).exists()
-    tech_has_block_2_appt = tech.appointments.filter(
-        schedule=schedule,
-        day=day,
-        start_time__gte=block_2.start_time,
-        end_time__lte=block_2.end_time,
-    ).exists()
-    tech_has_block_3_appt = tech.appointments.filter(
-        schedule=schedule,
-        day=day,
-        start_time__gte=block_3.start_time,
-        end_time__lte=block_3.end_time,
-    ).exists()
+    tech_has_block_1_appt = tech_slots.has_appointment_within(day_int, block_1_mask)
+    tech_has_block_2_appt = tech_slots.has_appointment_within(day_int, block_2_mask)
+    tech_has_block_3_appt = tech_slots.has_appointment_within(day_int, block_3_mask)
 
     if new_appt_is_block_3 and tech_has_block_1_appt and not tech_has_block_2_appt:
         warnings.append(f"This appointment will create a split block for {tech}")
@@ -333,47 +394,22 @@ def get_appointment_warnings(
 
 def find_recommended_subs(
     appointment: Appointment,
+    schedule: Schedule | None = None,
 ) -> list[Technician]:
     """
     Find technicians that are available to sub for the given client on the given day and time.
     """
-    # filter out technicians who don't meet the client's skill and language
-    # requirements
-    qs = Technician.objects.prefetch_related("appointments", "availabilities").filter(
-        skill_level__gte=appointment.client.req_skill_level
-    )
-    if appointment.client.req_spanish_speaking:
-        qs = qs.filter(spanish_speaking=True)
-
-    # filter out the technician who is already booked for this appointment
-    qs = qs.exclude(pk=appointment.technician.pk)
-
-    # filter out technicians who are not available on the given day and time
-    qs = qs.filter(
-        availabilities__schedule=appointment.schedule,
-        availabilities__day=appointment.day,
-        availabilities__start_time__lte=appointment.start_time,
-        availabilities__end_time__gte=appointment.end_time,
-    )
+    index = get_index(schedule)
 
-    # filter out technicians who are already booked on the given day and time
-    for tech in qs:
-        if tech.appointments.filter(
-            schedule=appointment.schedule,
-            day=appointment.day,
-            start_time__lt=appointment.end_time,
-            end_time__gt=appointment.start_time,
-        ).exists():
-            qs = qs.exclude(pk=tech.pk)
+    # technicians, other than the one already booked for this appointment, who
+    # meet the client's requirements and are free on the given day and time
+    technician_ids = index.find_substitute_technicians(appointment)
 
     # filter out technicians who are not currently working with the client
     # and have not worked with the client before
-    qs = qs.filter(
-        Q(past_clients__in=[appointment.client])
-        | (
-            Q(appointments__client=appointment.client)
-            & Q(appointments__schedule=appointment.schedule)
-        )
-    ).distinct()
+    current_technician_ids = index.current_technician_ids(appointment.client_id)
+    qs = Technician.objects.filter(pk__in=technician_ids).filter(
+        Q(past_clients__in=[appointment.client]) | Q(pk__in=current_technician_ids)
+    )
 
-    return qs
+    return qs.distinct()
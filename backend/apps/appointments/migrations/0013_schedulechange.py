@@ -0,0 +1,54 @@
+# Generated by Django 5.2.12 on 2026-10-18 14:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        (
+            "appointments",
+            "0012_alter_appointment_options_alter_availability_options_and_more",
+        ),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ScheduleChange",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("model", models.CharField(blank=True, max_length=30)),
+                ("object_id", models.UUIDField(blank=True, null=True)),
+                (
+                    "action",
+                    models.CharField(
+                        choices=[
+                            ("upsert", "Created or updated"),
+                            ("delete", "Deleted"),
+                            ("reset", "Reset"),
+                        ],
+                        max_length=6,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "schedule",
+                    models.ForeignKey(
+                        blank=True,
+                        default=None,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="changes",
+                        to="appointments.schedule",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["id"],
+                "indexes": [
+                    models.Index(fields=["schedule", "id"], name="schedule_change_feed")
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.12 on 2026-10-18 14:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appointments", "0014_revision"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="appointment",
+            name="duration_minutes",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="appointment",
+            name="end_minute",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="appointment",
+            name="start_minute",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="availability",
+            name="duration_minutes",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="availability",
+            name="end_minute",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="availability",
+            name="start_minute",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="therapyappointment",
+            name="duration_minutes",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="therapyappointment",
+            name="end_minute",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="therapyappointment",
+            name="start_minute",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
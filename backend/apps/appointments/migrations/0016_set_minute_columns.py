@@ -0,0 +1,27 @@
+from django.db import migrations
+from django.db.models.functions import ExtractHour, ExtractMinute
+
+
+def minute_of_day(field):
+    return ExtractHour(field) * 60 + ExtractMinute(field)
+
+
+def set_minute_columns(apps, schema_editor):
+    for name in ["Availability", "Appointment", "TherapyAppointment"]:
+        model = apps.get_model("appointments", name)
+        model.objects.update(
+            start_minute=minute_of_day("start_time"),
+            end_minute=minute_of_day("end_time"),
+            duration_minutes=minute_of_day("end_time") - minute_of_day("start_time"),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appointments", "0015_minute_columns"),
+    ]
+
+    operations = [
+        migrations.RunPython(set_minute_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+# Indexed (Postgres only) by the columns lookups filter on, then the
+# `int4range(start_minute, end_minute)` that `MinuteRange` builds
+GIST_INDEXES = [
+    ("Appointment", "appointment_technician_span", ["schedule_id", "technician_id"]),
+    ("Appointment", "appointment_client_span", ["schedule_id", "client_id"]),
+    (
+        "Availability",
+        "availability_object_span",
+        ["schedule_id", "content_type_id", "object_id"],
+    ),
+]
+
+
+def create_gist_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    # GiST operator classes for the scalar columns
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+    for model_name, name, columns in GIST_INDEXES:
+        table = apps.get_model("appointments", model_name)._meta.db_table
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING gist "
+            f"({', '.join(columns)}, day, int4range(start_minute, end_minute))"
+        )
+
+
+def drop_gist_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for _, name, _ in GIST_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appointments", "0016_set_minute_columns"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_gist_indexes, drop_gist_indexes),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.12 on 2026-10-18 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appointments", "0017_time_range_gist_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="appointment",
+            index=models.Index(
+                condition=models.Q(("schedule__isnull", False)),
+                fields=["technician", "schedule", "day", "start_minute"],
+                name="appointment_technician_day",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="appointment",
+            index=models.Index(
+                condition=models.Q(("schedule__isnull", True)),
+                fields=["technician", "day", "start_minute"],
+                name="appointment_current_tech_day",
+            ),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.12 on 2026-10-18 14:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appointments", "0018_technician_day_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="schedule",
+            name="is_overlay",
+            field=models.BooleanField(
+                default=False,
+                help_text="Only stores the rows changed from its parent schedule, and reads the others from it.  See overlays.py.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="schedule",
+            name="parent",
+            field=models.ForeignKey(
+                blank=True,
+                default=None,
+                help_text="The schedule an overlay is on top of (empty for the current schedule).",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="overlays",
+                to="appointments.schedule",
+            ),
+        ),
+        migrations.CreateModel(
+            name="HiddenRow",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("object_id", models.UUIDField()),
+                (
+                    "schedule",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="hidden_rows",
+                        to="appointments.schedule",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("schedule", "object_id"), name="hidden_row_unique"
+                    )
+                ],
+            },
+        ),
+    ]
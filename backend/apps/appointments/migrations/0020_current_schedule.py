@@ -0,0 +1,66 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+SCHEDULE_MODELS = ["Availability", "Appointment", "TherapyAppointment"]
+
+
+def create_current_schedule(apps, schema_editor):
+    Schedule = apps.get_model("appointments", "Schedule")
+    CurrentSchedule = apps.get_model("appointments", "CurrentSchedule")
+    ScheduleChange = apps.get_model("appointments", "ScheduleChange")
+
+    schedule = Schedule.objects.create(name="Main schedule")
+    for name in SCHEDULE_MODELS:
+        model = apps.get_model("appointments", name)
+        model.objects.filter(schedule=None).update(schedule=schedule)
+    Schedule.objects.filter(is_overlay=True, parent=None).update(parent=schedule)
+    CurrentSchedule.objects.create(id=1, schedule=schedule)
+    if ScheduleChange.objects.exists():
+        # readers of the current schedule's feed have to load it again
+        ScheduleChange.objects.create(schedule=schedule, action="reset")
+
+
+def remove_current_schedule(apps, schema_editor):
+    Schedule = apps.get_model("appointments", "Schedule")
+    CurrentSchedule = apps.get_model("appointments", "CurrentSchedule")
+    ScheduleChange = apps.get_model("appointments", "ScheduleChange")
+
+    current = CurrentSchedule.objects.get()
+    schedule_id = current.schedule_id
+    current.delete()
+    for name in SCHEDULE_MODELS:
+        model = apps.get_model("appointments", name)
+        model.objects.filter(schedule_id=schedule_id).update(schedule=None)
+    Schedule.objects.filter(parent_id=schedule_id).update(parent=None)
+    ScheduleChange.objects.filter(schedule_id=schedule_id).update(schedule=None)
+    Schedule.objects.filter(pk=schedule_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appointments", "0019_schedule_overlays"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CurrentSchedule",
+            fields=[
+                (
+                    "id",
+                    models.PositiveSmallIntegerField(
+                        default=1, editable=False, primary_key=True, serialize=False
+                    ),
+                ),
+                (
+                    "schedule",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="+",
+                        to="appointments.schedule",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(create_current_schedule, remove_current_schedule),
+    ]
@@ -0,0 +1,140 @@
+import apps.appointments.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appointments", "0020_current_schedule"),
+        ("contenttypes", "0002_remove_content_type_name"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="appointment",
+            options={
+                "ordering": ["schedule_id", "client", "technician", "day", "start_time"]
+            },
+        ),
+        migrations.AlterModelOptions(
+            name="availability",
+            options={
+                "ordering": [
+                    "schedule_id",
+                    "content_type",
+                    "object_id",
+                    "day",
+                    "start_time",
+                ],
+                "verbose_name_plural": "Availabilities",
+            },
+        ),
+        migrations.AlterModelOptions(
+            name="therapyappointment",
+            options={"ordering": ["schedule_id", "client", "day", "start_time"]},
+        ),
+        migrations.RemoveConstraint(
+            model_name="appointment",
+            name="appointment_unique_with_schedule",
+        ),
+        migrations.RemoveConstraint(
+            model_name="appointment",
+            name="appointment_unique_without_schedule",
+        ),
+        migrations.RemoveConstraint(
+            model_name="availability",
+            name="availability_unique_with_schedule",
+        ),
+        migrations.RemoveConstraint(
+            model_name="availability",
+            name="availability_unique_without_schedule",
+        ),
+        migrations.RemoveConstraint(
+            model_name="therapyappointment",
+            name="therapy_appointment_unique_with_schedule",
+        ),
+        migrations.RemoveConstraint(
+            model_name="therapyappointment",
+            name="therapy_appointment_unique_without_schedule",
+        ),
+        migrations.RemoveIndex(
+            model_name="appointment",
+            name="appointment_technician_day",
+        ),
+        migrations.RemoveIndex(
+            model_name="appointment",
+            name="appointment_current_tech_day",
+        ),
+        migrations.AlterField(
+            model_name="appointment",
+            name="schedule",
+            field=models.ForeignKey(
+                default=apps.appointments.models.get_current_schedule_id,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="appointments",
+                to="appointments.schedule",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="availability",
+            name="schedule",
+            field=models.ForeignKey(
+                default=apps.appointments.models.get_current_schedule_id,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="availabilities",
+                to="appointments.schedule",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="schedule",
+            name="parent",
+            field=models.ForeignKey(
+                blank=True,
+                default=None,
+                help_text="The schedule an overlay is on top of.",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="overlays",
+                to="appointments.schedule",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="therapyappointment",
+            name="schedule",
+            field=models.ForeignKey(
+                default=apps.appointments.models.get_current_schedule_id,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="therapy_appointments",
+                to="appointments.schedule",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="appointment",
+            index=models.Index(
+                fields=["technician", "schedule", "day", "start_minute"],
+                name="appointment_technician_day",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="appointment",
+            constraint=models.UniqueConstraint(
+                fields=("client", "schedule", "day", "start_time"),
+                name="appointment_unique_with_schedule",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="availability",
+            constraint=models.UniqueConstraint(
+                fields=("content_type", "object_id", "schedule", "day", "start_time"),
+                name="availability_unique_with_schedule",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="therapyappointment",
+            constraint=models.UniqueConstraint(
+                fields=("client", "schedule", "day", "start_time"),
+                name="therapy_appointment_unique_with_schedule",
+            ),
+        ),
+    ]
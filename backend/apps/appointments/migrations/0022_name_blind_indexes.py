@@ -0,0 +1,123 @@
+# Generated by Django 5.2.12 on 2026-10-18 15:13
+
+import base64
+import hashlib
+import hmac
+import unicodedata
+
+from django.conf import settings
+from django.db import migrations, models
+
+# NOTE: A frozen copy of blind_index.py as of this migration, so later changes
+# to it don't change what this migration does
+
+
+def normalize(value):
+    return " ".join(unicodedata.normalize("NFKC", value or "").casefold().split())
+
+
+def get_hmac(value, digits):
+    key = base64.urlsafe_b64decode(settings.BLIND_INDEX_KEY)
+    return hmac.new(key, value.encode(), hashlib.sha256).hexdigest()[:digits]
+
+
+def get_prefix_index(*names):
+    words = normalize(" ".join(names)).split()
+    tokens = {
+        get_hmac(f"prefix:{word[:length]}", 12)
+        for word in words
+        for length in range(1, len(word) + 1)
+    }
+    return f" {' '.join(sorted(tokens))} "
+
+
+def index_names(apps, schema_editor):
+    for name in ["Client", "Technician"]:
+        manager = apps.get_model("appointments", name)._base_manager.db_manager(
+            schema_editor.connection.alias
+        )
+        rows = list(manager.only("first_name", "last_name").order_by())
+        rows.sort(
+            key=lambda row: (
+                normalize(row.first_name),
+                normalize(row.last_name),
+                str(row.pk),
+            )
+        )
+        for rank, row in enumerate(rows, 1):
+            row.first_name_index = get_hmac(normalize(row.first_name), 32)
+            row.last_name_index = get_hmac(normalize(row.last_name), 32)
+            row.name_prefixes = get_prefix_index(row.first_name, row.last_name)
+            row.name_rank = rank
+        manager.bulk_update(
+            rows,
+            ["first_name_index", "last_name_index", "name_prefixes", "name_rank"],
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appointments", "0021_schedule_not_null"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="client",
+            options={"ordering": ["name_rank"]},
+        ),
+        migrations.AlterModelOptions(
+            name="technician",
+            options={"ordering": ["name_rank"]},
+        ),
+        migrations.AddField(
+            model_name="client",
+            name="first_name_index",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=32
+            ),
+        ),
+        migrations.AddField(
+            model_name="client",
+            name="last_name_index",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=32
+            ),
+        ),
+        migrations.AddField(
+            model_name="client",
+            name="name_prefixes",
+            field=models.TextField(default="", editable=False),
+        ),
+        migrations.AddField(
+            model_name="client",
+            name="name_rank",
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="technician",
+            name="first_name_index",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=32
+            ),
+        ),
+        migrations.AddField(
+            model_name="technician",
+            name="last_name_index",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=32
+            ),
+        ),
+        migrations.AddField(
+            model_name="technician",
+            name="name_prefixes",
+            field=models.TextField(default="", editable=False),
+        ),
+        migrations.AddField(
+            model_name="technician",
+            name="name_rank",
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(index_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.12 on 2026-10-18 15:15
+
+import apps.appointments.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appointments", "0022_name_blind_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="appointment",
+            name="notes",
+            field=apps.appointments.fields.EncryptedTextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name="client",
+            name="first_name",
+            field=apps.appointments.fields.EncryptedCharField(),
+        ),
+        migrations.AlterField(
+            model_name="client",
+            name="last_name",
+            field=apps.appointments.fields.EncryptedCharField(),
+        ),
+        migrations.AlterField(
+            model_name="client",
+            name="notes",
+            field=apps.appointments.fields.EncryptedTextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name="client",
+            name="sub_notes",
+            field=apps.appointments.fields.EncryptedTextField(
+                blank=True, help_text="Notes regarding subbing.  E.G 'No males'"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="technician",
+            name="first_name",
+            field=apps.appointments.fields.EncryptedCharField(),
+        ),
+        migrations.AlterField(
+            model_name="technician",
+            name="last_name",
+            field=apps.appointments.fields.EncryptedCharField(),
+        ),
+        migrations.AlterField(
+            model_name="technician",
+            name="notes",
+            field=apps.appointments.fields.EncryptedTextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name="therapyappointment",
+            name="notes",
+            field=apps.appointments.fields.EncryptedTextField(blank=True),
+        ),
+    ]
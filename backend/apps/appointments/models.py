@@ -1,18 +1,38 @@
+import threading
+
 from auditlog.registry import auditlog
 from colorfield.fields import ColorField
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.fields import IntegerRangeField
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models import Q, UniqueConstraint
-from encrypted_model_fields.fields import EncryptedCharField, EncryptedTextField
+from django.db import connections, models, router, transaction
+from django.db.backends.postgresql.psycopg_any import NumericRange
+from django.db.models import F, Func, OuterRef, Q, Subquery, Sum, UniqueConstraint
+from django.dispatch import Signal
 from schedule_builder.mixins import TimestampMixin, UUIDPrimaryKeyMixin
 
-from .utils import get_difference_in_minutes
+from . import blind_index
+from .fields import EncryptedCharField, EncryptedTextField
+from .utils import get_difference_in_minutes, get_minute_of_day
 
 
 class Schedule(UUIDPrimaryKeyMixin, TimestampMixin):
     name = models.CharField(max_length=100)
+    is_overlay = models.BooleanField(
+        default=False,
+        help_text="Only stores the rows changed from its parent schedule, "
+        "and reads the others from it.  See overlays.py.",
+    )
+    parent = models.ForeignKey(
+        "self",
+        related_name="overlays",
+        on_delete=models.SET_NULL,
+        default=None,
+        null=True,
+        blank=True,
+        help_text="The schedule an overlay is on top of.",
+    )
 
     class Meta:
         ordering = ["-created_at"]
@@ -21,6 +41,72 @@ class Schedule(UUIDPrimaryKeyMixin, TimestampMixin):
         return self.name
 
 
+class CurrentSchedule(models.Model):
+    """
+    Points at the schedule in use, which requests without an `X-Schedule-ID`
+    header read and write.  Promoting a sandbox points it at the sandbox.
+    There is only ever one.
+    """
+
+    id = models.PositiveSmallIntegerField(primary_key=True, default=1, editable=False)
+    schedule = models.OneToOneField(
+        Schedule, related_name="+", on_delete=models.PROTECT
+    )
+
+    def __str__(self):
+        return str(self.schedule)
+
+
+# The current schedule, cached per process until another one is promoted, and
+# how many times it was forgotten
+_current = {"schedule": None, "generation": 0}
+_current_lock = threading.Lock()
+
+# Sent before a process reads the current schedule from the database, so it
+# can be told when another one is promoted (see signals.py)
+current_schedule_read = Signal()
+
+# Sent after bulk writes, which don't send `post_save`, with the ids of the
+# schedules they wrote to, or None for rows shared by all of them (see
+# signals.py)
+bulk_written = Signal()
+
+
+def get_current_schedule() -> Schedule:
+    """
+    The schedule `CurrentSchedule` points at.  It's cached per process, and
+    every process forgets it when another schedule is promoted.
+    """
+    with _current_lock:
+        schedule, generation = _current["schedule"], _current["generation"]
+    if schedule is not None:
+        return schedule
+    current_schedule_read.send(sender=CurrentSchedule)
+    schedule = CurrentSchedule.objects.select_related("schedule").get().schedule
+    with _current_lock:
+        # unless it was forgotten while it was read
+        if _current["generation"] == generation:
+            _current["schedule"] = schedule
+    return schedule
+
+
+def clear_current_schedule():
+    with _current_lock:
+        _current["schedule"] = None
+        _current["generation"] += 1
+
+
+def get_current_schedule_id():
+    return get_current_schedule().pk
+
+
+def resolve_schedule(schedule: Schedule | None) -> Schedule:
+    """
+    The given schedule, or the current one for None.
+    """
+    return schedule if schedule is not None else get_current_schedule()
+
+
 class Block(models.Model):
     color = ColorField(default="#000000")
     start_time = models.TimeField()
@@ -33,7 +119,353 @@ class Block(models.Model):
         return f"{self.start_time} - {self.end_time}"
 
 
-class Technician(UUIDPrimaryKeyMixin, TimestampMixin):
+MINUTE_FIELDS = ["start_minute", "end_minute", "duration_minutes"]
+
+
+class MinuteRange(Func):
+    """
+    The `[start_minute, end_minute)` range of a row, as indexed by the GiST
+    indexes on Postgres (see migration 0017).
+    """
+
+    function = "int4range"
+    output_field = IntegerRangeField()
+
+    def __init__(self, start="start_minute", end="end_minute", **extra):
+        super().__init__(F(start), F(end), **extra)
+
+
+class MinuteRangeQuerySet(models.QuerySet):
+    """
+    Keeps the minute columns in sync on bulk writes, which don't call `save`,
+    and looks rows up by time range.
+    """
+
+    def is_postgres(self) -> bool:
+        return connections[self.db].vendor == "postgresql"
+
+    def in_schedule(self, schedule: Schedule | None):
+        """
+        Rows of a schedule (by default, the current one).  An overlay's are
+        its own rows plus those of its parent it doesn't hide.
+        """
+        schedule = resolve_schedule(schedule)
+        if not schedule.is_overlay:
+            return self.filter(schedule=schedule)
+        hidden = HiddenRow.objects.filter(schedule=schedule).values("object_id")
+        return self.filter(
+            Q(schedule=schedule) | Q(schedule=schedule.parent_id) & ~Q(pk__in=hidden)
+        )
+
+    def overlapping(self, start_minute: int, end_minute: int):
+        """
+        Rows whose time range overlaps `[start_minute, end_minute)`.
+        """
+        if not self.is_postgres():
+            return self.filter(start_minute__lt=end_minute, end_minute__gt=start_minute)
+        return self.alias(span=MinuteRange()).filter(
+            span__overlap=NumericRange(start_minute, end_minute)
+        )
+
+    def within(self, start_minute: int, end_minute: int):
+        """
+        Rows whose time range is contained in `[start_minute, end_minute)`.
+        """
+        if not self.is_postgres():
+            return self.filter(
+                start_minute__gte=start_minute, end_minute__lte=end_minute
+            )
+        return self.alias(span=MinuteRange()).filter(
+            span__contained_by=NumericRange(start_minute, end_minute)
+        )
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.set_minutes()
+        created = super().bulk_create(objs, *args, **kwargs)
+        bulk_written.send(
+            sender=self.model, schedule_ids={obj.schedule_id for obj in objs}
+        )
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if {"start_time", "end_time"} & set(fields):
+            objs = list(objs)
+            for obj in objs:
+                obj.set_minutes()
+            fields = [*fields, *MINUTE_FIELDS]
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def update(self, **kwargs):
+        # NOTE: `bulk_update` passes the minutes along with the times, as
+        # expressions
+        if "start_time" in kwargs and "start_minute" not in kwargs:
+            kwargs["start_minute"] = get_minute_of_day(kwargs["start_time"])
+        if "end_time" in kwargs and "end_minute" not in kwargs:
+            kwargs["end_minute"] = get_minute_of_day(kwargs["end_time"])
+        if "duration_minutes" not in kwargs and (
+            "start_minute" in kwargs or "end_minute" in kwargs
+        ):
+            # SET expressions read the values from before the update
+            kwargs["duration_minutes"] = kwargs.get(
+                "end_minute", F("end_minute")
+            ) - kwargs.get("start_minute", F("start_minute"))
+        # NOTE: `bulk_update` goes through here too
+        schedule_ids = set(
+            self.order_by().values_list("schedule_id", flat=True).distinct()
+        )
+        if "schedule" in kwargs:
+            schedule_ids.add(kwargs["schedule"].pk)
+        elif "schedule_id" in kwargs:
+            schedule_ids.add(kwargs["schedule_id"])
+        updated = super().update(**kwargs)
+        if updated:
+            bulk_written.send(sender=self.model, schedule_ids=schedule_ids)
+        return updated
+
+
+class MinuteRangeMixin(models.Model):
+    """
+    `start_time` and `end_time` also stored as minutes of the day, and their
+    difference, for integer comparisons and sums in SQL.  They are set on
+    save, and on bulk writes through `MinuteRangeQuerySet`.
+    """
+
+    start_minute = models.IntegerField(default=0, editable=False)
+    end_minute = models.IntegerField(default=0, editable=False)
+    duration_minutes = models.IntegerField(default=0, editable=False)
+
+    objects = MinuteRangeQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def set_minutes(self):
+        self.start_minute = get_minute_of_day(self.start_time)
+        self.end_minute = get_minute_of_day(self.end_time)
+        self.duration_minutes = self.end_minute - self.start_minute
+
+    def save(self, *args, **kwargs):
+        self.set_minutes()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"start_time", "end_time"} & set(
+            update_fields
+        ):
+            kwargs["update_fields"] = [*update_fields, *MINUTE_FIELDS]
+        super().save(*args, **kwargs)
+
+    @property
+    def duration(self):
+        return get_difference_in_minutes(self.start_time, self.end_time)
+
+
+def to_hours(minutes: float) -> float:
+    return round(minutes / 60, 2)
+
+
+class HoursQuerySet(models.QuerySet):
+    def with_hours(self, schedule: Schedule = None):
+        """
+        Annotate what the `HoursMixin` methods need, so that they don't query
+        per row.
+        """
+        schedule = resolve_schedule(schedule)
+        available = (
+            Availability.objects.in_schedule(schedule)
+            .filter(
+                content_type=ContentType.objects.get_for_model(self.model),
+                object_id=OuterRef("pk"),
+            )
+            .order_by()
+            .values("object_id")
+            .annotate(total=Sum("duration_minutes"))
+            .values("total")
+        )
+        if not schedule.is_overlay:
+            in_schedule = Q(appointments__schedule=schedule)
+        else:
+            in_schedule = Q(appointments__in=Appointment.objects.in_schedule(schedule))
+        # NOTE: Aggregating drops the default ordering, which pagination needs
+        ordering = self.query.order_by or self.model._meta.ordering
+        return self.annotate(
+            available_minutes=Subquery(available),
+            **{
+                f"day_{day}_minutes": Sum(
+                    "appointments__duration_minutes",
+                    filter=in_schedule & Q(appointments__day=day),
+                )
+                for day in range(7)
+            },
+        ).order_by(*ordering)
+
+
+def is_maxed(is_manually_maxed_out: bool, total_hours: float, target_hours: int):
+    return is_manually_maxed_out or total_hours >= target_hours
+
+
+class HoursMixin:
+    """
+    Hours of a client or technician in a schedule, read from the annotations
+    of `HoursQuerySet.with_hours` when present and summed in SQL otherwise.
+    """
+
+    # The hours they're maxed out on sessions at
+    target_hours_field: str
+
+    def total_hours_available(self, schedule: Schedule = None):
+        if hasattr(self, "available_minutes"):
+            total_minutes = self.available_minutes
+        else:
+            total_minutes = self.availabilities.in_schedule(schedule).aggregate(
+                total=Sum("duration_minutes")
+            )["total"]
+        return to_hours(total_minutes or 0)
+
+    def minutes_by_day(self, schedule: Schedule = None) -> list[int]:
+        if hasattr(self, "day_0_minutes"):
+            return [getattr(self, f"day_{day}_minutes") or 0 for day in range(7)]
+        minutes = dict(
+            self.appointments.in_schedule(schedule)
+            .order_by()
+            .values("day")
+            .annotate(total=Sum("duration_minutes"))
+            .values_list("day", "total")
+        )
+        return [minutes.get(day, 0) for day in range(7)]
+
+    def total_hours_by_day(self, schedule: Schedule = None):
+        return [to_hours(minutes) for minutes in self.minutes_by_day(schedule)]
+
+    def total_hours(self, schedule: Schedule = None):
+        return to_hours(sum(self.minutes_by_day(schedule)))
+
+    def is_maxed_on_sessions(self, schedule: Schedule = None):
+        return is_maxed(
+            self.is_manually_maxed_out,
+            self.total_hours(schedule),
+            getattr(self, self.target_hours_field),
+        )
+
+
+class NameIndexQuerySet(models.QuerySet):
+    """
+    Keeps the blind indexes of names in sync on bulk writes, which don't call
+    `save`, and looks rows up by name.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            blind_index.set_index(obj)
+        created = super().bulk_create(objs, *args, **kwargs)
+        blind_index.rank(self.model, self.db)
+        bulk_written.send(sender=self.model, schedule_ids=None)
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if set(blind_index.NAME_FIELDS) & set(fields):
+            objs = list(objs)
+            for obj in objs:
+                blind_index.set_index(obj)
+            fields = [*fields, *blind_index.INDEX_FIELDS]
+            updated = super().bulk_update(objs, fields, *args, **kwargs)
+            blind_index.rank(self.model, self.db)
+            return updated
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def update(self, **kwargs):
+        # NOTE: `bulk_update` goes through here too
+        updated = super().update(**kwargs)
+        if updated:
+            bulk_written.send(sender=self.model, schedule_ids=None)
+        return updated
+
+    def named(self, first_name: str | None = None, last_name: str | None = None):
+        """
+        Rows with exactly these names (regardless of case and spacing).
+        """
+        qs = self
+        if first_name is not None:
+            qs = qs.filter(first_name_index=blind_index.get_exact_index(first_name))
+        if last_name is not None:
+            qs = qs.filter(last_name_index=blind_index.get_exact_index(last_name))
+        return qs
+
+    def search(self, query: str):
+        """
+        Rows with a name starting with each word of the query, E.G. "jo sm"
+        matches "John Smith".
+        """
+        qs = self
+        for token in blind_index.get_search_tokens(query):
+            qs = qs.filter(name_prefixes__contains=f" {token} ")
+        return qs
+
+
+class PersonQuerySet(NameIndexQuerySet, HoursQuerySet):
+    pass
+
+
+# Columns of `NameIndexMixin`, which the API doesn't show
+NAME_INDEX_FIELDS = [*blind_index.INDEX_FIELDS, "name_rank"]
+
+
+class NameIndexMixin(models.Model):
+    """
+    Blind indexes of the encrypted `first_name` and `last_name`, and the
+    row's position in name order (see blind_index.py).  They are set on save,
+    and on bulk writes through `NameIndexQuerySet`.
+    """
+
+    first_name_index = models.CharField(
+        max_length=blind_index.EXACT_DIGITS, default="", editable=False, db_index=True
+    )
+    last_name_index = models.CharField(
+        max_length=blind_index.EXACT_DIGITS, default="", editable=False, db_index=True
+    )
+    name_prefixes = models.TextField(default="", editable=False)
+    name_rank = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        indexed = (self.first_name_index, self.last_name_index)
+        blind_index.set_index(self)
+        renamed = self._state.adding or indexed != (
+            self.first_name_index,
+            self.last_name_index,
+        )
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and set(blind_index.NAME_FIELDS) & set(
+            update_fields
+        ):
+            kwargs["update_fields"] = [
+                *update_fields,
+                *blind_index.INDEX_FIELDS,
+                "name_rank",
+            ]
+        elif update_fields is None and not renamed:
+            # other rows' names move the rank, so this one may be stale
+            kwargs["update_fields"] = [
+                field.attname
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname != "name_rank"
+            ]
+
+        if not renamed:
+            super().save(*args, **kwargs)
+            return
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            blind_index.place(self, using)
+            super().save(*args, **kwargs)
+
+
+class Technician(UUIDPrimaryKeyMixin, TimestampMixin, NameIndexMixin, HoursMixin):
+    target_hours_field = "requested_hours"
+
     first_name = EncryptedCharField(max_length=30)
     last_name = EncryptedCharField(max_length=30)
     bg_color = ColorField(default="#ffffff")
@@ -53,60 +485,20 @@ class Technician(UUIDPrimaryKeyMixin, TimestampMixin):
     # generic relation to availabilities
     availabilities = GenericRelation("Availability")
 
+    objects = PersonQuerySet.as_manager()
+
     class Meta:
-        # NOTE: Because first_name and last_name are encrypted in the database,
-        # the ordering will not be correct!  Ordering must* be done on the frontend.
-        # The problem with ordering them on the get_queryset is that sorting them there will
-        # return a `list` not a queryset
-        ordering = ["first_name", "last_name"]
+        # NOTE: first_name and last_name are encrypted in the database, so
+        # rows are ordered by their rank in name order instead
+        ordering = ["name_rank"]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
-    def total_hours_available(self, schedule: Schedule = None):
-        total_minutes = sum(
-            [
-                availability.duration
-                for availability in self.availabilities.filter(schedule=schedule)
-            ]
-        )
-        return round(total_minutes / 60, 2)
-
-    def total_hours_by_day(self, schedule: Schedule = None):
-        hours = []
-
-        for day in range(7):
-            total_minutes = sum(
-                [
-                    appointment.duration
-                    for appointment in self.appointments.filter(
-                        schedule=schedule,
-                        day=day,
-                    )
-                ]
-            )
-            hours.append(round(total_minutes / 60, 2))
-
-        return hours
-
-    def total_hours(self, schedule: Schedule = None):
-        total_minutes = sum(
-            [
-                appointment.duration
-                for appointment in self.appointments.filter(
-                    schedule=schedule,
-                )
-            ]
-        )
-        return round(total_minutes / 60, 2)
-
-    def is_maxed_on_sessions(self, schedule: Schedule = None):
-        if self.is_manually_maxed_out:
-            return True
-        return self.total_hours(schedule) >= self.requested_hours
 
+class Client(UUIDPrimaryKeyMixin, TimestampMixin, NameIndexMixin, HoursMixin):
+    target_hours_field = "prescribed_hours"
 
-class Client(UUIDPrimaryKeyMixin, TimestampMixin):
     first_name = EncryptedCharField(max_length=30)
     last_name = EncryptedCharField(max_length=30)
     prescribed_hours = models.IntegerField(default=0)
@@ -135,60 +527,18 @@ class Client(UUIDPrimaryKeyMixin, TimestampMixin):
     # generic relation to availabilities
     availabilities = GenericRelation("Availability")
 
+    objects = PersonQuerySet.as_manager()
+
     class Meta:
-        # NOTE: Because first_name and last_name are encrypted in the database,
-        # the ordering will not be correct!  Ordering must* be done on the frontend.
-        # The problem with ordering them on the get_queryset is that sorting them there will
-        # return a `list` not a queryset
-        ordering = ["first_name", "last_name"]
+        # NOTE: first_name and last_name are encrypted in the database, so
+        # rows are ordered by their rank in name order instead
+        ordering = ["name_rank"]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
-    def total_hours_available(self, schedule: Schedule = None):
-        total_minutes = sum(
-            [
-                availability.duration
-                for availability in self.availabilities.filter(
-                    schedule=schedule,
-                )
-            ]
-        )
-        return round(total_minutes / 60, 2)
-
-    def total_hours_by_day(self, schedule: Schedule = None):
-        hours = []
-
-        for day in range(7):
-            total_minutes = sum(
-                [
-                    appointment.duration
-                    for appointment in self.appointments.filter(
-                        schedule=schedule,
-                        day=day,
-                    )
-                ]
-            )
-            hours.append(round(total_minutes / 60, 2))
-
-        return hours
-
-    def total_hours(self, schedule: Schedule = None):
-        total_minutes = sum(
-            [
-                appointment.duration
-                for appointment in self.appointments.filter(schedule=schedule)
-            ]
-        )
-        return round(total_minutes / 60, 2)
 
-    def is_maxed_on_sessions(self, schedule: Schedule = None):
-        if self.is_manually_maxed_out:
-            return True
-        return self.total_hours(schedule) >= self.prescribed_hours
-
-
-class Availability(UUIDPrimaryKeyMixin, TimestampMixin):
+class Availability(UUIDPrimaryKeyMixin, TimestampMixin, MinuteRangeMixin):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.UUIDField()
     object = GenericForeignKey("content_type", "object_id")
@@ -209,36 +559,24 @@ class Availability(UUIDPrimaryKeyMixin, TimestampMixin):
         Schedule,
         related_name="availabilities",
         on_delete=models.CASCADE,
-        default=None,
-        null=True,
-        blank=True,
+        default=get_current_schedule_id,
     )
 
     class Meta:
-        ordering = ["schedule", "content_type", "object_id", "day", "start_time"]
+        ordering = ["schedule_id", "content_type", "object_id", "day", "start_time"]
         verbose_name_plural = "Availabilities"
         constraints = [
             UniqueConstraint(
                 fields=["content_type", "object_id", "schedule", "day", "start_time"],
-                condition=Q(schedule__isnull=False),
                 name="availability_unique_with_schedule",
             ),
-            UniqueConstraint(
-                fields=["content_type", "object_id", "day", "start_time"],
-                condition=Q(schedule__isnull=True),
-                name="availability_unique_without_schedule",
-            ),
         ]
 
     def __str__(self):
         return f"{self.object} - D{self.day} ({self.start_time}-{self.end_time})"
 
-    @property
-    def duration(self):
-        return get_difference_in_minutes(self.start_time, self.end_time)
-
 
-class Appointment(UUIDPrimaryKeyMixin, TimestampMixin):
+class Appointment(UUIDPrimaryKeyMixin, TimestampMixin, MinuteRangeMixin):
     client = models.ForeignKey(
         Client, related_name="appointments", on_delete=models.CASCADE
     )
@@ -258,35 +596,33 @@ class Appointment(UUIDPrimaryKeyMixin, TimestampMixin):
         Schedule,
         related_name="appointments",
         on_delete=models.CASCADE,
-        default=None,
-        null=True,
-        blank=True,
+        default=get_current_schedule_id,
     )
 
     class Meta:
-        ordering = ["schedule", "client", "technician", "day", "start_time"]
+        ordering = ["schedule_id", "client", "technician", "day", "start_time"]
         constraints = [
             UniqueConstraint(
                 fields=["client", "schedule", "day", "start_time"],
-                condition=Q(schedule__isnull=False),
                 name="appointment_unique_with_schedule",
             ),
-            UniqueConstraint(
-                fields=["client", "day", "start_time"],
-                condition=Q(schedule__isnull=True),
-                name="appointment_unique_without_schedule",
+        ]
+        # NOTE: The unique constraints above already index the lookups by
+        # client (and those of availabilities and therapy appointments by
+        # person), this indexes the same lookups by technician.  See the
+        # `explain_queries` command.
+        indexes = [
+            models.Index(
+                fields=["technician", "schedule", "day", "start_minute"],
+                name="appointment_technician_day",
             ),
         ]
 
     def __str__(self):
         return f"{self.client} - {self.technician} - D{self.day} {self.start_time} - {self.end_time}"
 
-    @property
-    def duration(self):
-        return get_difference_in_minutes(self.start_time, self.end_time)
 
-
-class TherapyAppointment(UUIDPrimaryKeyMixin, TimestampMixin):
+class TherapyAppointment(UUIDPrimaryKeyMixin, TimestampMixin, MinuteRangeMixin):
     OT = "ot"
     ST = "st"
     MH = "mh"
@@ -316,24 +652,16 @@ class TherapyAppointment(UUIDPrimaryKeyMixin, TimestampMixin):
         Schedule,
         related_name="therapy_appointments",
         on_delete=models.CASCADE,
-        default=None,
-        null=True,
-        blank=True,
+        default=get_current_schedule_id,
     )
 
     class Meta:
-        ordering = ["schedule", "client", "day", "start_time"]
+        ordering = ["schedule_id", "client", "day", "start_time"]
         constraints = [
             UniqueConstraint(
                 fields=["client", "schedule", "day", "start_time"],
-                condition=Q(schedule__isnull=False),
                 name="therapy_appointment_unique_with_schedule",
             ),
-            UniqueConstraint(
-                fields=["client", "day", "start_time"],
-                condition=Q(schedule__isnull=True),
-                name="therapy_appointment_unique_without_schedule",
-            ),
         ]
 
     def __str__(self):
@@ -342,13 +670,90 @@ class TherapyAppointment(UUIDPrimaryKeyMixin, TimestampMixin):
     def get_therapy_type_display(self):
         return dict(self.THERAPY_TYPE_CHOICES).get(self.therapy_type, "Unknown")
 
-    @property
-    def duration(self):
-        return get_difference_in_minutes(self.start_time, self.end_time)
+
+class HiddenRow(models.Model):
+    """
+    A row of an overlay's parent schedule that the overlay deleted, or
+    replaced with a changed copy of its own.
+    """
+
+    schedule = models.ForeignKey(
+        Schedule, related_name="hidden_rows", on_delete=models.CASCADE
+    )
+    object_id = models.UUIDField()
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=["schedule", "object_id"], name="hidden_row_unique"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.schedule}: {self.object_id}"
+
+
+class ScheduleChange(models.Model):
+    """
+    A row created, updated or deleted in a schedule, for the change feed.
+
+    Clients and technicians aren't part of a schedule, so their changes have
+    no schedule and belong to every schedule's feed.  A "reset" tells readers
+    of the feed to reload the whole schedule, after bulk changes, or without a
+    schedule after old changes were pruned.
+    """
+
+    UPSERT = "upsert"
+    DELETE = "delete"
+    RESET = "reset"
+    ACTION_CHOICES = (
+        (UPSERT, "Created or updated"),
+        (DELETE, "Deleted"),
+        (RESET, "Reset"),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    schedule = models.ForeignKey(
+        Schedule,
+        related_name="changes",
+        on_delete=models.CASCADE,
+        default=None,
+        null=True,
+        blank=True,
+    )
+    model = models.CharField(max_length=30, blank=True)
+    object_id = models.UUIDField(null=True, blank=True)
+    action = models.CharField(max_length=6, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["schedule", "id"], name="schedule_change_feed"),
+        ]
+
+    def __str__(self):
+        return f"{self.id}: {self.action} {self.model} {self.object_id}"
+
+
+class Revision(models.Model):
+    """
+    A counter bumped by every write to what it covers: a schedule's
+    appointments, availabilities and therapy appointments (keyed by the
+    schedule's ID, or "current"), or the clients, technicians and blocks
+    shared by all schedules ("shared").
+    """
+
+    key = models.CharField(max_length=36, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key}: {self.value}"
 
 
 # Register the models with auditlog
 auditlog.register(Schedule)
+auditlog.register(CurrentSchedule)
 auditlog.register(Block)
 auditlog.register(Technician)
 auditlog.register(Client)
@@ -0,0 +1,100 @@
+"""
+Overlay schedules.
+
+An overlay is a sandbox that doesn't copy its parent schedule: it only
+stores the rows created or changed in it, and reads the others from the
+parent (see `MinuteRangeQuerySet.in_schedule`).  Creating one is a single
+insert, and it grows with the changes made to it.
+
+Rows are copied on write: changing a row the overlay reads from its parent
+saves a copy in the overlay and hides the parent's row from it, and deleting
+one only hides it (see `HiddenRow`).  Changes to the parent's other rows show
+through.
+
+Overlays are made on top of the current schedule, and stay on top of it
+when another schedule is promoted (it's archived, with the same rows).  An
+overlay is materialized when its parent is deleted or when it's promoted:
+the rows it reads are copied into it, making it a plain schedule.
+"""
+
+from django.db import transaction
+
+from .changes import FEED_MODELS, record_reset
+from .copies import SCHEDULE_MODELS, copy_rows, log_copy
+from .events import publish_change, publish_reset
+from .models import HiddenRow, Schedule, ScheduleChange, resolve_schedule
+from .revisions import bump_schedule_revision
+
+
+def is_inherited(schedule: Schedule | None, instance) -> bool:
+    """
+    Whether the row is read by an overlay from its parent.
+    """
+    schedule = resolve_schedule(schedule)
+    return schedule.is_overlay and instance.schedule_id != schedule.pk
+
+
+def hide(schedule: Schedule, instance):
+    """
+    Hide a row of the parent from an overlay, as if it was deleted from it.
+    """
+    HiddenRow.objects.get_or_create(schedule=schedule, object_id=instance.pk)
+    name, _ = FEED_MODELS[type(instance)]
+    ScheduleChange.objects.create(
+        schedule=schedule,
+        model=name,
+        object_id=instance.pk,
+        action=ScheduleChange.DELETE,
+    )
+    bump_schedule_revision(schedule.pk)
+    publish_change(instance, ScheduleChange.DELETE, schedule_id=schedule.pk)
+
+
+def copy_on_write(schedule: Schedule | None, instance):
+    """
+    Return the row to change for a row of a schedule: the row itself, or a
+    copy saved in the overlay that replaces it if it's read from the parent.
+    """
+    if not is_inherited(schedule, instance):
+        return instance
+    with transaction.atomic():
+        hide(schedule, instance)
+        copy = type(instance).objects.get(pk=instance.pk)
+        copy.pk = None
+        copy._state.adding = True
+        copy.schedule = schedule
+        copy.save()
+    return copy
+
+
+def delete(schedule: Schedule | None, instance):
+    """
+    Delete a row of a schedule, or hide it if it's read from the parent.
+    """
+    if is_inherited(schedule, instance):
+        with transaction.atomic():
+            hide(schedule, instance)
+    else:
+        instance.delete()
+
+
+def materialize(overlay: Schedule):
+    """
+    Copy the rows an overlay reads from its parent into it, and make it a
+    plain schedule.
+    """
+    with transaction.atomic():
+        copied = {
+            name: copy_rows(model, overlay.parent_id, overlay.pk, hidden_by=overlay.pk)
+            for name, model in SCHEDULE_MODELS.items()
+        }
+        log_copy(overlay, overlay.parent_id, overlay.pk, copied)
+        HiddenRow.objects.filter(schedule=overlay).delete()
+        Schedule.objects.filter(pk=overlay.pk).update(is_overlay=False, parent=None)
+        overlay.is_overlay = False
+        overlay.parent = None
+
+        # the copies have new IDs
+        record_reset(overlay)
+        bump_schedule_revision(overlay.pk)
+        publish_reset(overlay.pk)
@@ -0,0 +1,129 @@
+"""
+Response cache.
+
+The responses of the heavy read endpoints are cached under keys made of the
+schedule's revisions (see revisions.py), the request's URL and its
+representation.  Every write
+bumps the revisions of what it touches, so it invalidates exactly the entries
+built from it: they are never read again, and expire.
+
+Entries are kept in the `RESPONSE_CACHE_ALIAS` cache, which should be shared
+by the server's processes (E.G. a file based or Redis cache) for them to share
+hits.  Hits and misses are counted per endpoint in the same cache.
+
+NOTE: Responses hold decrypted names and notes, so entries are stored as JSON
+encrypted with `RESPONSE_CACHE_KEY`: the plaintext never leaves the process.
+An entry that can't be decrypted (E.G. after changing the key) is a miss.
+"""
+
+import hashlib
+import json
+from functools import cache, wraps
+from urllib.parse import urlencode
+
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .revisions import get_request_revisions
+from .serializers import COMPACT, is_compact
+
+# Names of the endpoints that are cached
+cached_views = []
+
+MISSING = object()
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+@cache
+def get_fernet() -> Fernet:
+    return Fernet(settings.RESPONSE_CACHE_KEY)
+
+
+def encrypt_data(data) -> bytes:
+    return get_fernet().encrypt(JSONRenderer().render(data))
+
+
+def decrypt_data(token: bytes):
+    return json.loads(get_fernet().decrypt(token))
+
+
+def get_cache_key(request, name: str) -> str:
+    key, revision, shared = get_request_revisions(request)
+    params = urlencode(sorted(request.query_params.lists()), doseq=True)
+    url = hashlib.sha256(
+        f"{request.get_host()}{request.path}?{params}".encode()
+    ).hexdigest()
+    # the representation can be asked for with a header
+    representation = COMPACT if is_compact(request) else "full"
+    return f"response:{name}:{key}:{revision}:{shared}:{representation}:{url}"
+
+
+def count(name: str, outcome: str):
+    cache = get_cache()
+    key = f"response-stats:{name}:{outcome}"
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted since it was added
+        pass
+
+
+def get_stats() -> dict:
+    """
+    The hits, misses and hit rate of each cached endpoint.
+    """
+    keys = {
+        (name, outcome): f"response-stats:{name}:{outcome}"
+        for name in cached_views
+        for outcome in ["hits", "misses"]
+    }
+    counts = get_cache().get_many(keys.values())
+    stats = {}
+    for name in cached_views:
+        hits = counts.get(keys[name, "hits"], 0)
+        misses = counts.get(keys[name, "misses"], 0)
+        stats[name] = {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else None,
+        }
+    return stats
+
+
+def cache_response(name: str):
+    """
+    Cache the successful responses of a view method.
+    """
+    cached_views.append(name)
+
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            cache = get_cache()
+            key = get_cache_key(request, name)
+            token = cache.get(key, MISSING)
+            if token is not MISSING:
+                try:
+                    data = decrypt_data(token)
+                except InvalidToken:
+                    pass
+                else:
+                    count(name, "hits")
+                    return Response(data)
+
+            count(name, "misses")
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, encrypt_data(response.data))
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,69 @@
+"""
+Schedule revisions.
+
+Every write bumps the `Revision` counter of what it touches (see signals.py),
+in the same transaction, so a revision read before a queryset is never newer
+than the data the queryset returns.  The read endpoints use the revisions as
+ETags to answer conditional GETs with a 304 without any other query.
+"""
+
+from django.db.models import F
+
+from .models import Revision, Schedule, resolve_schedule
+
+SHARED = "shared"
+
+
+def get_key(schedule: Schedule | None) -> str:
+    return str(resolve_schedule(schedule).pk)
+
+
+def bump_revision(key: str):
+    if Revision.objects.filter(key=key).update(value=F("value") + 1):
+        return
+    # first write, unless another one just created the counter
+    _, created = Revision.objects.get_or_create(key=key, defaults={"value": 1})
+    if not created:
+        Revision.objects.filter(key=key).update(value=F("value") + 1)
+
+
+def bump_schedule_revision(schedule_id):
+    bump_revision(str(schedule_id))
+
+
+def get_revisions(schedule: Schedule | None) -> tuple[str, int, int]:
+    """
+    The key and revision of a schedule, and the revision of the shared rows.
+
+    An overlay (see overlays.py) changes with its parent, so its key is both
+    of theirs and its revision their sum, which both only go up.
+    """
+    schedule = resolve_schedule(schedule)
+    keys = [get_key(schedule)]
+    if schedule.is_overlay:
+        keys.append(str(schedule.parent_id))
+    revisions = dict(
+        Revision.objects.filter(key__in=[*keys, SHARED]).values_list("key", "value")
+    )
+    return (
+        "+".join(keys),
+        sum(revisions.get(key, 0) for key in keys),
+        revisions.get(SHARED, 0),
+    )
+
+
+def get_request_revisions(request) -> tuple[str, int, int]:
+    """
+    The revisions of the request's schedule, read once per request.
+    """
+    if not hasattr(request, "revisions"):
+        request.revisions = get_revisions(request.schedule)
+    return request.revisions
+
+
+def get_etag(revisions: tuple[str, int, int]) -> str:
+    """
+    An ETag for anything built from a schedule and the shared rows, which
+    changes with every write to either.
+    """
+    return '"{}-{}-{}"'.format(*revisions)
@@ -0,0 +1,904 @@
+"""
+Automatic scheduling.
+
+`auto_schedule` fills a sandbox schedule with appointments, placed on the
+`Block` rows of each weekday, from the clients' and technicians'
+availabilities.
+
+Every appointment it creates satisfies the hard constraints that the matcher
+and `get_appointment_warnings` encode:
+- the technician meets the client's skill level and language requirements
+- the client and technician are both available (technicians not as a sub)
+- neither the client nor the technician is already booked
+- the client's prescribed hours, the technician's requested hours and the
+  technician's max hours per day are not exceeded
+- neither the client nor the technician is manually maxed out
+
+Within those, it optimizes for soft goals: as many scheduled hours as
+possible, no split blocks, and technicians the client has worked with before.
+
+The solver works on a `ScheduleSnapshot`, a compact picklable copy of
+everything it needs, so it never touches the ORM while searching.
+"""
+
+import multiprocessing
+import random
+import time as timer
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, NamedTuple
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from .changes import record_upserts
+from .events import publish_reset
+from .flow import MinCostFlow
+from .models import (
+    Appointment,
+    Availability,
+    Block,
+    Client,
+    Schedule,
+    Technician,
+    get_current_schedule_id,
+)
+from .revisions import bump_schedule_revision
+
+WEEKDAYS = range(5)
+
+# Solver modes
+GREEDY = "greedy"
+FLOW = "flow"
+MODES = [GREEDY, FLOW]
+
+# Soft goal weights, per hour scheduled or per occurrence
+HOUR_WEIGHT = 100
+FULLY_SCHEDULED_WEIGHT = 50
+SPLIT_BLOCK_PENALTY = 60
+PAST_TECHNICIAN_WEIGHT = 10
+
+# Min-cost flow edge costs, per appointment
+CONTINUITY_COST = -20
+PAST_TECHNICIAN_COST = -15
+SKILL_SURPLUS_COST = 4
+SPANISH_SURPLUS_COST = 4
+HOUR_BALANCE_COST = 2
+SPLIT_BLOCK_COST = 30
+
+
+def to_minutes(value) -> int:
+    return value.hour * 60 + value.minute
+
+
+class SnapshotBlock(NamedTuple):
+    start: int
+    end: int
+
+
+class SnapshotTechnician(NamedTuple):
+    id: str
+    skill_level: int
+    spanish_speaking: bool
+    requested_minutes: int
+    max_minutes_per_day: int
+    is_manually_maxed_out: bool
+
+
+class SnapshotClient(NamedTuple):
+    id: str
+    req_skill_level: int
+    req_spanish_speaking: bool
+    prescribed_minutes: int
+    is_manually_maxed_out: bool
+    past_technicians: frozenset
+
+
+class SnapshotAvailability(NamedTuple):
+    day: int
+    start: int
+    end: int
+    is_sub: bool
+
+
+class SnapshotAppointment(NamedTuple):
+    id: str
+    client: int
+    technician: int
+    day: int
+    start: int
+    end: int
+
+
+class ScheduleSnapshot(NamedTuple):
+    """
+    Everything the solver needs, as plain tuples.  Clients and technicians are
+    referenced by their position in `clients` / `technicians`.
+    """
+
+    schedule_id: str | None
+    blocks: list[SnapshotBlock]
+    technicians: list[SnapshotTechnician]
+    clients: list[SnapshotClient]
+    technician_availabilities: list[list[SnapshotAvailability]]
+    client_availabilities: list[list[SnapshotAvailability]]
+    appointments: list[SnapshotAppointment]
+
+
+class Placement(NamedTuple):
+    client: int
+    technician: int
+    day: int
+    block: int
+
+
+class Solution(NamedTuple):
+    placements: list[Placement]
+    score: float
+
+
+def build_snapshot(schedule: Schedule | None) -> ScheduleSnapshot:
+    """
+    Load the blocks, technicians, clients, availabilities and appointments of
+    a schedule into a `ScheduleSnapshot`.
+    """
+    blocks = [
+        SnapshotBlock(to_minutes(block.start_time), to_minutes(block.end_time))
+        for block in Block.objects.order_by("start_time")
+    ]
+
+    technicians = [
+        SnapshotTechnician(
+            str(tech["id"]),
+            tech["skill_level"],
+            tech["spanish_speaking"],
+            tech["requested_hours"] * 60,
+            tech["max_hours_per_day"] * 60,
+            tech["is_manually_maxed_out"],
+        )
+        for tech in Technician.objects.order_by("id").values(
+            "id",
+            "skill_level",
+            "spanish_speaking",
+            "requested_hours",
+            "max_hours_per_day",
+            "is_manually_maxed_out",
+        )
+    ]
+    technician_index = {tech.id: i for i, tech in enumerate(technicians)}
+
+    past_technicians = {}
+    for client_id, technician_id in Client.past_technicians.through.objects.values_list(
+        "client_id", "technician_id"
+    ):
+        past_technicians.setdefault(str(client_id), set()).add(
+            technician_index[str(technician_id)]
+        )
+
+    clients = [
+        SnapshotClient(
+            str(client["id"]),
+            client["req_skill_level"],
+            client["req_spanish_speaking"],
+            client["prescribed_hours"] * 60,
+            client["is_manually_maxed_out"],
+            frozenset(past_technicians.get(str(client["id"]), ())),
+        )
+        for client in Client.objects.order_by("id").values(
+            "id",
+            "req_skill_level",
+            "req_spanish_speaking",
+            "prescribed_hours",
+            "is_manually_maxed_out",
+        )
+    ]
+    client_index = {client.id: i for i, client in enumerate(clients)}
+
+    technician_availabilities = [[] for _ in technicians]
+    client_availabilities = [[] for _ in clients]
+    technician_content_type = ContentType.objects.get_for_model(Technician)
+    for availability in Availability.objects.in_schedule(schedule).values(
+        "content_type_id",
+        "object_id",
+        "day",
+        "start_minute",
+        "end_minute",
+        "is_sub",
+    ):
+        snapshot_availability = SnapshotAvailability(
+            availability["day"],
+            availability["start_minute"],
+            availability["end_minute"],
+            availability["is_sub"],
+        )
+        object_id = str(availability["object_id"])
+        if availability["content_type_id"] == technician_content_type.pk:
+            if object_id in technician_index:
+                technician_availabilities[technician_index[object_id]].append(
+                    snapshot_availability
+                )
+        elif object_id in client_index:
+            client_availabilities[client_index[object_id]].append(snapshot_availability)
+
+    appointments = [
+        SnapshotAppointment(
+            str(appointment["id"]),
+            client_index[str(appointment["client_id"])],
+            technician_index[str(appointment["technician_id"])],
+            appointment["day"],
+            appointment["start_minute"],
+            appointment["end_minute"],
+        )
+        for appointment in Appointment.objects.in_schedule(schedule).values(
+            "id",
+            "client_id",
+            "technician_id",
+            "day",
+            "start_minute",
+            "end_minute",
+        )
+    ]
+
+    return ScheduleSnapshot(
+        str(schedule.pk) if schedule else None,
+        blocks,
+        technicians,
+        clients,
+        technician_availabilities,
+        client_availabilities,
+        appointments,
+    )
+
+
+def iter_bits(mask: int):
+    """
+    Yield the positions of the set bits of `mask`.
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def random_bit(mask: int, rng: random.Random) -> int:
+    """
+    Return the position of a random set bit of `mask`.
+    """
+    bits = list(iter_bits(mask))
+    return bits[rng.randrange(len(bits))]
+
+
+def count_split_blocks(blocks_by_day: list[int], block_count: int) -> int:
+    """
+    Count the days that have an appointment in the first and last block but
+    not in the second one, which is the split block rule of
+    `get_appointment_warnings`.
+
+    `blocks_by_day` holds, per day, a bitmap of the blocks used.
+    """
+    if block_count < 3:
+        return 0
+    first, second, last = 1, 1 << 1, 1 << (block_count - 1)
+    return sum(
+        1
+        for used in blocks_by_day
+        if used & first and used & last and not used & second
+    )
+
+
+class ScheduleProblem:
+    """
+    The static part of a scheduling problem, precomputed from a snapshot.
+
+    Technician sets are stored as int bitmaps over technician positions, so
+    "eligible technicians free in this slot" is a couple of ANDs.
+    """
+
+    def __init__(self, snapshot: ScheduleSnapshot):
+        self.snapshot = snapshot
+        self.blocks = snapshot.blocks
+        self.block_count = len(self.blocks)
+        self.technician_count = len(snapshot.technicians)
+        self.client_count = len(snapshot.clients)
+        self.slots = [
+            (day, block) for day in WEEKDAYS for block in range(self.block_count)
+        ]
+        self.min_block_minutes = min(
+            (block.end - block.start for block in self.blocks), default=0
+        )
+
+        # technicians each client may work with
+        self.eligible = [0] * self.client_count
+        for c, client in enumerate(snapshot.clients):
+            if client.is_manually_maxed_out:
+                continue
+            for t, tech in enumerate(snapshot.technicians):
+                if tech.is_manually_maxed_out:
+                    continue
+                if tech.skill_level < client.req_skill_level:
+                    continue
+                if client.req_spanish_speaking and not tech.spanish_speaking:
+                    continue
+                self.eligible[c] |= 1 << t
+
+        self.past_technicians = [
+            sum(1 << t for t in client.past_technicians) for client in snapshot.clients
+        ]
+
+        # technicians available (not as a sub) for each slot, and slots each
+        # client is available for
+        self.technicians_available = [0] * len(self.slots)
+        for t, availabilities in enumerate(snapshot.technician_availabilities):
+            for slot in self.available_slots(availabilities, include_sub=False):
+                self.technicians_available[slot] |= 1 << t
+        self.client_available = [
+            sum(
+                1 << slot
+                for slot in self.available_slots(availabilities, include_sub=True)
+            )
+            for availabilities in snapshot.client_availabilities
+        ]
+
+    def slot_index(self, day: int, block: int) -> int:
+        return day * self.block_count + block
+
+    def available_slots(self, availabilities, include_sub):
+        for slot, (day, block) in enumerate(self.slots):
+            start, end = self.blocks[block]
+            if any(
+                a.day == day and a.start <= start and a.end >= end
+                for a in availabilities
+                if include_sub or not a.is_sub
+            ):
+                yield slot
+
+    def block_minutes(self, block: int) -> int:
+        return self.blocks[block].end - self.blocks[block].start
+
+    def overlapping_blocks(self, start: int, end: int):
+        for block, (block_start, block_end) in enumerate(self.blocks):
+            if block_start < end and block_end > start:
+                yield block
+
+    def containing_block(self, start: int, end: int):
+        for block, (block_start, block_end) in enumerate(self.blocks):
+            if start >= block_start and end <= block_end:
+                return block
+        return None
+
+
+class ScheduleState:
+    """
+    The mutable part of a scheduling problem: who is booked where, and how
+    many hours everyone has left.
+    """
+
+    def __init__(self, problem: ScheduleProblem):
+        snapshot = problem.snapshot
+        self.problem = problem
+        self.technicians_free = list(problem.technicians_available)
+        self.client_free = list(problem.client_available)
+        self.technician_minutes = [
+            tech.requested_minutes for tech in snapshot.technicians
+        ]
+        self.technician_day_minutes = [
+            [tech.max_minutes_per_day] * 5 for tech in snapshot.technicians
+        ]
+        self.client_minutes = [client.prescribed_minutes for client in snapshot.clients]
+        # per technician / client, per day, a bitmap of the blocks used
+        self.technician_blocks = [[0] * 5 for _ in snapshot.technicians]
+        self.client_blocks = [[0] * 5 for _ in snapshot.clients]
+        # technicians each client is already booked with
+        self.client_technicians = [0] * problem.client_count
+        # per day, per block, technicians with an appointment in that block
+        self.technicians_in_block = [[0] * problem.block_count for _ in WEEKDAYS]
+        # per day, per block, technicians with enough hours left for it
+        self.technicians_with_capacity = [[0] * problem.block_count for _ in WEEKDAYS]
+        self.placements = []
+
+        for appointment in snapshot.appointments:
+            self.book_existing(appointment)
+        for t in range(problem.technician_count):
+            self.update_capacity(t)
+
+    def book_existing(self, appointment: SnapshotAppointment):
+        problem = self.problem
+        c, t, day = appointment.client, appointment.technician, appointment.day
+        minutes = appointment.end - appointment.start
+
+        self.client_minutes[c] -= minutes
+        self.technician_minutes[t] -= minutes
+        if day in WEEKDAYS:
+            self.technician_day_minutes[t][day] -= minutes
+            for block in problem.overlapping_blocks(appointment.start, appointment.end):
+                slot = problem.slot_index(day, block)
+                self.client_free[c] &= ~(1 << slot)
+                self.technicians_free[slot] &= ~(1 << t)
+            block = problem.containing_block(appointment.start, appointment.end)
+            if block is not None:
+                self.client_blocks[c][day] |= 1 << block
+                self.technician_blocks[t][day] |= 1 << block
+                self.technicians_in_block[day][block] |= 1 << t
+        self.client_technicians[c] |= 1 << t
+
+    def update_capacity(self, t: int):
+        """
+        Recompute which blocks technician `t` still has enough hours for.
+        """
+        problem = self.problem
+        for day in WEEKDAYS:
+            for block in range(problem.block_count):
+                minutes = problem.block_minutes(block)
+                if (
+                    self.technician_minutes[t] >= minutes
+                    and self.technician_day_minutes[t][day] >= minutes
+                ):
+                    self.technicians_with_capacity[day][block] |= 1 << t
+                else:
+                    self.technicians_with_capacity[day][block] &= ~(1 << t)
+
+    def can_place(self, placement: Placement) -> bool:
+        c, t, day, block = placement
+        problem = self.problem
+        slot = problem.slot_index(day, block)
+        minutes = problem.block_minutes(block)
+        return (
+            bool(problem.eligible[c] >> t & 1)
+            and bool(self.client_free[c] >> slot & 1)
+            and bool(self.technicians_free[slot] >> t & 1)
+            and self.client_minutes[c] >= minutes
+            and self.technician_minutes[t] >= minutes
+            and self.technician_day_minutes[t][day] >= minutes
+        )
+
+    def place(self, placement: Placement):
+        c, t, day, block = placement
+        problem = self.problem
+        slot = problem.slot_index(day, block)
+        minutes = problem.block_minutes(block)
+
+        self.client_free[c] &= ~(1 << slot)
+        self.technicians_free[slot] &= ~(1 << t)
+        self.client_minutes[c] -= minutes
+        self.technician_minutes[t] -= minutes
+        self.technician_day_minutes[t][day] -= minutes
+        self.client_blocks[c][day] |= 1 << block
+        self.technician_blocks[t][day] |= 1 << block
+        self.technicians_in_block[day][block] |= 1 << t
+        self.client_technicians[c] |= 1 << t
+        self.update_capacity(t)
+        self.placements.append(placement)
+
+    def creates_split(self, blocks_used: int, block: int) -> bool:
+        block_count = self.problem.block_count
+        if block_count < 3:
+            return False
+        first, second, last = 1, 1 << 1, 1 << (block_count - 1)
+        used = blocks_used | 1 << block
+        return bool(used & first and used & last and not used & second)
+
+    def split_risk(self, day: int, block: int) -> int:
+        """
+        Return the technicians for whom a placement in this block would
+        create a split block.
+        """
+        last = self.problem.block_count - 1
+        if last < 2 or block not in (0, last):
+            return 0
+        in_block = self.technicians_in_block[day]
+        return in_block[last - block] & ~in_block[1]
+
+    def score(self) -> float:
+        return score_state(self)
+
+
+def score_state(state: ScheduleState) -> float:
+    """
+    Score a schedule on the soft goals.  Higher is better.
+    """
+    problem = state.problem
+    snapshot = problem.snapshot
+
+    scheduled_minutes = sum(
+        client.prescribed_minutes - state.client_minutes[c]
+        for c, client in enumerate(snapshot.clients)
+    )
+    fully_scheduled = sum(
+        1
+        for c, client in enumerate(snapshot.clients)
+        if client.prescribed_minutes > 0 and state.client_minutes[c] <= 0
+    )
+    split_blocks = sum(
+        count_split_blocks(blocks_by_day, problem.block_count)
+        for blocks_by_day in [*state.client_blocks, *state.technician_blocks]
+    )
+    past_technician_minutes = sum(
+        problem.block_minutes(block)
+        for c, t, _, block in state.placements
+        if t in snapshot.clients[c].past_technicians
+    )
+
+    return (
+        HOUR_WEIGHT * scheduled_minutes / 60
+        + FULLY_SCHEDULED_WEIGHT * fully_scheduled
+        - SPLIT_BLOCK_PENALTY * split_blocks
+        + PAST_TECHNICIAN_WEIGHT * past_technician_minutes / 60
+    )
+
+
+def greedy_solve(problem: ScheduleProblem, seed: int | None = None) -> Solution:
+    """
+    Build a schedule with a randomized greedy pass.
+
+    Clients are filled in order of how few options they have (with random
+    tie-breaking), and each of their appointments is placed in the slot and
+    with the technician that best serves the soft goals.
+    """
+    rng = random.Random(seed)
+    state = ScheduleState(problem)
+
+    def options(c):
+        return sum(
+            (problem.eligible[c] & state.technicians_free[slot]).bit_count()
+            for slot in iter_bits(state.client_free[c])
+        )
+
+    order = sorted(
+        range(problem.client_count),
+        key=lambda c: (options(c), rng.random()),
+    )
+
+    for c in order:
+        while state.client_minutes[c] >= problem.min_block_minutes > 0:
+            best = None
+
+            for slot in iter_bits(state.client_free[c]):
+                day, block = problem.slots[slot]
+                minutes = problem.block_minutes(block)
+                if minutes > state.client_minutes[c]:
+                    continue
+
+                candidates = (
+                    problem.eligible[c]
+                    & state.technicians_free[slot]
+                    & state.technicians_with_capacity[day][block]
+                )
+                if not candidates:
+                    continue
+
+                no_split = candidates & ~state.split_risk(day, block)
+                tiers = [
+                    no_split & state.client_technicians[c],
+                    no_split & problem.past_technicians[c],
+                    no_split,
+                    candidates,
+                ]
+                tier, technicians = next(
+                    (i, mask) for i, mask in enumerate(tiers) if mask
+                )
+
+                client_blocks = state.client_blocks[c][day]
+                score = (
+                    -tier
+                    - 2 * state.creates_split(client_blocks, block)
+                    # prefer days the client is already coming in
+                    + bool(client_blocks)
+                    + rng.random()
+                )
+                if best is None or score > best[0]:
+                    best = (score, day, block, technicians)
+
+            if best is None:
+                break
+
+            _, day, block, technicians = best
+            state.place(Placement(c, random_bit(technicians, rng), day, block))
+
+    return Solution(state.placements, state.score())
+
+
+def flow_solve(problem: ScheduleProblem, deadline: float | None = None):
+    """
+    Assign technicians to clients one block at a time, day by day, each as a
+    min-cost flow:
+
+        source -> client -> technician class -> sink
+        source -> client -> technician -> technician class -> sink
+
+    Technicians who cost the same (same skill level, Spanish, hour balance and
+    split block risk) are one class, with a capacity of how many of them are
+    free, so a client has an edge per class rather than per technician, plus
+    one to each of their current and past technicians for continuity.
+
+    Each appointment earns its hours, and the edge costs encode continuity,
+    skill level and Spanish surplus, and split blocks.  Hour balance comes
+    from making clients and technicians past half of their hours slightly more
+    expensive.  Every block's assignment is optimal given the ones before it,
+    which it's made after.
+
+    Returns None if the deadline (a `time.time()`) passes first.
+    """
+    snapshot = problem.snapshot
+    state = ScheduleState(problem)
+
+    def balance_cost(remaining, total):
+        return HOUR_BALANCE_COST if remaining * 2 <= total else 0
+
+    for slot, (day, block) in enumerate(problem.slots):
+        if deadline is not None and timer.time() > deadline:
+            return None
+
+        minutes = problem.block_minutes(block)
+        technicians = (
+            state.technicians_free[slot] & state.technicians_with_capacity[day][block]
+        )
+        if not technicians:
+            continue
+        split_risk = state.split_risk(day, block)
+
+        # class -> technicians in it, as a bitmap
+        classes = defaultdict(int)
+        for t in iter_bits(technicians):
+            tech = snapshot.technicians[t]
+            key = (
+                tech.skill_level,
+                tech.spanish_speaking,
+                balance_cost(state.technician_minutes[t], tech.requested_minutes),
+                bool(split_risk >> t & 1),
+            )
+            classes[key] |= 1 << t
+
+        graph = MinCostFlow()
+        source, sink = graph.add_node(), graph.add_node()
+        class_nodes = {}
+        for key, members in classes.items():
+            class_nodes[key] = graph.add_node()
+            graph.add_edge(class_nodes[key], sink, members.bit_count(), key[2])
+        technician_nodes = {}
+        # (edge, client, class members or technician, technician)
+        assignment_edges = []
+
+        for c, client in enumerate(snapshot.clients):
+            candidates = problem.eligible[c] & technicians
+            if (
+                not candidates
+                or not state.client_free[c] >> slot & 1
+                or state.client_minutes[c] < minutes
+            ):
+                continue
+
+            client_node = graph.add_node()
+            cost = -HOUR_WEIGHT * minutes // 60 + balance_cost(
+                state.client_minutes[c], client.prescribed_minutes
+            )
+            if state.creates_split(state.client_blocks[c][day], block):
+                cost += SPLIT_BLOCK_COST
+            graph.add_edge(source, client_node, 1, cost)
+
+            known = state.client_technicians[c] | problem.past_technicians[c]
+            for key, members in classes.items():
+                if not candidates & members:
+                    continue
+                skill_level, spanish_speaking, _, at_risk = key
+                cost = SKILL_SURPLUS_COST * (skill_level - client.req_skill_level)
+                if spanish_speaking and not client.req_spanish_speaking:
+                    cost += SPANISH_SURPLUS_COST
+                if at_risk:
+                    cost += SPLIT_BLOCK_COST
+                edge = graph.add_edge(client_node, class_nodes[key], 1, cost)
+                assignment_edges.append((edge, c, candidates & members))
+
+                for t in iter_bits(candidates & members & known):
+                    if t not in technician_nodes:
+                        technician_nodes[t] = graph.add_node()
+                        graph.add_edge(technician_nodes[t], class_nodes[key], 1, 0)
+                    if state.client_technicians[c] >> t & 1:
+                        continuity = CONTINUITY_COST
+                    else:
+                        continuity = PAST_TECHNICIAN_COST
+                    edge = graph.add_edge(
+                        client_node, technician_nodes[t], 1, cost + continuity
+                    )
+                    assignment_edges.append((edge, c, 1 << t))
+
+        graph.solve(source, sink)
+
+        # Place the assignments to a given technician first, then give those
+        # to a class any technician of it left
+        assignment_edges.sort(key=lambda assignment: assignment[2].bit_count() > 1)
+        for edge, c, options in assignment_edges:
+            if not graph.flow(edge):
+                continue
+            for t in iter_bits(options & state.technicians_free[slot]):
+                placement = Placement(c, t, day, block)
+                if state.can_place(placement):
+                    state.place(placement)
+                    break
+
+    return Solution(state.placements, state.score())
+
+
+def greedy_restarts(
+    problem: ScheduleProblem,
+    seed: int,
+    deadline: float,
+    progress: Callable[[Solution, Solution, int], None] | None = None,
+) -> tuple[Solution, int]:
+    """
+    Run randomized greedy restarts until the deadline (a `time.time()`) and
+    return the best solution and the number of runs.  At least one run is
+    always made.
+    """
+    rng = random.Random(seed)
+    started = timer.time()
+    best = None
+    runs = 0
+
+    while True:
+        solution = greedy_solve(problem, rng.randrange(2**32))
+        runs += 1
+        if best is None or solution.score > best.score:
+            best = solution
+        if progress:
+            progress(solution, best, runs)
+
+        # stop if another run would likely go past the deadline
+        now = timer.time()
+        if now + (now - started) / runs > deadline:
+            return best, runs
+
+
+# The problem of a worker process, built once per worker by `init_worker`
+worker_problem = None
+
+
+def init_worker(snapshot: ScheduleSnapshot):
+    global worker_problem
+    worker_problem = ScheduleProblem(snapshot)
+
+
+def run_worker(seed: int, deadline: float) -> tuple[Solution, int]:
+    return greedy_restarts(worker_problem, seed, deadline)
+
+
+def solve(
+    snapshot: ScheduleSnapshot,
+    time_budget: float = 10,
+    seed: int | None = None,
+    progress: Callable[[dict], None] | None = None,
+    mode: str = GREEDY,
+    workers: int = 1,
+) -> Solution:
+    """
+    Return the best solution found for the snapshot.
+
+    In greedy mode, randomized restarts are run until the time budget (in
+    seconds) is used up, spread over `workers` processes.  Flow mode is
+    deterministic, so it runs once, after a single greedy run it falls back on
+    if it doesn't finish within the time budget.
+    """
+    rng = random.Random(seed)
+    started = timer.time()
+    deadline = started + time_budget
+
+    def report(solution, best, runs):
+        if progress:
+            progress(
+                {
+                    "runs": runs,
+                    "elapsed": round(timer.time() - started, 2),
+                    "score": round(solution.score, 2),
+                    "best_score": round(best.score, 2),
+                }
+            )
+
+    if mode == FLOW:
+        # a greedy run to fall back on if the flow doesn't finish in time
+        problem = ScheduleProblem(snapshot)
+        best = greedy_solve(problem, rng.randrange(2**32))
+        report(best, best, 1)
+        solution = flow_solve(problem, deadline)
+        if solution is not None:
+            best = max(best, solution, key=lambda solution: solution.score)
+            report(solution, best, 2)
+        return best
+
+    if workers <= 1:
+        best, _ = greedy_restarts(
+            ScheduleProblem(snapshot), rng.randrange(2**32), deadline, report
+        )
+        return best
+
+    # Each worker gets the snapshot once, builds its own problem from it, and
+    # runs restarts with its own seed until the deadline.  Only the best
+    # solution of each worker is sent back.
+    # NOTE: Workers are forked so they don't need to set up Django again; they
+    # never touch the database.
+    best = None
+    runs = 0
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=init_worker,
+        initargs=(snapshot,),
+    ) as executor:
+        futures = [
+            executor.submit(run_worker, rng.randrange(2**32), deadline)
+            for _ in range(workers)
+        ]
+        for future in as_completed(futures):
+            solution, worker_runs = future.result()
+            runs += worker_runs
+            if best is None or solution.score > best.score:
+                best = solution
+            report(solution, best, runs)
+
+    return best
+
+
+def write_solution(
+    schedule: Schedule, snapshot: ScheduleSnapshot, solution: Solution
+) -> list[Appointment]:
+    """
+    Bulk create the appointments of a solution in the given schedule.
+    """
+    blocks = list(Block.objects.order_by("start_time"))
+    appointments = [
+        Appointment(
+            client_id=snapshot.clients[c].id,
+            technician_id=snapshot.technicians[t].id,
+            day=day,
+            start_time=blocks[block].start_time,
+            end_time=blocks[block].end_time,
+            schedule=schedule,
+        )
+        for c, t, day, block in solution.placements
+    ]
+    with transaction.atomic():
+        created = Appointment.objects.bulk_create(appointments)
+        record_upserts(Appointment, created)
+        bump_schedule_revision(schedule.pk)
+        publish_reset(schedule.pk)
+    return created
+
+
+def auto_schedule(
+    schedule: Schedule,
+    time_budget: float = 10,
+    seed: int | None = None,
+    progress: Callable[[dict], None] | None = None,
+    mode: str = GREEDY,
+    workers: int | None = None,
+) -> dict:
+    """
+    Fill a sandbox schedule with appointments and return a summary.
+
+    `workers` defaults to the `AUTO_SCHEDULE_WORKERS` setting.
+    """
+    if schedule is None or schedule.pk == get_current_schedule_id():
+        raise ValueError("Only sandbox schedules can be filled automatically.")
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode '{mode}'.")
+
+    status = {}
+
+    def report(current):
+        status.update(current)
+        if progress:
+            progress(current)
+
+    if workers is None:
+        workers = settings.AUTO_SCHEDULE_WORKERS
+
+    snapshot = build_snapshot(schedule)
+    solution = solve(snapshot, time_budget, seed, report, mode, workers)
+    created = write_solution(schedule, snapshot, solution)
+
+    return {
+        "created": len(created),
+        "hours": sum(appointment.duration_minutes for appointment in created) / 60,
+        "score": round(solution.score, 2),
+        "runs": status["runs"],
+        "elapsed": status["elapsed"],
+    }
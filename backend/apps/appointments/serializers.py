@@ -1,7 +1,12 @@
+from collections import defaultdict
+
 from django.db import transaction
 from rest_framework import serializers
 
+from .copies import copy_schedule
 from .models import (
+    MINUTE_FIELDS,
+    NAME_INDEX_FIELDS,
     Appointment,
     Availability,
     Block,
@@ -9,6 +14,7 @@ from .models import (
     Schedule,
     Technician,
     TherapyAppointment,
+    get_current_schedule,
 )
 
 
@@ -22,85 +28,122 @@ class ScheduleSerializer(serializers.ModelSerializer):
     class Meta:
         model = Schedule
         fields = "__all__"
+        # NOTE: Overlays are created on top of the current schedule
+        read_only_fields = ["parent"]
+
+    def validate(self, data):
+        is_overlay = data.get("is_overlay", False)
+        if self.instance is not None:
+            if is_overlay != self.instance.is_overlay and "is_overlay" in data:
+                raise serializers.ValidationError(
+                    "A schedule can't be made an overlay, or a plain schedule, "
+                    "after it's created."
+                )
+        elif is_overlay and data.get("copy_from_current"):
+            raise serializers.ValidationError(
+                "An overlay reads the current schedule's rows instead of "
+                "copying them."
+            )
+        return data
 
     def create(self, validated_data):
         with transaction.atomic():
             copy = validated_data.pop("copy_from_current", False)
+            if validated_data.get("is_overlay"):
+                validated_data["parent"] = get_current_schedule()
 
             schedule = super().create(validated_data)
 
             if copy:
-                current_availabilities = Availability.objects.filter(schedule=None)
-                current_appointments = Appointment.objects.filter(schedule=None)
-                current_therapy_appointments = TherapyAppointment.objects.filter(
-                    schedule=None
-                )
-
-                new_availabilities = []
-                for availability in current_availabilities:
-                    new_availabilities.append(
-                        Availability(
-                            content_type=availability.content_type,
-                            object_id=availability.object_id,
-                            day=availability.day,
-                            start_time=availability.start_time,
-                            end_time=availability.end_time,
-                            is_sub=availability.is_sub,
-                            in_clinic=availability.in_clinic,
-                            schedule=schedule,
-                        )
-                    )
-
-                new_appointments = []
-                for appointment in current_appointments:
-                    new_appointments.append(
-                        Appointment(
-                            client=appointment.client,
-                            technician=appointment.technician,
-                            day=appointment.day,
-                            start_time=appointment.start_time,
-                            end_time=appointment.end_time,
-                            in_clinic=appointment.in_clinic,
-                            is_preschool_or_adaptive=appointment.is_preschool_or_adaptive,
-                            notes=appointment.notes,
-                            schedule=schedule,
-                        )
-                    )
-
-                new_therapy_appointments = []
-                for therapy_appointment in current_therapy_appointments:
-                    new_therapy_appointments.append(
-                        TherapyAppointment(
-                            client=therapy_appointment.client,
-                            therapy_type=therapy_appointment.therapy_type,
-                            day=therapy_appointment.day,
-                            start_time=therapy_appointment.start_time,
-                            end_time=therapy_appointment.end_time,
-                            notes=therapy_appointment.notes,
-                            schedule=schedule,
-                        )
-                    )
-
-                Availability.objects.bulk_create(new_availabilities)
-                Appointment.objects.bulk_create(new_appointments)
-                TherapyAppointment.objects.bulk_create(new_therapy_appointments)
+                copy_schedule(get_current_schedule(), schedule)
 
             return schedule
 
 
-class ClientBasicSerializer(serializers.ModelSerializer):
+class DeferredNotesMixin:
+    """
+    Leave the notes out when the view deferred them (see
+    `views.DeferredNotesMixin`).
+    """
+
+    notes_fields = ["notes"]
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.context.get("defer_notes"):
+            for name in self.notes_fields:
+                del fields[name]
+        return fields
+
+
+COMPACT = "compact"
+
+
+def is_compact(request) -> bool:
+    """
+    Whether the request asks for the compact representation, with
+    `?representation=compact` or an `X-Representation: compact` header.
+    """
+    representation = request.query_params.get(
+        "representation", request.headers.get("X-Representation", "")
+    )
+    return representation == COMPACT
+
+
+class SideLoads:
+    """
+    The clients and technicians a compact response references by ID (see
+    `views.CompactMixin`), to include each of them once.
+    """
+
+    def __init__(self):
+        self.referenced = defaultdict(set)
+        # the ones serialized in full anyway, E.G. the listed clients
+        self.present = defaultdict(set)
+
+    def reference(self, name: str, pk):
+        if pk is not None:
+            self.referenced[name].add(pk)
+
+    def add_present(self, name: str, pk):
+        self.present[name].add(pk)
+
+    def get_missing(self, name: str) -> set:
+        return self.referenced[name] - self.present[name]
+
+
+class ClientBasicSerializer(DeferredNotesMixin, serializers.ModelSerializer):
+    notes_fields = ["notes", "sub_notes"]
+
     class Meta:
         model = Client
-        fields = "__all__"
+        exclude = NAME_INDEX_FIELDS
 
 
-class TechnicianBasicSerializer(serializers.ModelSerializer):
+class TechnicianBasicSerializer(DeferredNotesMixin, serializers.ModelSerializer):
     class Meta:
         model = Technician
-        fields = "__all__"
+        exclude = NAME_INDEX_FIELDS
+
 
+class AppointmentBasicSerializer(serializers.ModelSerializer):
+    """
+    An appointment with its client and technician as IDs.
+    """
+
+    class Meta:
+        model = Appointment
+        exclude = MINUTE_FIELDS
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+
+        data["duration"] = instance.duration
 
-class AppointmentSerializer(serializers.ModelSerializer):
+        return data
+
+
+class AppointmentSerializer(DeferredNotesMixin, serializers.ModelSerializer):
     repeats = serializers.ListField(
         child=serializers.IntegerField(),
         allow_empty=True,
@@ -109,12 +152,21 @@ class AppointmentSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Appointment
-        fields = "__all__"
+        exclude = MINUTE_FIELDS
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
 
         data["duration"] = instance.duration
+
+        side_loads = self.context.get("side_loads")
+        if side_loads is not None:
+            data["client_id"] = data.pop("client")
+            data["technician_id"] = data.pop("technician")
+            side_loads.reference("clients", instance.client_id)
+            side_loads.reference("technicians", instance.technician_id)
+            return data
+
         data["client"] = ClientBasicSerializer(
             instance.client, context=self.context
         ).data
@@ -149,10 +201,60 @@ class AppointmentSerializer(serializers.ModelSerializer):
         return created
 
 
-class TherapyAppointmentSerializer(serializers.ModelSerializer):
+class AppointmentPlacementSerializer(serializers.Serializer):
+    """
+    A candidate (client, technician, day, start time, end time) placement to
+    evaluate warnings for.
+    """
+
+    client_id = serializers.UUIDField()
+    tech_id = serializers.UUIDField()
+    day = serializers.IntegerField(min_value=0, max_value=4)
+    start_time = serializers.TimeField()
+    end_time = serializers.TimeField()
+    appointment_id = serializers.UUIDField(required=False, allow_null=True)
+
+
+class BatchWarningsSerializer(serializers.Serializer):
+    placements = AppointmentPlacementSerializer(many=True, max_length=1000)
+
+
+class AppointmentSlotSerializer(serializers.Serializer):
+    technician_id = serializers.UUIDField()
+    day = serializers.IntegerField(min_value=0, max_value=4)
+    start_time = serializers.TimeField()
+    end_time = serializers.TimeField()
+
+
+class AppointmentChangeSerializer(serializers.Serializer):
+    """
+    A change from the diff returned by the `improve` action.
+    """
+
+    action = serializers.ChoiceField(choices=["update", "create"])
+    appointment_id = serializers.UUIDField(required=False, allow_null=True)
+    client_id = serializers.UUIDField()
+    before = AppointmentSlotSerializer(required=False, allow_null=True)
+    after = AppointmentSlotSerializer()
+
+    def validate(self, data):
+        if data["action"] == "update" and (
+            not data.get("appointment_id") or not data.get("before")
+        ):
+            raise serializers.ValidationError(
+                "Updates need an appointment_id and what it was before."
+            )
+        return data
+
+
+class ApplyChangesSerializer(serializers.Serializer):
+    changes = AppointmentChangeSerializer(many=True)
+
+
+class TherapyAppointmentSerializer(DeferredNotesMixin, serializers.ModelSerializer):
     class Meta:
         model = TherapyAppointment
-        fields = "__all__"
+        exclude = MINUTE_FIELDS
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
@@ -171,7 +273,7 @@ class TherapyAppointmentSerializer(serializers.ModelSerializer):
 class AvailabilitySerializer(serializers.ModelSerializer):
     class Meta:
         model = Availability
-        fields = "__all__"
+        exclude = MINUTE_FIELDS
         read_only_fields = [
             "content_type",
             "object_id",
@@ -197,14 +299,19 @@ class BlockSerialzier(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class ClientSerializer(serializers.ModelSerializer):
+class ClientSerializer(DeferredNotesMixin, serializers.ModelSerializer):
+    notes_fields = ["notes", "sub_notes"]
+
     class Meta:
         model = Client
-        fields = "__all__"
+        exclude = NAME_INDEX_FIELDS
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
         request = self.context.get("request")
+        side_loads = self.context.get("side_loads")
+        if side_loads is not None:
+            side_loads.add_present("clients", instance.pk)
 
         if request and request.query_params.get("expand_properties"):
             data["computed_properties"] = {
@@ -218,41 +325,53 @@ class ClientSerializer(serializers.ModelSerializer):
 
         if request and request.query_params.get("expand_appointments"):
             data["appointments"] = AppointmentSerializer(
-                instance.appointments.filter(schedule=request.schedule),
+                instance.appointments.in_schedule(request.schedule),
                 many=True,
                 context=self.context,
             ).data
             data["therapy_appointments"] = TherapyAppointmentSerializer(
-                instance.therapy_appointments.filter(schedule=request.schedule),
+                instance.therapy_appointments.in_schedule(request.schedule),
                 many=True,
                 context=self.context,
             ).data
 
         if request and request.query_params.get("expand_availabilities"):
             data["availabilities"] = AvailabilitySerializer(
-                instance.availabilities.filter(schedule=request.schedule),
+                instance.availabilities.in_schedule(request.schedule),
                 many=True,
                 context=self.context,
             ).data
 
         if request and request.query_params.get("expand_current_technicians"):
             # Serialize current technicians from appointments
-            current_technician_ids = instance.appointments.filter(
-                schedule=request.schedule,
+            current_technician_ids = instance.appointments.in_schedule(
+                request.schedule,
             ).values_list(
                 "technician__id",
                 flat=True,
             )
-            current_technicians_qs = Technician.objects.filter(
-                id__in=current_technician_ids,
-            ).distinct()
-            data["current_technicians"] = TechnicianBasicSerializer(
-                current_technicians_qs,
-                many=True,
-                context=self.context,
-            ).data
+            if side_loads is not None:
+                ids = list(dict.fromkeys(current_technician_ids))
+                data["current_technician_ids"] = ids
+                for pk in ids:
+                    side_loads.reference("technicians", pk)
+            else:
+                current_technicians_qs = Technician.objects.filter(
+                    id__in=current_technician_ids,
+                ).distinct()
+                data["current_technicians"] = TechnicianBasicSerializer(
+                    current_technicians_qs,
+                    many=True,
+                    context=self.context,
+                ).data
 
         # Serialize past technicians
+        if side_loads is not None:
+            # already listed by ID, as `past_technicians`
+            for technician in instance.past_technicians.all():
+                side_loads.reference("technicians", technician.pk)
+            return data
+
         data["past_technicians"] = TechnicianBasicSerializer(
             instance.past_technicians.all(),
             many=True,
@@ -262,14 +381,17 @@ class ClientSerializer(serializers.ModelSerializer):
         return data
 
 
-class TechnicianSerializer(serializers.ModelSerializer):
+class TechnicianSerializer(DeferredNotesMixin, serializers.ModelSerializer):
     class Meta:
         model = Technician
-        fields = "__all__"
+        exclude = NAME_INDEX_FIELDS
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
         request = self.context.get("request")
+        side_loads = self.context.get("side_loads")
+        if side_loads is not None:
+            side_loads.add_present("technicians", instance.pk)
 
         if request and request.query_params.get("expand_properties"):
             data["computed_properties"] = {
@@ -283,16 +405,43 @@ class TechnicianSerializer(serializers.ModelSerializer):
 
         if request and request.query_params.get("expand_appointments"):
             data["appointments"] = AppointmentSerializer(
-                instance.appointments.filter(schedule=request.schedule),
+                instance.appointments.in_schedule(request.schedule),
                 many=True,
                 context=self.context,
             ).data
 
         if request and request.query_params.get("expand_availabilities"):
             data["availabilities"] = AvailabilitySerializer(
-                instance.availabilities.filter(schedule=request.schedule),
+                instance.availabilities.in_schedule(request.schedule),
                 many=True,
                 context=self.context,
             ).data
 
         return data
+
+
+# What compact responses include the entities they reference with
+SIDE_LOADED = {
+    "clients": (
+        ClientBasicSerializer,
+        Client.objects.prefetch_related("past_technicians"),
+    ),
+    "technicians": (TechnicianBasicSerializer, Technician.objects.all()),
+}
+
+
+def get_included(side_loads: SideLoads, context: dict) -> dict:
+    """
+    The referenced clients and technicians by ID, loaded with one query each.
+    """
+    included = {}
+    for name, (serializer_class, queryset) in SIDE_LOADED.items():
+        ids = side_loads.get_missing(name)
+        rows = []
+        if ids:
+            queryset = queryset.filter(pk__in=ids)
+            if context.get("defer_notes"):
+                queryset = queryset.defer(*serializer_class.notes_fields)
+            rows = serializer_class(queryset, many=True, context=context).data
+        included[name] = {row["id"]: row for row in rows}
+    return included
@@ -0,0 +1,184 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import availability_index, changes, events, overlays, revisions
+from .availability_index import APPOINTMENT, AVAILABILITY
+from .models import (
+    Appointment,
+    Availability,
+    Block,
+    Client,
+    CurrentSchedule,
+    Schedule,
+    ScheduleChange,
+    Technician,
+    TherapyAppointment,
+    bulk_written,
+    clear_current_schedule,
+    current_schedule_read,
+)
+
+
+def _on_commit_for_schedule(kind, instance, apply):
+    """
+    Apply a write to the built index of the instance's schedule once the
+    transaction commits.  Indexes of other schedules that still hold the row
+    (I.E. its schedule was changed) are discarded.
+    """
+    for index in availability_index.get_built_indexes():
+        if index.schedule_id == instance.schedule_id:
+            transaction.on_commit(lambda index=index: apply(index))
+        elif index.contains(kind, instance.pk):
+            availability_index.discard_index(index.schedule_id)
+
+
+@receiver(post_save, sender=Availability)
+def availability_saved(sender, instance, created, **kwargs):
+    _on_commit_for_schedule(
+        AVAILABILITY,
+        instance,
+        lambda index: index.save_availability(instance),
+    )
+
+
+@receiver(post_delete, sender=Availability)
+def availability_deleted(sender, instance, **kwargs):
+    _on_commit_for_schedule(
+        AVAILABILITY,
+        instance,
+        lambda index: index.delete_availability(instance.pk),
+    )
+
+
+@receiver(post_save, sender=Appointment)
+def appointment_saved(sender, instance, created, **kwargs):
+    _on_commit_for_schedule(
+        APPOINTMENT,
+        instance,
+        lambda index: index.save_appointment(instance),
+    )
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_deleted(sender, instance, **kwargs):
+    _on_commit_for_schedule(
+        APPOINTMENT,
+        instance,
+        lambda index: index.delete_appointment(instance.pk),
+    )
+
+
+@receiver(post_save, sender=Technician)
+def technician_saved(sender, instance, created, **kwargs):
+    for index in availability_index.get_built_indexes():
+        transaction.on_commit(lambda index=index: index.save_technician(instance))
+
+
+@receiver(post_delete, sender=Technician)
+def technician_deleted(sender, instance, **kwargs):
+    for index in availability_index.get_built_indexes():
+        transaction.on_commit(lambda index=index: index.delete_technician(instance.pk))
+
+
+# Change feed
+
+
+def record_saved(sender, instance, **kwargs):
+    changes.record_change(instance, ScheduleChange.UPSERT)
+
+
+def record_deleted(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Schedule) or getattr(origin, "model", None) is Schedule:
+        # the schedule and its feed are being deleted
+        return
+    changes.record_change(instance, ScheduleChange.DELETE)
+
+
+for model in changes.FEED_MODELS:
+    post_save.connect(record_saved, sender=model)
+    post_delete.connect(record_deleted, sender=model)
+
+
+@receiver(m2m_changed, sender=Client.past_technicians.through)
+def past_technicians_changed(sender, instance, action, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    _bump_revision(revisions.SHARED)
+    if isinstance(instance, Client):
+        changes.record_change(instance, ScheduleChange.UPSERT)
+    elif pk_set:
+        # changed from the technician's side
+        changes.record_upserts(Client, [Client(pk=pk) for pk in pk_set])
+
+
+# Revisions
+
+
+def _bump_revision(key):
+    revisions.bump_revision(key)
+    # the write is applied to the built indexes above, or they don't read it
+    availability_index.expect_revision(key)
+
+
+def bump_revision(sender, instance, **kwargs):
+    if sender in (Appointment, Availability, TherapyAppointment):
+        _bump_revision(str(instance.schedule_id))
+    else:
+        _bump_revision(revisions.SHARED)
+
+
+@receiver(bulk_written)
+def bulk_written_bump_revisions(sender, schedule_ids, **kwargs):
+    # NOTE: The built indexes aren't updated, so they're rebuilt on next use
+    if schedule_ids is None:
+        revisions.bump_revision(revisions.SHARED)
+    for schedule_id in schedule_ids or []:
+        revisions.bump_schedule_revision(schedule_id)
+
+
+for model in [Appointment, Availability, TherapyAppointment, Client, Technician, Block]:
+    post_save.connect(bump_revision, sender=model)
+    post_delete.connect(bump_revision, sender=model)
+
+
+# Events
+
+
+def publish_saved(sender, instance, **kwargs):
+    events.publish_change(instance, ScheduleChange.UPSERT)
+
+
+def publish_deleted(sender, instance, **kwargs):
+    events.publish_change(instance, ScheduleChange.DELETE)
+
+
+for model in [Appointment, Availability, TherapyAppointment]:
+    post_save.connect(publish_saved, sender=model)
+    post_delete.connect(publish_deleted, sender=model)
+
+
+# Current schedule
+
+
+@receiver(current_schedule_read)
+def watch_current_schedule(sender, **kwargs):
+    # forget it once another schedule is promoted, in whichever process
+    events.watch_current_moved(clear_current_schedule)
+
+
+@receiver(post_save, sender=CurrentSchedule)
+def current_schedule_saved(sender, instance, **kwargs):
+    # this process right away, the others when they're notified
+    transaction.on_commit(clear_current_schedule)
+    events.publish_current_moved()
+
+
+# Overlays
+
+
+@receiver(pre_delete, sender=Schedule)
+def schedule_deleted(sender, instance, **kwargs):
+    # its rows are about to be deleted
+    for overlay in instance.overlays.filter(is_overlay=True):
+        overlays.materialize(overlay)
@@ -1,8 +1,73 @@
+import asyncio
+import json
+import random
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from auditlog.models import LogEntry
+from cryptography.fernet import Fernet
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from encrypted_model_fields.fields import encrypt_str
+from faker import Faker
+from knox.models import AuthToken
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from .availability_index import clear_indexes, get_index
+from .blind_index import get_exact_index
+from .changes import SETTLE_SECONDS
+from .decrypt_cache import DecryptCache, get_decrypt_cache
+from .events import (
+    CURRENT,
+    CURRENT_MOVED_EVENT,
+    MAX_PENDING_EVENTS,
+    RESET_EVENT,
+    get_hub,
+)
+from .flow import MinCostFlow
+from .improver import (
+    ImprovementState,
+    StaleChangeError,
+    apply_changes,
+    improve_schedule,
+)
+from .management.commands.explain_queries import get_queries
+from .matcher import (
+    find_available_technicians,
+    find_repeatable_appointment_days,
+    get_appointment_warnings,
+)
+from .models import (
+    Appointment,
+    Availability,
+    Block,
+    Client,
+    CurrentSchedule,
+    Schedule,
+    ScheduleChange,
+    Technician,
+    TherapyAppointment,
+    clear_current_schedule,
+    current_schedule_read,
+    get_current_schedule,
+)
+from .response_cache import get_cache, get_fernet
+from .scheduler import ScheduleProblem, auto_schedule, build_snapshot
+from .serializers import ClientBasicSerializer, TechnicianBasicSerializer
+from .streaming import Rows, render
 
-from .matcher import find_available_technicians
-from .models import Appointment, Availability, Block, Client, Technician
+User = get_user_model()
 
 
 class AvailabilityTestCase(TestCase):
@@ -338,3 +403,2388 @@ class AvailabilityTestCase(TestCase):
         )
 
         self.assertEqual(self.client.total_hours(), 11.5)
+
+    def test_manually_maxed_out(self):
+        """
+        Assert that a technician who is manually maxed out is not returned.
+        """
+
+        self.technician.is_manually_maxed_out = True
+        self.technician.save()
+
+        block_1_technicians = find_available_technicians(
+            self.client,
+            0,
+            self.block_1.start_time,
+            self.block_1.end_time,
+        )
+        self.assertEqual(len(block_1_technicians), 0)
+
+    def test_instance_technician_always_returned(self):
+        """
+        Assert that the technician of the appointment being edited is returned
+        even if they would otherwise be filtered out.
+        """
+
+        appointment = Appointment.objects.create(
+            client=self.client,
+            technician=self.technician,
+            day=0,
+            start_time=self.block_1.start_time,
+            end_time=self.block_1.end_time,
+        )
+
+        block_1_technicians = find_available_technicians(
+            self.client,
+            0,
+            "09:00:00",
+            "12:00:00",
+            instance=appointment,
+        )
+        self.assertEqual(list(block_1_technicians), [self.technician])
+
+    def test_constant_number_of_queries(self):
+        """
+        Assert that finding available technicians costs one set-based query
+        while the availability index is cold, and two (index fingerprint and
+        result) once it is built, no matter how many technicians there are.
+        Both paths return the same technicians.
+        """
+
+        content_type = ContentType.objects.get_for_model(Technician)
+        for i in range(20):
+            technician = Technician.objects.create(
+                first_name="Tech",
+                last_name=str(i),
+                requested_hours=3 if i % 2 else 40,
+            )
+            Availability.objects.create(
+                content_type=content_type,
+                object_id=technician.id,
+                day=0,
+                start_time=self.block_1.start_time,
+                end_time=self.block_1.end_time,
+            )
+            # book every other technician for a full block on another day,
+            # which maxes out those requesting 3 hours
+            if i % 4 < 2:
+                Appointment.objects.create(
+                    client=Client.objects.create(first_name="Client", last_name=str(i)),
+                    technician=technician,
+                    day=i % 5,
+                    start_time=self.block_2.start_time,
+                    end_time=self.block_2.end_time,
+                )
+
+        clear_indexes()
+        with self.assertNumQueries(1):
+            cold_technicians = list(
+                find_available_technicians(
+                    self.client,
+                    0,
+                    self.block_1.start_time,
+                    self.block_1.end_time,
+                )
+            )
+
+        # build the index
+        with self.captureOnCommitCallbacks(execute=True):
+            get_index()
+
+        with self.assertNumQueries(2):
+            block_1_technicians = list(
+                find_available_technicians(
+                    self.client,
+                    0,
+                    self.block_1.start_time,
+                    self.block_1.end_time,
+                )
+            )
+
+        # 1 original technician + 10 requesting 40 hours + 5 requesting 3
+        # hours that have not been booked yet
+        self.assertEqual(len(block_1_technicians), 16)
+        self.assertEqual(len(set(block_1_technicians)), 16)
+        self.assertEqual(block_1_technicians, cold_technicians)
+
+    def test_index_updated_incrementally(self):
+        """
+        Assert that an appointment saved in this process is applied to the
+        availability index without rebuilding it.
+        """
+
+        with self.captureOnCommitCallbacks(execute=True):
+            index = get_index()
+        slots = index.technician_slots(self.technician.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.create(
+                client=self.client,
+                technician=self.technician,
+                day=0,
+                start_time="09:00:00",
+                end_time="10:00:00",
+            )
+
+        self.assertIs(get_index(), index)
+        # readers holding the technician's slots don't see them change
+        self.assertEqual(slots.appointments, {})
+        self.assertEqual(
+            len(index.technician_slots(self.technician.id).appointments), 1
+        )
+        block_1_technicians = find_available_technicians(
+            self.client,
+            0,
+            "10:00:00",
+            "12:00:00",
+        )
+        self.assertEqual(list(block_1_technicians), [self.technician])
+        block_1_technicians = find_available_technicians(
+            self.client,
+            0,
+            "09:30:00",
+            "12:00:00",
+        )
+        self.assertEqual(len(block_1_technicians), 0)
+
+    def test_index_rebuilt_after_bulk_write(self):
+        """
+        Assert that writes which don't send signals cause the availability
+        index to be rebuilt.
+        """
+
+        with self.captureOnCommitCallbacks(execute=True):
+            index = get_index()
+
+        Appointment.objects.bulk_create(
+            [
+                Appointment(
+                    client=self.client,
+                    technician=self.technician,
+                    day=0,
+                    start_time=self.block_1.start_time,
+                    end_time=self.block_1.end_time,
+                )
+            ]
+        )
+
+        self.assertIsNot(get_index(), index)
+        block_1_technicians = find_available_technicians(
+            self.client,
+            0,
+            self.block_1.start_time,
+            self.block_1.end_time,
+        )
+        self.assertEqual(len(block_1_technicians), 0)
+
+    def test_index_rebuilt_after_update(self):
+        """
+        Assert that a queryset update, which doesn't set `updated_at`, causes
+        the availability index to be rebuilt.
+        """
+
+        appointment = Appointment.objects.create(
+            client=self.client,
+            technician=self.technician,
+            day=1,
+            start_time=self.block_1.start_time,
+            end_time=self.block_1.end_time,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            index = get_index()
+
+        Appointment.objects.filter(pk=appointment.pk).update(day=0)
+
+        self.assertIsNot(get_index(), index)
+        block_1_technicians = find_available_technicians(
+            self.client,
+            0,
+            self.block_1.start_time,
+            self.block_1.end_time,
+        )
+        self.assertEqual(len(block_1_technicians), 0)
+
+    def test_index_not_kept_after_rollback(self):
+        """
+        Assert that an index built inside a transaction that's rolled back
+        isn't kept, even once the revisions are back where they were.
+        """
+
+        with self.captureOnCommitCallbacks(execute=True):
+            index = get_index()
+
+        try:
+            with transaction.atomic():
+                Appointment.objects.create(
+                    client=self.client,
+                    technician=self.technician,
+                    day=0,
+                    start_time=self.block_1.start_time,
+                    end_time=self.block_1.end_time,
+                )
+                get_index()
+                raise IntegrityError
+        except IntegrityError:
+            pass
+
+        self.assertIs(get_index(), index)
+
+    def test_repeatable_appointment_days(self):
+        """
+        Assert that only days both the client and technician are available and
+        the technician is free are returned.
+        """
+
+        for day in [1, 2, 3]:
+            Availability.objects.create(
+                content_type=ContentType.objects.get_for_model(Client),
+                object_id=self.client.id,
+                day=day,
+                start_time=self.block_1.start_time,
+                end_time=self.block_1.end_time,
+            )
+        for day in [1, 3]:
+            Availability.objects.create(
+                content_type=ContentType.objects.get_for_model(Technician),
+                object_id=self.technician.id,
+                day=day,
+                start_time="08:00:00",
+                end_time="12:00:00",
+            )
+        self.technician.requested_hours = 40
+        self.technician.save()
+        Appointment.objects.create(
+            client=Client.objects.create(first_name="Other", last_name="Client"),
+            technician=self.technician,
+            day=3,
+            start_time="11:00:00",
+            end_time="12:00:00",
+        )
+
+        repeatable_days = find_repeatable_appointment_days(
+            self.client,
+            self.technician,
+            "0",
+            "09:00:00",
+            "12:00:00",
+        )
+        self.assertEqual(repeatable_days, [1])
+
+
+class AppointmentWarningsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+
+        self.block_1 = Block.objects.create(
+            start_time="09:00:00",
+            end_time="12:00:00",
+        )
+        self.block_2 = Block.objects.create(
+            start_time="12:30:00",
+            end_time="15:30:00",
+        )
+        self.block_3 = Block.objects.create(
+            start_time="16:00:00",
+            end_time="19:00:00",
+        )
+        self.client_instance = Client.objects.create(
+            first_name="Test",
+            last_name="Client",
+            prescribed_hours=6,
+        )
+        self.technician = Technician.objects.create(
+            first_name="Test",
+            last_name="Technician",
+            requested_hours=40,
+            max_hours_per_day=8,
+        )
+
+        for content_type, object_id in [
+            (ContentType.objects.get_for_model(Client), self.client_instance.id),
+            (ContentType.objects.get_for_model(Technician), self.technician.id),
+        ]:
+            for block in [self.block_1, self.block_2, self.block_3]:
+                Availability.objects.create(
+                    content_type=content_type,
+                    object_id=object_id,
+                    day=0,
+                    start_time=block.start_time,
+                    end_time=block.end_time,
+                )
+
+        self.appointment = Appointment.objects.create(
+            client=self.client_instance,
+            technician=self.technician,
+            day=0,
+            start_time=self.block_3.start_time,
+            end_time=self.block_3.end_time,
+        )
+
+    def placement(self, start_time, end_time, day=0, **kwargs):
+        return {
+            "client_id": str(self.client_instance.id),
+            "tech_id": str(self.technician.id),
+            "day": day,
+            "start_time": start_time,
+            "end_time": end_time,
+            **kwargs,
+        }
+
+    def test_get_warnings(self):
+        """
+        Assert that the single placement endpoint reports split blocks and
+        unavailability.
+        """
+
+        response = self.client.get(
+            reverse("appointment-get-warnings"),
+            self.placement("09:00:00", "12:00:00"),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            [
+                "This appointment will create a split block for Test Client",
+                "This appointment will create a split block for Test Technician",
+            ],
+        )
+
+        response = self.client.get(
+            reverse("appointment-get-warnings"),
+            self.placement("09:00:00", "12:00:00", day=1),
+        )
+        self.assertEqual(
+            response.json(),
+            [
+                "Test Client is not available on Tuesday during this time",
+                "Test Technician is not available on Tuesday during this time",
+            ],
+        )
+
+    def test_batch_warnings(self):
+        """
+        Assert that the batch endpoint returns the same warnings as the single
+        placement endpoint, in order.
+        """
+
+        placements = [
+            self.placement("09:00:00", "12:00:00"),
+            self.placement("12:30:00", "15:30:00"),
+            self.placement("17:00:00", "19:00:00"),
+            self.placement(
+                "17:00:00", "19:00:00", appointment_id=str(self.appointment.id)
+            ),
+            self.placement("09:00:00", "12:00:00", day=1),
+        ]
+
+        response = self.client.post(
+            reverse("appointment-batch-warnings"),
+            {"placements": placements},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+        expected = [
+            self.client.get(reverse("appointment-get-warnings"), placement).json()
+            for placement in placements
+        ]
+        self.assertEqual(response.json(), expected)
+        self.assertEqual(response.json()[1], [])
+        self.assertEqual(
+            response.json()[2],
+            [
+                "Test Client is already booked on Monday during this time",
+                "Test Technician is already booked on Monday during this time",
+            ],
+        )
+        self.assertEqual(response.json()[3], [])
+
+    def test_batch_warnings_constant_number_of_queries(self):
+        """
+        Assert that the number of queries does not grow with the number of
+        placements.
+        """
+
+        def post(placements):
+            return self.client.post(
+                reverse("appointment-batch-warnings"),
+                {"placements": placements},
+                format="json",
+            )
+
+        post([self.placement("09:00:00", "12:00:00")])
+
+        with CaptureQueriesContext(connection) as one:
+            post([self.placement("09:00:00", "12:00:00")])
+        with CaptureQueriesContext(connection) as many:
+            post(
+                [
+                    self.placement(f"{hour:02}:00:00", f"{hour + 1:02}:00:00", day)
+                    for hour in range(8, 20)
+                    for day in range(5)
+                ]
+            )
+        self.assertEqual(len(one), len(many))
+
+    def test_batch_warnings_not_found(self):
+        response = self.client.post(
+            reverse("appointment-batch-warnings"),
+            {
+                "placements": [
+                    self.placement("09:00:00", "12:00:00", tech_id=str(uuid4()))
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class AutoScheduleTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+        self.schedule = Schedule.objects.create(name="Sandbox")
+
+        self.blocks = [
+            Block.objects.create(start_time="09:00:00", end_time="12:00:00"),
+            Block.objects.create(start_time="12:30:00", end_time="15:30:00"),
+            Block.objects.create(start_time="16:00:00", end_time="19:00:00"),
+        ]
+
+        fake = Faker()
+        Faker.seed(0)
+        client_content_type = ContentType.objects.get_for_model(Client)
+        technician_content_type = ContentType.objects.get_for_model(Technician)
+
+        for i in range(12):
+            client = Client.objects.create(
+                first_name=fake.first_name(),
+                last_name=fake.last_name(),
+                prescribed_hours=fake.random_int(min=3, max=15),
+                req_skill_level=fake.random_int(min=1, max=3),
+                req_spanish_speaking=fake.boolean(chance_of_getting_true=20),
+            )
+            self.create_availabilities(client_content_type, client.id, fake)
+
+        for i in range(6):
+            technician = Technician.objects.create(
+                first_name=fake.first_name(),
+                last_name=fake.last_name(),
+                requested_hours=fake.random_int(min=6, max=20),
+                max_hours_per_day=fake.random_int(min=3, max=6),
+                skill_level=fake.random_int(min=1, max=3),
+                spanish_speaking=fake.boolean(chance_of_getting_true=40),
+            )
+            self.create_availabilities(technician_content_type, technician.id, fake)
+
+    def create_availabilities(self, content_type, object_id, fake):
+        for day in range(5):
+            for block in self.blocks:
+                if fake.boolean(chance_of_getting_true=60):
+                    Availability.objects.create(
+                        content_type=content_type,
+                        object_id=object_id,
+                        schedule=self.schedule,
+                        day=day,
+                        start_time=block.start_time,
+                        end_time=block.end_time,
+                        is_sub=fake.boolean(chance_of_getting_true=10),
+                    )
+
+    def test_hard_constraints(self):
+        """
+        Assert that the automatically created appointments don't break any of
+        the hard constraints checked by `get_appointment_warnings`.
+        """
+
+        result = auto_schedule(self.schedule, time_budget=0.5, seed=1)
+        self.assert_hard_constraints(result)
+
+    def test_parallel_hard_constraints(self):
+        result = auto_schedule(self.schedule, time_budget=1, seed=1, workers=2)
+        self.assert_hard_constraints(result)
+
+    def test_flow_hard_constraints(self):
+        result = auto_schedule(self.schedule, mode="flow")
+        self.assert_hard_constraints(result)
+
+    def test_flow_time_budget(self):
+        """
+        Assert that flow mode falls back on a greedy run when the time budget
+        runs out before the flow is done.
+        """
+
+        result = auto_schedule(self.schedule, time_budget=0.000001, mode="flow")
+        self.assertEqual(result["runs"], 1)
+        self.assert_hard_constraints(result)
+
+    def assert_hard_constraints(self, result):
+        appointments = Appointment.objects.filter(schedule=self.schedule)
+        self.assertGreater(result["created"], 0)
+        self.assertEqual(result["created"], appointments.count())
+
+        for appointment in appointments:
+            warnings = get_appointment_warnings(
+                appointment.client,
+                appointment.technician,
+                appointment.day,
+                appointment.start_time.strftime("%H:%M:%S"),
+                appointment.end_time.strftime("%H:%M:%S"),
+                instance=appointment,
+                schedule=self.schedule,
+            )
+            self.assertEqual(
+                [warning for warning in warnings if "split block" not in warning],
+                [],
+            )
+
+        self.assertFalse(
+            Appointment.objects.filter(schedule=None).exists(),
+        )
+
+    def test_fills_around_existing_appointments(self):
+        """
+        Assert that existing appointments are kept and counted towards hours.
+        """
+
+        client = Client.objects.order_by("id").first()
+        client.prescribed_hours = 3
+        client.save()
+        technician = Technician.objects.order_by("id").first()
+        existing = Appointment.objects.create(
+            client=client,
+            technician=technician,
+            schedule=self.schedule,
+            day=0,
+            start_time="09:00:00",
+            end_time="12:00:00",
+        )
+
+        auto_schedule(self.schedule, time_budget=0.5, seed=1)
+
+        self.assertTrue(Appointment.objects.filter(pk=existing.pk).exists())
+        self.assertEqual(client.total_hours(self.schedule), 3)
+
+    def test_min_cost_flow(self):
+        """
+        Assert that flow is only pushed while it lowers the cost.
+        """
+
+        graph = MinCostFlow(4)
+        cheap = graph.add_edge(0, 1, 2, -5)
+        expensive = graph.add_edge(0, 2, 2, 5)
+        graph.add_edge(1, 3, 1, 0)
+        graph.add_edge(2, 3, 5, -4)
+        graph.add_edge(1, 2, 1, 0)
+
+        self.assertEqual(graph.solve(0, 3), (2, -14))
+        self.assertEqual(graph.flow(cheap), 2)
+        self.assertEqual(graph.flow(expensive), 0)
+
+    def test_auto_schedule_action(self):
+        response = self.client.post(
+            reverse("schedule-auto-schedule", args=[self.schedule.id]),
+            {"time_budget": 0.5, "seed": 1},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["created"],
+            Appointment.objects.filter(schedule=self.schedule).count(),
+        )
+
+        response = self.client.post(
+            reverse("schedule-auto-schedule", args=[self.schedule.id]),
+            {"time_budget": 600},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class ImproveScheduleTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+
+        self.blocks = [
+            Block.objects.create(start_time="09:00:00", end_time="12:00:00"),
+            Block.objects.create(start_time="12:30:00", end_time="15:30:00"),
+            Block.objects.create(start_time="16:00:00", end_time="19:00:00"),
+        ]
+        self.client_instance = Client.objects.create(
+            first_name="Split",
+            last_name="Client",
+            prescribed_hours=6,
+        )
+        self.short_client = Client.objects.create(
+            first_name="Short",
+            last_name="Client",
+            prescribed_hours=3,
+        )
+        self.technician = Technician.objects.create(
+            first_name="Busy",
+            last_name="Technician",
+            requested_hours=40,
+            max_hours_per_day=3,
+        )
+        self.other_technician = Technician.objects.create(
+            first_name="Free",
+            last_name="Technician",
+            requested_hours=40,
+            max_hours_per_day=8,
+        )
+
+        for model, instance in [
+            (Client, self.client_instance),
+            (Client, self.short_client),
+            (Technician, self.technician),
+            (Technician, self.other_technician),
+        ]:
+            for block in self.blocks:
+                Availability.objects.create(
+                    content_type=ContentType.objects.get_for_model(model),
+                    object_id=instance.id,
+                    day=0,
+                    start_time=block.start_time,
+                    end_time=block.end_time,
+                )
+
+        # a split block for the client and the technician, who is also over
+        # their max hours per day
+        self.appointments = [
+            Appointment.objects.create(
+                client=self.client_instance,
+                technician=self.technician,
+                day=0,
+                start_time=block.start_time,
+                end_time=block.end_time,
+            )
+            for block in [self.blocks[0], self.blocks[2]]
+        ]
+
+    def test_improve(self):
+        """
+        Assert that the improvements fix the split block and the overrun, fill
+        the short client's hours, and aren't saved until applied.
+        """
+
+        response = self.client.post(
+            reverse("appointment-improve"),
+            {"time_budget": 0.5, "seed": 1},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+
+        self.assertEqual(result["metrics_before"]["split_blocks"], 2)
+        self.assertEqual(result["metrics_before"]["max_hours_per_day_overrun"], 3)
+        self.assertEqual(result["metrics_after"]["split_blocks"], 0)
+        self.assertEqual(result["metrics_after"]["max_hours_per_day_overrun"], 0)
+        self.assertEqual(result["metrics_after"]["clients_at_prescribed_hours"], 2)
+        self.assertGreater(result["score_after"], result["score_before"])
+        self.assertEqual(Appointment.objects.count(), 2)
+
+        response = self.client.post(
+            reverse("appointment-apply-improvements"),
+            {"changes": result["changes"]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(Appointment.objects.count(), 3)
+        for appointment in Appointment.objects.all():
+            warnings = get_appointment_warnings(
+                appointment.client,
+                appointment.technician,
+                appointment.day,
+                appointment.start_time.strftime("%H:%M:%S"),
+                appointment.end_time.strftime("%H:%M:%S"),
+                instance=appointment,
+            )
+            self.assertEqual(warnings, [])
+
+    def test_incremental_score(self):
+        """
+        Assert that the score kept up to date move by move matches the score
+        of the resulting schedule computed from scratch.
+        """
+
+        state = ImprovementState(ScheduleProblem(build_snapshot(None)))
+        score = state.score()
+        rng = random.Random(1)
+        for _ in range(500):
+            changes = state.random_change(rng)
+            delta = state.try_change(changes) if changes else None
+            if delta is not None:
+                score += delta
+
+        self.assertAlmostEqual(score, state.score())
+
+    def test_stale_changes(self):
+        result = improve_schedule(None, time_budget=0.5, seed=1)
+        self.assertTrue(
+            any(change["action"] == "update" for change in result["changes"])
+        )
+
+        Appointment.objects.filter(pk=self.appointments[1].pk).update(day=1)
+        Appointment.objects.filter(pk=self.appointments[0].pk).update(day=2)
+
+        with self.assertRaises(StaleChangeError):
+            apply_changes(None, result["changes"])
+        self.assertEqual(Appointment.objects.count(), 2)
+
+    def test_overlapping_changes(self):
+        result = improve_schedule(None, time_budget=0.5, seed=1)
+        after = result["changes"][0]["after"]
+
+        # booked since, in the slot a change moves to
+        Appointment.objects.create(
+            client=Client.objects.create(first_name="Other", last_name="Client"),
+            **after,
+        )
+
+        with self.assertRaises(StaleChangeError):
+            apply_changes(None, result["changes"])
+        self.assertEqual(Appointment.objects.count(), 3)
+
+    def test_conflicting_create(self):
+        result = improve_schedule(None, time_budget=0.5, seed=1)
+        create = next(
+            change for change in result["changes"] if change["action"] == "create"
+        )
+
+        # booked since, at the same time as an appointment the changes create
+        Appointment.objects.create(
+            client_id=create["client_id"],
+            **{
+                **create["after"],
+                "technician_id": Technician.objects.create(
+                    first_name="Other", last_name="Technician"
+                ).id,
+            },
+        )
+
+        with self.assertRaises(StaleChangeError):
+            apply_changes(None, result["changes"])
+        self.assertEqual(Appointment.objects.count(), 3)
+
+
+class ExplainQueriesTestCase(TestCase):
+    def setUp(self):
+        technician = Technician.objects.create(first_name="Test", last_name="Tech")
+        Appointment.objects.create(
+            client=Client.objects.create(first_name="Test", last_name="Client"),
+            technician=technician,
+            day=0,
+            start_time="09:00:00",
+            end_time="12:00:00",
+        )
+        self.models = [
+            Schedule,
+            Client,
+            Technician,
+            Availability,
+            Appointment,
+            TherapyAppointment,
+        ]
+
+    def test_explain_queries(self):
+        counts = {model: model.objects.count() for model in self.models}
+        output = StringIO()
+        call_command(
+            "explain_queries",
+            "--clients=4",
+            "--technicians=2",
+            "--schedules=1",
+            stdout=output,
+        )
+        output = output.getvalue()
+
+        # in the current schedule and a sandbox
+        for query in get_queries(get_current_schedule()):
+            self.assertEqual(output.count(f"\n{query}: "), 2)
+        # the dataset is rolled back
+        self.assertEqual(
+            {model: model.objects.count() for model in self.models}, counts
+        )
+
+    def test_technician_day_index(self):
+        index = next(
+            index
+            for index in Appointment._meta.indexes
+            if index.name == "appointment_technician_day"
+        )
+        self.assertEqual(
+            index.fields, ["technician", "schedule", "day", "start_minute"]
+        )
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Appointment._meta.db_table
+            )
+        self.assertTrue(constraints["appointment_technician_day"]["index"])
+
+
+@skipUnless(connection.vendor == "postgresql", "Exclusion constraints need Postgres")
+class BookingConstraintsTestCase(TestCase):
+    def setUp(self):
+        call_command("booking_constraints", stdout=StringIO())
+        self.technicians = [
+            Technician.objects.create(first_name="Technician", last_name=str(i))
+            for i in range(2)
+        ]
+        self.appointments = [
+            Appointment.objects.create(
+                client=Client.objects.create(first_name="Client", last_name=str(i)),
+                technician=technician,
+                day=0,
+                start_time="09:00:00",
+                end_time="12:00:00",
+            )
+            for i, technician in enumerate(self.technicians)
+        ]
+
+    def check_constraints(self):
+        """
+        Check the deferred constraints now, since the test's transaction is
+        never committed.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute("SET CONSTRAINTS ALL DEFERRED")
+
+    def describe(self, technician):
+        return {
+            "technician_id": str(technician.id),
+            "day": 0,
+            "start_time": "09:00:00",
+            "end_time": "12:00:00",
+        }
+
+    def test_swap(self):
+        first, second = self.technicians
+        changes = [
+            {
+                "action": "update",
+                "appointment_id": str(appointment.id),
+                "client_id": str(appointment.client_id),
+                "before": self.describe(before),
+                "after": self.describe(after),
+            }
+            for appointment, before, after in [
+                (self.appointments[0], first, second),
+                (self.appointments[1], second, first),
+            ]
+        ]
+
+        self.assertEqual(apply_changes(None, changes), {"updated": 2, "created": 0})
+        self.check_constraints()
+        self.assertEqual(
+            Appointment.objects.get(pk=self.appointments[0].pk).technician, second
+        )
+
+    def test_double_booking(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Appointment.objects.create(
+                client=Client.objects.create(first_name="Other", last_name="Client"),
+                technician=self.technicians[0],
+                day=0,
+                start_time="10:00:00",
+                end_time="11:00:00",
+            )
+            self.check_constraints()
+
+
+class ScheduleSnapshotTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+        self.schedule = Schedule.objects.create(name="Sandbox")
+        Block.objects.create(start_time="09:00:00", end_time="12:00:00")
+
+    def create_clients(self, count):
+        client_content_type = ContentType.objects.get_for_model(Client)
+        for i in range(count):
+            client = Client.objects.create(
+                first_name="Client",
+                last_name=str(i),
+            )
+            technician = Technician.objects.create(
+                first_name="Technician",
+                last_name=str(i),
+            )
+            client.past_technicians.add(technician)
+            Availability.objects.create(
+                content_type=client_content_type,
+                object_id=client.id,
+                schedule=self.schedule,
+                day=0,
+                start_time="09:00:00",
+                end_time="12:00:00",
+            )
+            Appointment.objects.create(
+                client=client,
+                technician=technician,
+                schedule=self.schedule,
+                day=0,
+                start_time="09:00:00",
+                end_time="12:00:00",
+            )
+            TherapyAppointment.objects.create(
+                client=client,
+                therapy_type=TherapyAppointment.OT,
+                schedule=self.schedule,
+                day=1,
+                start_time="09:00:00",
+                end_time="10:00:00",
+            )
+
+    def get_snapshot(self, schedule_id):
+        # read once per process, not per request
+        get_current_schedule()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("schedule-snapshot", args=[schedule_id]))
+            # the rows are read as they're streamed
+            content = b"".join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(content), len(queries)
+
+    def test_snapshot(self):
+        self.create_clients(2)
+        data, _ = self.get_snapshot(self.schedule.id)
+
+        self.assertEqual(data["schedule"]["id"], str(self.schedule.id))
+        self.assertEqual(len(data["blocks"]), 1)
+        self.assertEqual(len(data["clients"]), 2)
+        self.assertEqual(len(data["technicians"]), 2)
+        self.assertEqual(len(data["availabilities"]), 2)
+        self.assertEqual(len(data["therapy_appointments"]), 2)
+
+        # flat, referencing clients and technicians by ID
+        appointment = data["appointments"][0]
+        client = next(c for c in data["clients"] if c["id"] == appointment["client"])
+        self.assertEqual(client["past_technicians"], [appointment["technician"]])
+        self.assertEqual(appointment["duration"], 180)
+
+        data, _ = self.get_snapshot("current")
+        self.assertEqual(data["schedule"]["id"], str(get_current_schedule().id))
+        self.assertEqual(data["appointments"], [])
+
+    def test_constant_query_count(self):
+        self.create_clients(2)
+        _, small = self.get_snapshot(self.schedule.id)
+        self.create_clients(10)
+        _, large = self.get_snapshot(self.schedule.id)
+
+        self.assertEqual(small, large)
+
+
+class ScheduleChangesTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+        self.schedule = Schedule.objects.create(name="Sandbox")
+        self.client_instance = Client.objects.create(
+            first_name="Test",
+            last_name="Client",
+        )
+        self.technician = Technician.objects.create(
+            first_name="Test",
+            last_name="Technician",
+        )
+        self.settle()
+
+    def settle(self):
+        ScheduleChange.objects.update(
+            created_at=timezone.now() - timedelta(seconds=SETTLE_SECONDS + 1)
+        )
+
+    def get_changes(self, schedule_id, cursor):
+        response = self.client.get(
+            reverse("schedule-changes", args=[schedule_id]), {"cursor": cursor}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_changes(self):
+        response = self.client.get(
+            reverse("schedule-snapshot", args=[self.schedule.id])
+        )
+        cursor = json.loads(b"".join(response.streaming_content))["cursor"]
+
+        appointment = Appointment.objects.create(
+            client=self.client_instance,
+            technician=self.technician,
+            schedule=self.schedule,
+            day=0,
+            start_time="09:00:00",
+            end_time="12:00:00",
+        )
+        # in another schedule
+        Appointment.objects.create(
+            client=self.client_instance,
+            technician=self.technician,
+            day=0,
+            start_time="09:00:00",
+            end_time="12:00:00",
+        )
+        self.client_instance.first_name = "Renamed"
+        self.client_instance.save()
+
+        data = self.get_changes(self.schedule.id, cursor)
+        self.assertEqual(
+            [row["id"] for row in data["changes"]["appointments"]],
+            [str(appointment.id)],
+        )
+        self.assertEqual(data["changes"]["clients"][0]["first_name"], "Renamed")
+        self.assertEqual(data["deleted"], {})
+        # recent changes are sent again until they settle
+        self.assertEqual(data["cursor"], cursor)
+
+        self.settle()
+        data = self.get_changes(self.schedule.id, cursor)
+        self.assertGreater(data["cursor"], cursor)
+        cursor = data["cursor"]
+
+        appointment_id = str(appointment.id)
+        appointment.delete()
+        self.settle()
+        data = self.get_changes(self.schedule.id, cursor)
+        self.assertEqual(data["changes"], {})
+        self.assertEqual(data["deleted"], {"appointments": [appointment_id]})
+
+    def test_idle_poll(self):
+        cursor = self.get_changes("current", 0)["cursor"]
+
+        with self.assertNumQueries(1):
+            data = self.get_changes("current", cursor)
+
+        self.assertEqual(
+            data, {"cursor": cursor, "reset": False, "changes": {}, "deleted": {}}
+        )
+
+    def test_reset(self):
+        cursor = self.get_changes("current", 0)["cursor"]
+
+        self.addCleanup(clear_current_schedule)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("schedule-promote-to-current", args=[self.schedule.id]),
+                {"archive_name": "Archive"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+        self.assertTrue(self.get_changes("current", cursor)["reset"])
+
+    def test_prune(self):
+        old_cursor = self.get_changes(self.schedule.id, 0)["cursor"]
+        Appointment.objects.create(
+            client=self.client_instance,
+            technician=self.technician,
+            schedule=self.schedule,
+            day=0,
+            start_time="09:00:00",
+            end_time="12:00:00",
+        )
+        self.settle()
+        cursor = self.get_changes(self.schedule.id, old_cursor)["cursor"]
+        self.assertGreater(cursor, old_cursor)
+
+        ScheduleChange.objects.update(created_at=timezone.now() - timedelta(days=31))
+        call_command("prune_changes", "--days", "30", stdout=StringIO())
+        self.assertEqual(ScheduleChange.objects.count(), 1)
+
+        # the pruned changes can't be sent, so older readers reload
+        self.assertTrue(self.get_changes(self.schedule.id, old_cursor)["reset"])
+        self.assertTrue(self.get_changes("current", old_cursor)["reset"])
+        # up to date readers carry on
+        self.client_instance.first_name = "Renamed"
+        self.client_instance.save()
+        data = self.get_changes(self.schedule.id, cursor)
+        self.assertFalse(data["reset"])
+        self.assertEqual(data["changes"]["clients"][0]["first_name"], "Renamed")
+
+        # a reload reads on from after the pruned changes
+        response = self.client.get(
+            reverse("schedule-snapshot", args=[self.schedule.id])
+        )
+        cursor = json.loads(b"".join(response.streaming_content))["cursor"]
+        self.assertFalse(self.get_changes(self.schedule.id, cursor)["reset"])
+
+        # pruning again keeps the reset
+        call_command("prune_changes", "--days", "30", stdout=StringIO())
+        self.assertTrue(self.get_changes(self.schedule.id, old_cursor)["reset"])
+
+
+class RevisionETagTestCase(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+        self.schedule = Schedule.objects.create(name="Sandbox")
+        self.client_instance = Client.objects.create(
+            first_name="Test",
+            last_name="Client",
+        )
+        self.technician = Technician.objects.create(
+            first_name="Test",
+            last_name="Technician",
+        )
+
+    def get_etag(self, url="appointment-list", **headers):
+        response = self.client.get(reverse(url), headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("X-Schedule-ID", response["Vary"])
+        return response["ETag"]
+
+    def create_appointment(self, schedule=None):
+        return Appointment.objects.create(
+            client=self.client_instance,
+            technician=self.technician,
+            schedule=schedule,
+            day=0,
+            start_time="09:00:00",
+            end_time="12:00:00",
+        )
+
+    def test_not_modified(self):
+        for url in [
+            "appointment-list",
+            "availability-list",
+            "block-list",
+            "client-list",
+            "technician-list",
+        ]:
+            etag = self.get_etag(url)
+            with self.assertNumQueries(1):
+                response = self.client.get(
+                    reverse(url), headers={"If-None-Match": etag}
+                )
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response["ETag"], etag)
+
+    def test_schedule_writes(self):
+        current = self.get_etag()
+        sandbox = self.get_etag(x_schedule_id=str(self.schedule.id))
+        self.assertNotEqual(current, sandbox)
+
+        appointment = self.create_appointment(self.schedule)
+        self.assertEqual(self.get_etag(), current)
+        changed = self.get_etag(x_schedule_id=str(self.schedule.id))
+        self.assertNotEqual(changed, sandbox)
+
+        appointment.delete()
+        self.assertNotEqual(self.get_etag(x_schedule_id=str(self.schedule.id)), changed)
+
+        response = self.client.get(
+            reverse("appointment-list"),
+            headers={"If-None-Match": sandbox},
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_shared_writes(self):
+        etag = self.get_etag()
+        self.client_instance.first_name = "Renamed"
+        self.client_instance.save()
+        renamed = self.get_etag()
+        self.assertNotEqual(renamed, etag)
+
+        self.client_instance.past_technicians.add(self.technician)
+        self.assertNotEqual(self.get_etag(), renamed)
+
+    def test_auto_schedule(self):
+        etag = self.get_etag(x_schedule_id=str(self.schedule.id))
+        auto_schedule(self.schedule, time_budget=0.1, seed=0)
+        self.assertNotEqual(self.get_etag(x_schedule_id=str(self.schedule.id)), etag)
+
+
+class ScheduleEventsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.schedule = Schedule.objects.create(name="Sandbox")
+        self.client_instance = Client.objects.create(
+            first_name="Test",
+            last_name="Client",
+        )
+        self.technician = Technician.objects.create(
+            first_name="Test",
+            last_name="Technician",
+        )
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def subscribe(self, key):
+        async def subscribe():
+            return get_hub().subscribe([key])
+
+        subscription = self.loop.run_until_complete(subscribe())
+        self.addCleanup(get_hub().unsubscribe, subscription)
+        return subscription
+
+    def get_events(self, subscription):
+        # let the events put from this thread reach the queue
+        self.loop.run_until_complete(asyncio.sleep(0))
+        events = []
+        while not subscription.queue.empty():
+            events.append(subscription.queue.get_nowait())
+        return events
+
+    def test_publish(self):
+        sandbox = self.subscribe(str(self.schedule.id))
+        current = self.subscribe(str(get_current_schedule().id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment = Appointment.objects.create(
+                client=self.client_instance,
+                technician=self.technician,
+                schedule=self.schedule,
+                day=0,
+                start_time="09:00:00",
+                end_time="12:00:00",
+            )
+            # not published before the transaction commits
+            self.assertEqual(self.get_events(sandbox), [])
+        appointment_id = str(appointment.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.delete()
+
+        self.assertEqual(
+            self.get_events(sandbox),
+            [
+                {"model": "appointments", "id": appointment_id, "action": "upsert"},
+                {"model": "appointments", "id": appointment_id, "action": "delete"},
+            ],
+        )
+        self.assertEqual(self.get_events(current), [])
+
+    def test_overflow(self):
+        subscription = self.subscribe("current")
+        for i in range(MAX_PENDING_EVENTS + 1):
+            get_hub().dispatch("current", {"model": "appointments", "id": str(i)})
+        self.assertEqual(self.get_events(subscription), [RESET_EVENT])
+
+    def test_current_moved(self):
+        """
+        Assert that a promotion in another process makes this one forget its
+        cached current schedule once it's notified, or once it may have missed
+        the notification.
+        """
+
+        self.addCleanup(clear_current_schedule)
+        current = get_current_schedule()
+        for notify in [
+            lambda: get_hub().dispatch(CURRENT, CURRENT_MOVED_EVENT),
+            lambda: get_hub().dispatch_all(RESET_EVENT),
+        ]:
+            CurrentSchedule.objects.update(schedule=current)
+            clear_current_schedule()
+            self.assertEqual(get_current_schedule(), current)
+
+            # as another process promotes it, without this one's signals
+            CurrentSchedule.objects.update(schedule=self.schedule)
+            self.assertEqual(get_current_schedule(), current)
+            notify()
+            self.assertEqual(get_current_schedule(), self.schedule)
+
+    def test_current_forgotten_while_read(self):
+        def forget(sender, **kwargs):
+            clear_current_schedule()
+
+        clear_current_schedule()
+        self.addCleanup(clear_current_schedule)
+        current_schedule_read.connect(forget)
+        try:
+            get_current_schedule()
+        finally:
+            current_schedule_read.disconnect(forget)
+        # it may be stale, so it's read again
+        with self.assertNumQueries(1):
+            get_current_schedule()
+
+
+class ScheduleEventsStreamTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        _, self.token = AuthToken.objects.create(self.user)
+
+    async def test_unauthenticated(self):
+        response = await self.async_client.get(
+            reverse("schedule-events", args=["current"])
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_not_served_over_wsgi(self):
+        response = self.client.get(
+            reverse("schedule-events", args=["current"]),
+            headers={"Authorization": f"Token {self.token}"},
+        )
+        self.assertEqual(response.status_code, 501)
+
+    async def test_not_found(self):
+        response = await self.async_client.get(
+            reverse("schedule-events", args=[uuid4()]),
+            headers={"Authorization": f"Token {self.token}"},
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_stream(self):
+        response = await self.async_client.get(
+            reverse("schedule-events", args=["current"]),
+            headers={"Authorization": f"Token {self.token}"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b"retry:"))
+        event = {"model": "appointments", "id": "1", "action": "upsert"}
+        current = await sync_to_async(get_current_schedule)()
+        get_hub().dispatch(str(current.id), event)
+        self.assertEqual(await anext(chunks), f"data: {json.dumps(event)}\n\n".encode())
+
+        # readers reconnect to the new current schedule
+        get_hub().dispatch("current", CURRENT_MOVED_EVENT)
+        self.assertEqual(
+            await anext(chunks), f"data: {json.dumps(CURRENT_MOVED_EVENT)}\n\n".encode()
+        )
+        with self.assertRaises(StopAsyncIteration):
+            await anext(chunks)
+
+
+class ResponseCacheTestCase(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+        self.schedule = Schedule.objects.create(name="Sandbox")
+        self.client_instance = Client.objects.create(
+            first_name="Test",
+            last_name="Client",
+        )
+        self.technician = Technician.objects.create(
+            first_name="Test",
+            last_name="Technician",
+        )
+        self.params = {"expand_properties": "true", "expand_appointments": "true"}
+
+    def get_clients(self, **headers):
+        response = self.client.get(reverse("client-list"), self.params, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_cache(self):
+        data = self.get_clients()
+        # only the revisions are read
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_clients(), data)
+
+        # in another schedule
+        Appointment.objects.create(
+            client=self.client_instance,
+            technician=self.technician,
+            schedule=self.schedule,
+            day=0,
+            start_time="09:00:00",
+            end_time="12:00:00",
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_clients(), data)
+        self.assertEqual(
+            len(
+                self.get_clients(x_schedule_id=str(self.schedule.id))["results"][0][
+                    "appointments"
+                ]
+            ),
+            1,
+        )
+
+        Appointment.objects.create(
+            client=self.client_instance,
+            technician=self.technician,
+            day=0,
+            start_time="09:00:00",
+            end_time="12:00:00",
+        )
+        self.assertEqual(len(self.get_clients()["results"][0]["appointments"]), 1)
+
+        self.technician.first_name = "Renamed"
+        self.technician.save()
+        self.assertEqual(
+            self.get_clients()["results"][0]["appointments"][0]["technician"][
+                "first_name"
+            ],
+            "Renamed",
+        )
+
+        stats = self.client.get(reverse("schedule-cache-stats")).json()
+        self.assertEqual(stats["client-list"]["hits"], 2)
+        self.assertEqual(stats["client-list"]["misses"], 4)
+
+    def test_params(self):
+        data = self.get_clients()
+        self.params = {"expand_properties": "true"}
+        self.assertNotEqual(self.get_clients(), data)
+
+    def test_encrypted(self):
+        self.client_instance.first_name = "Plaintextname"
+        self.client_instance.save()
+        data = self.get_clients()
+        self.assertEqual(data["results"][0]["first_name"], "Plaintextname")
+
+        # the stored values, as the cache backend keeps them
+        stored = list(get_cache()._cache.values())
+        self.assertTrue(stored)
+        for value in stored:
+            self.assertNotIn(b"Plaintextname", value)
+        self.assertEqual(self.get_clients(), data)
+
+    def test_key_changed(self):
+        data = self.get_clients()
+        get_fernet.cache_clear()
+        self.addCleanup(get_fernet.cache_clear)
+        # the entry can't be decrypted, so it's a miss
+        with self.settings(RESPONSE_CACHE_KEY=Fernet.generate_key()):
+            self.assertEqual(self.get_clients(), data)
+        stats = self.client.get(reverse("schedule-cache-stats")).json()
+        self.assertEqual(stats["client-list"]["hits"], 0)
+        self.assertEqual(stats["client-list"]["misses"], 2)
+
+
+class ComputedPropertiesTestCase(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+        self.schedule = Schedule.objects.create(name="Sandbox")
+        self.technician = Technician.objects.create(
+            first_name="Test",
+            last_name="Technician",
+            requested_hours=5,
+        )
+
+    def add_client(self, name):
+        client = Client.objects.create(first_name=name, last_name="Client")
+        current = get_current_schedule()
+        for schedule, day, start_time, end_time in [
+            (current, 0, "09:00:00", "12:00:00"),
+            (current, 0, "12:30:00", "13:50:00"),
+            (current, 3, "16:00:00", "19:00:00"),
+            (self.schedule, 1, "09:00:00", "12:00:00"),
+        ]:
+            Appointment.objects.create(
+                client=client,
+                technician=self.technician,
+                schedule=schedule,
+                day=day,
+                start_time=start_time,
+                end_time=end_time,
+            )
+            Availability.objects.create(
+                content_type=ContentType.objects.get_for_model(Client),
+                object_id=client.id,
+                schedule=schedule,
+                day=day,
+                start_time=start_time,
+                end_time=end_time,
+            )
+        return client
+
+    def get_properties(self, url, **headers):
+        response = self.client.get(
+            reverse(url), {"expand_properties": "true"}, headers=headers
+        )
+        self.assertEqual(response.status_code, 200)
+        return {
+            row["id"]: row["computed_properties"] for row in response.json()["results"]
+        }
+
+    def test_annotations(self):
+        clients = [self.add_client(name) for name in ["A", "B"]]
+
+        for schedule in [None, self.schedule]:
+            headers = {"x_schedule_id": str(schedule.id)} if schedule else {}
+            for url, instances in [
+                ("client-list", clients),
+                ("technician-list", [self.technician]),
+            ]:
+                properties = self.get_properties(url, **headers)
+                for instance in instances:
+                    self.assertEqual(
+                        properties[str(instance.id)],
+                        {
+                            "total_hours_available": instance.total_hours_available(
+                                schedule
+                            ),
+                            "total_hours": instance.total_hours(schedule),
+                            "total_hours_by_day": instance.total_hours_by_day(schedule),
+                            "is_maxed_on_sessions": instance.is_maxed_on_sessions(
+                                schedule
+                            ),
+                        },
+                    )
+
+        self.assertEqual(
+            self.get_properties("client-list")[str(clients[0].id)][
+                "total_hours_by_day"
+            ],
+            [4.33, 0, 0, 3, 0, 0, 0],
+        )
+
+    def test_query_count(self):
+        self.add_client("A")
+        with CaptureQueriesContext(connection) as queries:
+            self.get_properties("client-list")
+        for name in ["B", "C", "D"]:
+            self.add_client(name)
+        get_cache().clear()
+        with self.assertNumQueries(len(queries)):
+            self.get_properties("client-list")
+
+
+class MinuteColumnsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+        self.client_instance = Client.objects.create(
+            first_name="Test",
+            last_name="Client",
+        )
+        self.technician = Technician.objects.create(
+            first_name="Test",
+            last_name="Technician",
+        )
+
+    def build_appointment(self, **kwargs):
+        return Appointment(
+            client=self.client_instance,
+            technician=self.technician,
+            day=0,
+            start_time="09:00:00",
+            end_time="12:30:00",
+            **kwargs,
+        )
+
+    def assertMinutes(self, appointment, start, end):
+        appointment.refresh_from_db()
+        self.assertEqual(
+            (
+                appointment.start_minute,
+                appointment.end_minute,
+                appointment.duration_minutes,
+            ),
+            (start, end, end - start),
+        )
+
+    def test_save(self):
+        appointment = self.build_appointment()
+        appointment.save()
+        self.assertMinutes(appointment, 540, 750)
+
+        appointment.end_time = "11:15:00"
+        appointment.save(update_fields=["end_time"])
+        self.assertMinutes(appointment, 540, 675)
+
+    def test_bulk(self):
+        [appointment] = Appointment.objects.bulk_create([self.build_appointment()])
+        self.assertMinutes(appointment, 540, 750)
+
+        appointment.start_time = "10:00:00"
+        Appointment.objects.bulk_update([appointment], ["start_time"])
+        self.assertMinutes(appointment, 600, 750)
+
+        Appointment.objects.filter(pk=appointment.pk).update(end_time="13:00:00")
+        self.assertMinutes(appointment, 600, 780)
+        Appointment.objects.filter(pk=appointment.pk).update(start_time="08:00:00")
+        self.assertMinutes(appointment, 480, 780)
+
+    def test_range_lookups(self):
+        appointment = self.build_appointment()
+        appointment.save()
+
+        for start, end, overlapping, within in [
+            (480, 540, False, False),
+            (480, 541, True, False),
+            (749, 800, True, False),
+            (750, 800, False, False),
+            (540, 750, True, True),
+            (500, 800, True, True),
+        ]:
+            self.assertEqual(
+                Appointment.objects.overlapping(start, end).exists(), overlapping
+            )
+            self.assertEqual(Appointment.objects.within(start, end).exists(), within)
+
+    def test_serializer_output(self):
+        appointment = self.build_appointment()
+        appointment.save()
+        response = self.client.get(reverse("appointment-detail", args=[appointment.id]))
+        data = response.json()
+        self.assertEqual(data["duration"], 210)
+        self.assertNotIn("start_minute", data)
+        self.assertNotIn("duration_minutes", data)
+
+
+class ScheduleCopyTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+        self.client_instance = Client.objects.create(
+            first_name="Test",
+            last_name="Client",
+        )
+        self.technician = Technician.objects.create(
+            first_name="Test",
+            last_name="Technician",
+        )
+        self.appointment = Appointment.objects.create(
+            client=self.client_instance,
+            technician=self.technician,
+            day=1,
+            start_time="09:00:00",
+            end_time="12:30:00",
+            notes="Bring the blue folder",
+        )
+        self.availability = Availability.objects.create(
+            content_type=ContentType.objects.get_for_model(Technician),
+            object_id=self.technician.id,
+            day=1,
+            start_time="08:00:00",
+            end_time="17:00:00",
+        )
+        self.therapy_appointment = TherapyAppointment.objects.create(
+            client=self.client_instance,
+            day=2,
+            start_time="13:00:00",
+            end_time="14:00:00",
+            notes="Speech",
+        )
+
+    def get_ciphertext(self, model, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT notes FROM {model._meta.db_table} WHERE id = %s",
+                [model._meta.pk.get_db_prep_value(pk, connection)],
+            )
+            return cursor.fetchone()[0]
+
+    def test_copy_from_current(self):
+        response = self.client.post(
+            reverse("schedule-list"),
+            {"name": "Sandbox", "copy_from_current": True},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        schedule = Schedule.objects.get(id=response.json()["id"])
+
+        copy = Appointment.objects.get(schedule=schedule)
+        self.assertNotEqual(copy.id, self.appointment.id)
+        self.assertEqual(copy.notes, "Bring the blue folder")
+        self.assertEqual(
+            self.get_ciphertext(Appointment, copy.id),
+            self.get_ciphertext(Appointment, self.appointment.id),
+        )
+        self.assertEqual(
+            (copy.client_id, copy.technician_id, copy.day, copy.duration_minutes),
+            (self.client_instance.id, self.technician.id, 1, 210),
+        )
+        self.assertEqual(
+            Availability.objects.get(schedule=schedule).object_id, self.technician.id
+        )
+        self.assertEqual(
+            TherapyAppointment.objects.get(schedule=schedule).notes, "Speech"
+        )
+        # the current schedule is untouched
+        self.assertEqual(Appointment.objects.in_schedule(None).count(), 1)
+
+        entry = LogEntry.objects.get_for_object(schedule).latest("timestamp")
+        self.assertEqual(
+            entry.additional_data["copied_from"], str(get_current_schedule().id)
+        )
+        self.assertEqual(entry.additional_data["appointments"], 1)
+
+    def test_promote(self):
+        sandbox = Schedule.objects.create(name="Sandbox")
+        promoted = Appointment.objects.create(
+            client=self.client_instance,
+            technician=self.technician,
+            schedule=sandbox,
+            day=3,
+            start_time="10:00:00",
+            end_time="11:00:00",
+            notes="Promoted",
+        )
+
+        self.addCleanup(clear_current_schedule)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("schedule-promote-to-current", args=[sandbox.id]),
+                {"archive_name": "Archive"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(get_current_schedule(), sandbox)
+        # nothing is copied
+        current = Appointment.objects.in_schedule(None).get()
+        self.assertEqual(current.id, promoted.id)
+        self.assertFalse(TherapyAppointment.objects.in_schedule(None).exists())
+        archive = Schedule.objects.get(name="Archive")
+        self.assertEqual(
+            Appointment.objects.get(schedule=archive).id, self.appointment.id
+        )
+
+        # the current schedule isn't listed, nor can it be promoted again
+        response = self.client.get(reverse("schedule-list"))
+        self.assertEqual(
+            [row["id"] for row in response.json()["results"]], [str(archive.id)]
+        )
+        response = self.client.post(
+            reverse("schedule-promote-to-current", args=[sandbox.id]),
+            {"archive_name": "Archive"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class OverlayScheduleTestCase(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+        self.client_instance = Client.objects.create(
+            first_name="Test",
+            last_name="Client",
+        )
+        self.technician = Technician.objects.create(
+            first_name="Test",
+            last_name="Technician",
+        )
+        self.appointment = Appointment.objects.create(
+            client=self.client_instance,
+            technician=self.technician,
+            day=0,
+            start_time="09:00:00",
+            end_time="12:00:00",
+        )
+        self.availability = Availability.objects.create(
+            content_type=ContentType.objects.get_for_model(Technician),
+            object_id=self.technician.id,
+            day=0,
+            start_time="08:00:00",
+            end_time="17:00:00",
+        )
+        response = self.client.post(
+            reverse("schedule-list"),
+            {"name": "Overlay", "is_overlay": True},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.overlay = Schedule.objects.get(id=response.json()["id"])
+
+    def list_ids(self, name, schedule):
+        response = self.client.get(
+            reverse(f"{name}-list"), HTTP_X_SCHEDULE_ID=str(schedule.id)
+        )
+        self.assertEqual(response.status_code, 200)
+        return {row["id"] for row in response.json()["results"]}
+
+    def test_reads_parent(self):
+        self.assertFalse(Appointment.objects.filter(schedule=self.overlay).exists())
+        self.assertEqual(
+            self.list_ids("appointment", self.overlay), {str(self.appointment.id)}
+        )
+        self.assertEqual(
+            self.list_ids("availability", self.overlay), {str(self.availability.id)}
+        )
+
+        # changes to the parent show through
+        self.appointment.end_time = "11:00:00"
+        self.appointment.save()
+        self.assertEqual(
+            Appointment.objects.in_schedule(self.overlay).get().duration_minutes, 120
+        )
+
+    def test_copy_on_write(self):
+        etag = self.client.get(
+            reverse("appointment-list"), HTTP_X_SCHEDULE_ID=str(self.overlay.id)
+        )["ETag"]
+
+        response = self.client.patch(
+            reverse("appointment-detail", args=[self.appointment.id]),
+            {"end_time": "10:00:00"},
+            format="json",
+            HTTP_X_SCHEDULE_ID=str(self.overlay.id),
+        )
+        self.assertEqual(response.status_code, 200)
+        copy_id = response.json()["id"]
+        self.assertNotEqual(copy_id, str(self.appointment.id))
+
+        self.assertEqual(self.list_ids("appointment", self.overlay), {copy_id})
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.duration_minutes, 180)
+        self.assertEqual(
+            Appointment.objects.get(id=copy_id).schedule_id, self.overlay.id
+        )
+
+        response = self.client.delete(
+            reverse("availability-detail", args=[self.availability.id]),
+            HTTP_X_SCHEDULE_ID=str(self.overlay.id),
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.list_ids("availability", self.overlay), set())
+        self.assertTrue(Availability.objects.filter(id=self.availability.id).exists())
+
+        response = self.client.get(
+            reverse("appointment-list"), HTTP_X_SCHEDULE_ID=str(self.overlay.id)
+        )
+        self.assertNotEqual(response["ETag"], etag)
+
+        data = self.client.get(
+            reverse("schedule-changes", args=[self.overlay.id]), {"cursor": 0}
+        ).json()
+        self.assertEqual(data["deleted"]["appointments"], [str(self.appointment.id)])
+        self.assertEqual(data["changes"]["appointments"][0]["id"], copy_id)
+
+    def test_promote(self):
+        other = Schedule.objects.create(
+            name="Other", is_overlay=True, parent=get_current_schedule()
+        )
+        Appointment.objects.create(
+            client=self.client_instance,
+            technician=self.technician,
+            schedule=self.overlay,
+            day=1,
+            start_time="09:00:00",
+            end_time="12:00:00",
+        )
+
+        self.addCleanup(clear_current_schedule)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("schedule-promote-to-current", args=[self.overlay.id]),
+                {"archive_name": "Archive"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+        # it's materialized, the current schedule reads no other
+        self.overlay.refresh_from_db()
+        self.assertFalse(self.overlay.is_overlay)
+        self.assertEqual(
+            sorted(Appointment.objects.in_schedule(None).values_list("day")),
+            [(0,), (1,)],
+        )
+        # overlays on the archived schedule still read the same rows
+        archive = Schedule.objects.get(name="Archive")
+        other.refresh_from_db()
+        self.assertEqual(other.parent, archive)
+        self.assertEqual(
+            list(Appointment.objects.in_schedule(other).values_list("id", flat=True)),
+            [self.appointment.id],
+        )
+
+        archive.delete()
+        other.refresh_from_db()
+        self.assertFalse(other.is_overlay)
+        self.assertEqual(
+            list(Appointment.objects.in_schedule(other).values_list("day", flat=True)),
+            [0],
+        )
+
+
+class NameIndexTestCase(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+        for first_name, last_name in [
+            ("Zoe", "Adams"),
+            ("adam", "Brown"),
+            ("Bob", "Zimmer"),
+        ]:
+            Client.objects.create(first_name=first_name, last_name=last_name)
+
+    def list_names(self, **params):
+        response = self.client.get(reverse("client-list"), params)
+        self.assertEqual(response.status_code, 200)
+        return [row["first_name"] for row in response.json()["results"]]
+
+    def test_order(self):
+        self.assertEqual(self.list_names(), ["adam", "Bob", "Zoe"])
+        self.assertEqual(self.list_names(page_size=2), ["adam", "Bob"])
+
+        client = Client.objects.get(first_name_index=get_exact_index("bob"))
+        client.first_name = "Ann"
+        client.save()
+        get_cache().clear()
+        self.assertEqual(self.list_names(), ["adam", "Ann", "Zoe"])
+
+        Client.objects.bulk_create([Client(first_name="Aaron", last_name="Young")])
+        get_cache().clear()
+        self.assertEqual(self.list_names(), ["Aaron", "adam", "Ann", "Zoe"])
+
+    def get_ranked_names(self):
+        return [
+            client.first_name
+            for client in Client.objects.order_by("name_rank")
+            if client.name_rank
+        ]
+
+    def test_rank_one(self):
+        """
+        Assert that creating a client ranks it without locking or rewriting
+        the other clients, however many there are.
+        """
+
+        table = Client._meta.db_table
+
+        def create(first_name):
+            with CaptureQueriesContext(connection) as queries:
+                Client.objects.create(first_name=first_name, last_name="New")
+            return [query["sql"] for query in queries if table in query["sql"]]
+
+        small = create("Abe")
+        Client.objects.bulk_create(
+            Client(first_name=f"Name {i:02d}", last_name="Bulk") for i in range(30)
+        )
+        large = create("Beth")
+
+        # read the names, move the ranks after it, and insert it
+        self.assertEqual(len(small), 3)
+        self.assertEqual(len(large), 3)
+        for sql in large:
+            self.assertNotIn("FOR UPDATE", sql)
+        names = self.get_ranked_names()
+        self.assertEqual(len(names), Client.objects.count())
+        self.assertEqual(names[:5], ["Abe", "adam", "Beth", "Bob", "Name 00"])
+        self.assertEqual(
+            list(Client.objects.values_list("name_rank", flat=True)),
+            list(range(1, len(names) + 1)),
+        )
+
+    def test_rename(self):
+        client = Client.objects.named(first_name="Zoe").get()
+        for first_name, names in [
+            ("Aaron", ["Aaron", "adam", "Bob"]),
+            ("Bert", ["adam", "Bert", "Bob"]),
+            ("Zack", ["adam", "Bob", "Zack"]),
+        ]:
+            client.first_name = first_name
+            client.save()
+            self.assertEqual(self.get_ranked_names(), names)
+
+        # a stale rank isn't saved back
+        other = Client.objects.named(first_name="adam").get()
+        client.first_name = "Abe"
+        client.save()
+        other.is_manually_maxed_out = True
+        other.save()
+        self.assertEqual(self.get_ranked_names(), ["Abe", "adam", "Bob"])
+        self.assertEqual(
+            list(Client.objects.values_list("name_rank", flat=True)), [1, 2, 3]
+        )
+
+    def test_rank_after_delete(self):
+        """
+        Assert that clients created or renamed after a delete, which leaves a
+        gap in the ranks, are still ranked in name order.
+        """
+
+        Client.objects.create(first_name="Carl", last_name="New")
+        Client.objects.named(first_name="Bob").get().delete()
+
+        Client.objects.create(first_name="Dan", last_name="New")
+        self.assertEqual(self.get_ranked_names(), ["adam", "Carl", "Dan", "Zoe"])
+
+        Client.objects.named(first_name="adam").get().delete()
+        client = Client.objects.named(first_name="Carl").get()
+        client.first_name = "Zora"
+        client.save()
+        self.assertEqual(self.get_ranked_names(), ["Dan", "Zoe", "Zora"])
+
+        ranks = list(Client.objects.values_list("name_rank", flat=True))
+        self.assertEqual(len(set(ranks)), len(ranks))
+
+    def test_search(self):
+        self.assertEqual(self.list_names(search="ad"), ["adam", "Zoe"])
+        self.assertEqual(self.list_names(search="ZO ada"), ["Zoe"])
+        self.assertEqual(self.list_names(search="dam"), [])
+        self.assertEqual(self.list_names(first_name=" ADAM "), ["adam"])
+        self.assertEqual(self.list_names(first_name="ada"), [])
+
+        # the names can't be read from the indexes
+        client = Client.objects.named(first_name="Zoe").get()
+        for value in [client.first_name_index, client.name_prefixes]:
+            self.assertNotIn("zoe", value.lower())
+        self.assertNotIn(
+            "name_prefixes",
+            self.client.get(reverse("client-list")).json()["results"][0],
+        )
+
+
+class DecryptCacheTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+        get_decrypt_cache().clear()
+
+    def test_lru(self):
+        cache = DecryptCache(max_entries=2, timeout=60)
+        first, second, third = [encrypt_str(name).decode() for name in "ABC"]
+
+        self.assertEqual(cache.decrypt(first), "A")
+        self.assertEqual(cache.decrypt(second), "B")
+        self.assertEqual(cache.decrypt(first), "A")
+        # evicts the least recently used
+        self.assertEqual(cache.decrypt(third), "C")
+        self.assertEqual(cache.decrypt(first), "A")
+        self.assertEqual(cache.decrypt(second), "B")
+
+        stats = cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 4))
+        self.assertEqual((stats["size"], stats["evictions"]), (2, 2))
+        # plaintext isn't a key
+        self.assertNotIn(first, cache.entries)
+
+        expired = DecryptCache(max_entries=2, timeout=0)
+        expired.decrypt(first)
+        expired.decrypt(first)
+        self.assertEqual(expired.get_stats()["hits"], 0)
+
+    def test_fields(self):
+        Client.objects.create(first_name="Test", last_name="Client", notes="Notes")
+        get_decrypt_cache().clear()
+
+        for _ in range(2):
+            client = Client.objects.get()
+            self.assertEqual(
+                (client.first_name, client.last_name, client.notes),
+                ("Test", "Client", "Notes"),
+            )
+
+        response = self.client.get(reverse("schedule-cache-stats"))
+        stats = response.json()["decrypted-fields"]
+        # first_name, last_name, notes and sub_notes
+        self.assertEqual((stats["misses"], stats["hits"]), (4, 4))
+
+
+class DeferredNotesTestCase(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+        self.client_instance = Client.objects.create(
+            first_name="Test",
+            last_name="Client",
+            notes="Client notes",
+            sub_notes="Sub notes",
+        )
+        self.technician = Technician.objects.create(
+            first_name="Test",
+            last_name="Technician",
+            notes="Technician notes",
+        )
+        self.appointment = Appointment.objects.create(
+            client=self.client_instance,
+            technician=self.technician,
+            day=0,
+            start_time="09:00:00",
+            end_time="12:00:00",
+            notes="Appointment notes",
+        )
+
+    def test_list(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("appointment-list"))
+        appointment = response.json()["results"][0]
+        self.assertNotIn("notes", appointment)
+        self.assertNotIn("notes", appointment["client"])
+        self.assertNotIn("sub_notes", appointment["client"])
+        self.assertNotIn("notes", appointment["technician"])
+        # not even loaded, for the appointment, its client or its technician
+        listed = next(
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith('SELECT "appointments_appointment"."id"')
+        )
+        self.assertNotIn('"notes"', listed)
+
+        response = self.client.get(reverse("client-list"))
+        self.assertNotIn("sub_notes", response.json()["results"][0])
+
+        response = self.client.get(reverse("appointment-list"), {"include": "notes"})
+        appointment = response.json()["results"][0]
+        self.assertEqual(appointment["notes"], "Appointment notes")
+        self.assertEqual(appointment["client"]["sub_notes"], "Sub notes")
+
+    def test_detail(self):
+        response = self.client.get(
+            reverse("client-detail", args=[self.client_instance.id])
+        )
+        self.assertEqual(
+            (response.json()["notes"], response.json()["sub_notes"]),
+            ("Client notes", "Sub notes"),
+        )
+
+
+class CompactRepresentationTestCase(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+        self.technician = Technician.objects.create(
+            first_name="Test", last_name="Technician"
+        )
+        self.clients = []
+        for index in range(3):
+            client = Client.objects.create(first_name="Client", last_name=f"{index}")
+            client.past_technicians.add(self.technician)
+            Appointment.objects.create(
+                client=client,
+                technician=self.technician,
+                day=index,
+                start_time="09:00:00",
+                end_time="12:00:00",
+            )
+            self.clients.append(client)
+
+    def test_list(self):
+        url = reverse("appointment-list")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {"representation": "compact"})
+        data = response.json()
+        appointment = data["results"][0]
+        self.assertNotIn("client", appointment)
+        self.assertEqual(appointment["technician_id"], str(self.technician.id))
+        self.assertEqual(
+            set(data["included"]["clients"]),
+            {str(client.id) for client in self.clients},
+        )
+        self.assertEqual(
+            data["included"]["technicians"][str(self.technician.id)]["first_name"],
+            "Test",
+        )
+        # the appointments, then their clients (and past technicians) and
+        # technicians once, whatever their number
+        compact_queries = len(queries)
+        Appointment.objects.create(
+            client=Client.objects.create(first_name="Client", last_name="3"),
+            technician=self.technician,
+            day=4,
+            start_time="09:00:00",
+            end_time="12:00:00",
+        )
+        with self.assertNumQueries(compact_queries):
+            self.client.get(url, {"representation": "compact"})
+
+        # or with a header
+        response = self.client.get(url, headers={"X-Representation": "compact"})
+        self.assertIn("included", response.json())
+        self.assertIn("X-Representation", response["Vary"])
+        response = self.client.get(url)
+        self.assertEqual(
+            response.json()["results"][0]["client"]["first_name"], "Client"
+        )
+
+    def test_client_detail(self):
+        client = self.clients[0]
+        response = self.client.get(
+            reverse("client-detail", args=[client.id]),
+            {
+                "representation": "compact",
+                "expand_appointments": True,
+                "expand_current_technicians": True,
+            },
+        )
+        data = response.json()
+        self.assertEqual(data["past_technicians"], [str(self.technician.id)])
+        self.assertEqual(data["current_technician_ids"], [str(self.technician.id)])
+        self.assertEqual(data["appointments"][0]["client_id"], str(client.id))
+        # the client is the response itself
+        self.assertEqual(data["included"]["clients"], {})
+        self.assertEqual(
+            list(data["included"]["technicians"]), [str(self.technician.id)]
+        )
+
+    def test_cached_list(self):
+        url = reverse("client-list")
+        self.client.get(url)
+        response = self.client.get(url, headers={"X-Representation": "compact"})
+        self.assertIn("included", response.json())
+
+
+class ValuesListTestCase(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_superuser(
+            email="admin@example.com",
+            password="password",
+        )
+        self.client.force_authenticate(self.user)
+        technicians = [
+            Technician.objects.create(
+                first_name=f"Technician {index}",
+                last_name="Ünïcode",
+                notes=f"Notes {index}",
+                is_manually_maxed_out=index == 0,
+            )
+            for index in range(3)
+        ]
+        for index in range(4):
+            client = Client.objects.create(
+                first_name=f"Client {index}",
+                last_name="Test",
+                prescribed_hours=3,
+                notes="Notes",
+                sub_notes="Sub notes",
+            )
+            client.past_technicians.set(technicians[: index % 3])
+            Appointment.objects.create(
+                client=client,
+                technician=technicians[index % 3],
+                day=index,
+                start_time="09:00:00",
+                end_time="12:00:00",
+            )
+
+    def get_content(self, name: str, params: dict) -> bytes:
+        get_cache().clear()
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def test_identical(self):
+        for name in ["client-list", "technician-list"]:
+            for params in [
+                {},
+                {"page_size": 2, "page": 2},
+                {"include": "notes"},
+                {"expand_properties": True},
+                {"representation": "compact", "expand_properties": True},
+            ]:
+                with self.subTest(name=name, params=params):
+                    with override_settings(VALUES_LISTS=False):
+                        expected = self.get_content(name, params)
+                    self.assertEqual(self.get_content(name, params), expected)
+
+    def test_queries(self):
+        # the revisions, the page, its count and the past technicians, whatever
+        # their number
+        with self.assertNumQueries(4):
+            self.get_content("client-list", {"include": "notes"})
+
+    def test_fallback(self):
+        client = Client.objects.first()
+        response = self.client.get(
+            reverse("client-list"), {"expand_appointments": True}
+        )
+        self.assertEqual(
+            response.json()["results"][0]["appointments"][0]["client"]["id"],
+            str(client.id),
+        )
+
+
+class StreamingTestCase(APITestCase):
+    def setUp(self):
+        for name in ["Zoë", "Line\u2028Separator", "Plain"]:
+            Technician.objects.create(first_name=name, last_name="Test", notes="")
+        self.request = APIRequestFactory().get("/")
+
+    def test_identical(self):
+        context = {"request": self.request}
+        queryset = Technician.objects.all()
+        expected = JSONRenderer().render(
+            {
+                "cursor": None,
+                "technicians": TechnicianBasicSerializer(
+                    queryset, many=True, context=context
+                ).data,
+                "empty": [],
+            }
+        )
+        content = b"".join(
+            render(
+                {
+                    "cursor": None,
+                    "technicians": Rows(queryset, TechnicianBasicSerializer, context),
+                    "empty": Rows(queryset.none(), TechnicianBasicSerializer, context),
+                }
+            )
+        )
+        self.assertEqual(content, expected)
+
+    @patch("apps.appointments.streaming.CHUNK_SIZE", 2)
+    def test_chunks(self):
+        client = Client.objects.create(first_name="Test", last_name="Client")
+        client.past_technicians.set(Technician.objects.all())
+        Client.objects.create(first_name="Other", last_name="Client")
+        Client.objects.create(first_name="Third", last_name="Client")
+        rows = Rows(
+            Client.objects.prefetch_related("past_technicians"),
+            ClientBasicSerializer,
+            {"request": self.request},
+        )
+        # one query, fetched a chunk at a time, and a prefetch per chunk
+        with self.assertNumQueries(3):
+            clients = list(rows)
+        self.assertEqual(len(clients), 3)
+        self.assertEqual(
+            len(
+                next(c for c in clients if c["id"] == str(client.id))[
+                    "past_technicians"
+                ]
+            ),
+            3,
+        )
@@ -1,11 +1,24 @@
-from datetime import datetime
+from datetime import time
 
 
-def get_difference_in_minutes(start_time, end_time):
-    start_datetime = datetime.combine(datetime.today(), start_time)
-    end_datetime = datetime.combine(datetime.today(), end_time)
+def get_seconds_of_day(value: time) -> float:
+    return (
+        value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1e6
+    )
+
+
+def get_minute_of_day(value: str | time) -> int:
+    """
+    Convert a `datetime.time` or "HH:MM[:SS]" string to whole minutes since
+    midnight.
+    """
+    if isinstance(value, str):
+        value = time.fromisoformat(value)
+    return value.hour * 60 + value.minute
 
-    time_difference = end_datetime - start_datetime
 
-    total_minutes = time_difference.total_seconds() / 60
+def get_difference_in_minutes(start_time, end_time):
+    time_difference = get_seconds_of_day(end_time) - get_seconds_of_day(start_time)
+
+    total_minutes = time_difference / 60
     return total_minutes
@@ -0,0 +1,236 @@
+"""
+Client and technician lists from `.values()` rows.
+
+Serializing a page of a thousand clients through `ClientSerializer` loads a
+model instance per row and walks every serializer field of every instance.
+List requests are served from `.values()` rows instead, turned into the
+same dicts, in the same order, by converters precomputed once per field from
+the serializer's own fields, so the JSON is byte-identical (see
+`ValuesListTestCase`, and the `benchmark_lists` command for the speedup).
+
+Expanding appointments, availabilities or current technicians queries per
+row anyway, so those requests go through the serializers.
+"""
+
+from django.conf import settings
+from django.db.models import F
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+
+from .models import Client, Technician, is_maxed, to_hours
+from .serializers import ClientSerializer, TechnicianBasicSerializer
+
+# Fields that represent a database value as the value itself
+IDENTITY_FIELDS = {
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.IntegerField,
+    PrimaryKeyRelatedField,
+}
+# Fields whose own representation of a value is used as is
+CONVERTED_FIELDS = {
+    serializers.DateField,
+    serializers.DateTimeField,
+    serializers.DecimalField,
+    serializers.FloatField,
+    serializers.TimeField,
+}
+
+# What the serializers nest in place of the related IDs, outside compact
+# responses
+NESTED = {
+    (ClientSerializer, "past_technicians"): TechnicianBasicSerializer,
+}
+
+# Names of the listed rows, and of the ones they reference, in compact
+# responses' side loads
+SIDE_LOADED = {Client: "clients", Technician: "technicians"}
+
+# Expansions served by the serializers only
+SLOW_EXPANSIONS = [
+    "expand_appointments",
+    "expand_availabilities",
+    "expand_current_technicians",
+]
+
+# Annotations of `HoursQuerySet.with_hours`
+HOURS_ANNOTATIONS = ["available_minutes", *(f"day_{day}_minutes" for day in range(7))]
+
+# Alias of the listed row's ID in the rows of a many to many relation
+LISTED_PK = "listed_pk"
+
+
+class UnsupportedField(Exception):
+    pass
+
+
+def get_converter(field):
+    """
+    What represents a database value like the field would, or None for the
+    value itself.
+    """
+    field_type = type(field)
+    if field_type in IDENTITY_FIELDS:
+        if field_type is PrimaryKeyRelatedField and field.pk_field is not None:
+            raise UnsupportedField(field.field_name)
+        return None
+    if field_type is serializers.UUIDField and field.uuid_format == "hex_verbose":
+        return str
+    if field_type in CONVERTED_FIELDS:
+        return field.to_representation
+    raise UnsupportedField(field.field_name)
+
+
+class ValuesSerializer:
+    """
+    Represents `.values()` rows like a ModelSerializer represents instances,
+    without the additions of its `to_representation`.
+    """
+
+    def __init__(self, serializer):
+        self.model = serializer.Meta.model
+        # (name, column, converter) in the serializer's order, with no column
+        # for many to many relations
+        self.fields = []
+        self.many = {}
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, ManyRelatedField):
+                if type(field.child_relation) is not PrimaryKeyRelatedField:
+                    raise UnsupportedField(name)
+                self.many[name] = self.model._meta.get_field(field.source)
+                self.fields.append((name, None, None))
+            else:
+                self.fields.append((name, field.source, get_converter(field)))
+
+    @property
+    def columns(self) -> list[str]:
+        return [column for _, column, _ in self.fields if column is not None]
+
+    def represent(self, row: dict) -> dict:
+        data = {}
+        for name, column, converter in self.fields:
+            if column is None:
+                data[name] = []
+                continue
+            value = row[column]
+            if value is None or converter is None:
+                data[name] = value
+            else:
+                data[name] = converter(value)
+        return data
+
+    def get_related(self, name: str, pks: list, nested=None) -> dict:
+        """
+        The related rows of a many to many relation, by the listed rows' IDs,
+        in the related model's order: their IDs, or their representation by a
+        `nested` ValuesSerializer.  One query.
+        """
+        field = self.many[name]
+        query_name = field.related_query_name()
+        queryset = field.related_model.objects.filter(**{f"{query_name}__in": pks})
+        columns = ["pk"] if nested is None else nested.columns
+        related = {pk: [] for pk in pks}
+        for row in queryset.values(*columns, **{LISTED_PK: F(query_name)}):
+            value = row["pk"] if nested is None else nested.represent(row)
+            related[row[LISTED_PK]].append(value)
+        return related
+
+
+def is_supported(request) -> bool:
+    return settings.VALUES_LISTS and not any(
+        request.query_params.get(expansion) for expansion in SLOW_EXPANSIONS
+    )
+
+
+def get_computed_properties(model, row: dict) -> dict:
+    """
+    `computed_properties`, from the annotations of `HoursQuerySet.with_hours`.
+    """
+    minutes_by_day = [row[f"day_{day}_minutes"] or 0 for day in range(7)]
+    total_hours = to_hours(sum(minutes_by_day))
+    return {
+        "total_hours_available": to_hours(row["available_minutes"] or 0),
+        "total_hours": total_hours,
+        "total_hours_by_day": [to_hours(minutes) for minutes in minutes_by_day],
+        "is_maxed_on_sessions": is_maxed(
+            row["is_manually_maxed_out"],
+            total_hours,
+            row[model.target_hours_field],
+        ),
+    }
+
+
+class ValuesList:
+    """
+    A list request's rows, represented like its serializer (a
+    `ClientSerializer` or `TechnicianSerializer`) represents them.
+    """
+
+    def __init__(self, serializer_class, context: dict):
+        self.serializer_class = serializer_class
+        self.context = context
+        self.request = context["request"]
+        self.side_loads = context.get("side_loads")
+        self.values_serializer = ValuesSerializer(serializer_class(context=context))
+        self.model = self.values_serializer.model
+        self.pk_name = self.model._meta.pk.name
+        self.nested = {}
+        if self.side_loads is None:
+            for name in self.values_serializer.many:
+                nested_class = NESTED.get((serializer_class, name))
+                if nested_class is not None:
+                    nested = ValuesSerializer(nested_class(context=context))
+                    if nested.many:
+                        raise UnsupportedField(name)
+                    self.nested[name] = nested
+        self.computed_properties = bool(
+            self.request.query_params.get("expand_properties")
+        )
+
+    def get_queryset(self, queryset):
+        """
+        The `.values()` of a queryset of the list's rows, to paginate.
+        """
+        columns = {self.pk_name, *self.values_serializer.columns}
+        if self.computed_properties:
+            columns.update(
+                [
+                    *HOURS_ANNOTATIONS,
+                    "is_manually_maxed_out",
+                    self.model.target_hours_field,
+                ]
+            )
+        # the relations are read by `represent`, for the page's rows only
+        return queryset.prefetch_related(None).values(*columns)
+
+    def represent(self, rows: list[dict]) -> list[dict]:
+        pks = [row[self.pk_name] for row in rows]
+        related = {
+            name: self.values_serializer.get_related(
+                name, pks, nested=self.nested.get(name)
+            )
+            for name in self.values_serializer.many
+        }
+
+        data = []
+        for row in rows:
+            item = self.values_serializer.represent(row)
+            for name, by_pk in related.items():
+                item[name] = by_pk[row[self.pk_name]]
+            if self.computed_properties:
+                item["computed_properties"] = get_computed_properties(self.model, row)
+            data.append(item)
+
+        if self.side_loads is not None:
+            for pk in pks:
+                self.side_loads.add_present(SIDE_LOADED[self.model], pk)
+            for name, by_pk in related.items():
+                related_name = SIDE_LOADED[
+                    self.values_serializer.many[name].related_model
+                ]
+                for related_pks in by_pk.values():
+                    for pk in related_pks:
+                        self.side_loads.reference(related_name, pk)
+        return data
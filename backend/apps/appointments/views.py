@@ -1,6 +1,14 @@
+from functools import cached_property
+
+from asgiref.sync import sync_to_async
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
 from django.db import transaction
-from rest_framework import exceptions, mixins, viewsets
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from knox.auth import TokenAuthentication
+from rest_framework import exceptions, mixins, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
@@ -15,31 +23,192 @@ from apps.appointments.models import (
     TherapyAppointment,
 )
 
+from . import overlays, values_lists
+from .changes import get_changes, get_cursor, record_reset
+from .decrypt_cache import get_decrypt_cache
+from .events import CURRENT, get_key, stream_events
+from .filters import ClientFilter, TechnicianFilter
+from .improver import StaleChangeError, apply_changes, improve_schedule
 from .matcher import (
     find_available_technicians,
     find_recommended_subs,
     find_repeatable_appointment_days,
     get_appointment_warnings,
+    get_batch_appointment_warnings,
 )
 from .models import (
     Appointment,
     Availability,
     Block,
     Client,
+    CurrentSchedule,
     Schedule,
     Technician,
     TherapyAppointment,
+    get_current_schedule,
+    get_current_schedule_id,
 )
+from .response_cache import cache_response, get_stats
+from .revisions import get_etag, get_request_revisions
+from .scheduler import GREEDY, MODES, auto_schedule
 from .serializers import (
+    ApplyChangesSerializer,
+    AppointmentBasicSerializer,
     AppointmentSerializer,
     AvailabilitySerializer,
+    BatchWarningsSerializer,
     BlockSerialzier,
+    ClientBasicSerializer,
     ClientSerializer,
     ScheduleSerializer,
+    SideLoads,
     TechnicianBasicSerializer,
     TechnicianSerializer,
     TherapyAppointmentSerializer,
+    get_included,
+    is_compact,
 )
+from .streaming import Rows, stream_json
+
+# NOTE: Requests are served synchronously, so keep them well under the
+# server's timeout.  Use the `auto_schedule` command for longer runs.
+MAX_AUTO_SCHEDULE_TIME_BUDGET = 60
+
+
+class RevisionETagMixin:
+    """
+    Answer list requests with the schedule's revision as an ETag, and
+    conditional ones with a 304 if nothing changed since, before any other
+    query.
+    """
+
+    def list(self, request, *args, **kwargs):
+        etag = get_etag(get_request_revisions(request))
+        if etag in request.headers.get("If-None-Match", ""):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = self.list_response(request, *args, **kwargs)
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        # the same URL lists a different schedule's rows, or represents them
+        # differently, per header
+        patch_vary_headers(response, ["X-Schedule-ID", "X-Representation"])
+        return response
+
+    def list_response(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+
+class DeferredNotesMixin:
+    """
+    Leave the encrypted notes, which can be long, out of list responses
+    unless they're asked for with `?include=notes`: they're neither loaded
+    (nor decrypted) nor serialized.  Single objects always have them.
+    """
+
+    # Notes of the listed rows, and of the related rows loaded with them
+    deferred_notes = ["notes"]
+
+    def defers_notes(self) -> bool:
+        if self.action != "list":
+            return False
+        include = self.request.query_params.get("include", "")
+        return "notes" not in include.split(",")
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.defers_notes():
+            qs = qs.defer(*self.deferred_notes)
+        return qs
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["defer_notes"] = self.defers_notes()
+        return context
+
+
+class CompactMixin:
+    """
+    Answer `?representation=compact` (or `X-Representation: compact`) list
+    and detail requests with the related clients and technicians referenced
+    by ID (E.G. `client_id`), and each of them included once in `included`,
+    instead of nested in every row that references them.
+    """
+
+    def is_compact(self) -> bool:
+        return self.action in ["list", "retrieve"] and is_compact(self.request)
+
+    @cached_property
+    def side_loads(self) -> SideLoads:
+        return SideLoads()
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.is_compact():
+            # they're loaded once, by `get_included`
+            qs = qs.select_related(None)
+        return qs
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.is_compact():
+            context["side_loads"] = self.side_loads
+        return context
+
+    def include_side_loads(self, response):
+        if self.is_compact() and response.status_code == 200:
+            response.data["included"] = get_included(
+                self.side_loads, self.get_serializer_context()
+            )
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.include_side_loads(super().list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.include_side_loads(super().retrieve(request, *args, **kwargs))
+
+
+class ValuesListMixin:
+    """
+    Serve list requests from `.values()` rows when values_lists.py can
+    represent them, which is faster and gives the same responses.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not values_lists.is_supported(request):
+            return super().list(request, *args, **kwargs)
+        try:
+            values_list = values_lists.ValuesList(
+                self.get_serializer_class(), self.get_serializer_context()
+            )
+        except values_lists.UnsupportedField:
+            return super().list(request, *args, **kwargs)
+
+        queryset = values_list.get_queryset(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(values_list.represent(list(queryset)))
+        return self.get_paginated_response(values_list.represent(page))
+
+
+class ScheduleRowsMixin:
+    """
+    Rows of the request's schedule.  In an overlay, rows read from its parent
+    are copied on write (see overlays.py).
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().in_schedule(self.request.schedule)
+
+    def perform_update(self, serializer):
+        serializer.instance = overlays.copy_on_write(
+            self.request.schedule, serializer.instance
+        )
+        serializer.save()
+
+    def perform_destroy(self, instance):
+        overlays.delete(self.request.schedule, instance)
 
 
 class ScheduleViewSet(viewsets.ModelViewSet):
@@ -49,11 +218,23 @@ class ScheduleViewSet(viewsets.ModelViewSet):
         IsSuperUserOrReadOnlyAuthenticated,
     ]
 
+    def get_queryset(self):
+        # NOTE: The current schedule is read with "current" as its ID, and
+        # can't be changed or deleted here
+        return super().get_queryset().exclude(pk=get_current_schedule_id())
+
+    def get_schedule(self, pk):
+        """
+        The schedule with the ID, or the current one for "current".
+        """
+        return get_current_schedule() if pk == "current" else self.get_object()
+
     @action(detail=True, methods=["post"])
     def promote_to_current(self, request, pk=None):
         """
-        Promote this schedule to be the new main schedule (schedule=None),
-        archiving the current main schedule records into a new schedule.
+        Promote this schedule to be the new main schedule, archiving the
+        current main schedule under the given name.  Only the pointer to the
+        current schedule moves: no rows are copied.
         """
 
         archive_name = request.data.get("archive_name")
@@ -66,86 +247,144 @@ class ScheduleViewSet(viewsets.ModelViewSet):
             raise exceptions.NotFound("Schedule not found.")
 
         with transaction.atomic():
-            archive_schedule = Schedule.objects.create(name=archive_name)
-
-            # Move all current schedule records (schedule=None) to the archive
-            for model in [Availability, Appointment, TherapyAppointment]:
-                model.objects.filter(schedule=None).update(schedule=archive_schedule)
-
-            # Copy all records from the sandbox schedule to main (schedule=None)
-            # Availabilities
-            availabilities = Availability.objects.filter(schedule=sandbox_schedule)
-            avail_objs = [
-                Availability(
-                    content_type=a.content_type,
-                    object_id=a.object_id,
-                    day=a.day,
-                    start_time=a.start_time,
-                    end_time=a.end_time,
-                    is_sub=a.is_sub,
-                    in_clinic=a.in_clinic,
-                    schedule=None,
-                )
-                for a in availabilities
-            ]
-            Availability.objects.bulk_create(avail_objs)
-
-            # Appointments
-            appointments = Appointment.objects.filter(schedule=sandbox_schedule)
-            appt_objs = [
-                Appointment(
-                    client=a.client,
-                    technician=a.technician,
-                    day=a.day,
-                    start_time=a.start_time,
-                    end_time=a.end_time,
-                    in_clinic=a.in_clinic,
-                    is_preschool_or_adaptive=a.is_preschool_or_adaptive,
-                    notes=a.notes,
-                    schedule=None,
-                )
-                for a in appointments
-            ]
-            Appointment.objects.bulk_create(appt_objs)
-
-            # Therapy Appointments
-            therapy_appointments = TherapyAppointment.objects.filter(
-                schedule=sandbox_schedule
-            )
-            therapy_objs = [
-                TherapyAppointment(
-                    client=a.client,
-                    therapy_type=a.therapy_type,
-                    day=a.day,
-                    start_time=a.start_time,
-                    end_time=a.end_time,
-                    notes=a.notes,
-                    schedule=None,
-                )
-                for a in therapy_appointments
-            ]
-            TherapyAppointment.objects.bulk_create(therapy_objs)
+            # one promotion at a time
+            current = CurrentSchedule.objects.select_for_update().get()
+            if sandbox_schedule.is_overlay:
+                # the current schedule reads no other
+                overlays.materialize(sandbox_schedule)
+
+            # the overlays on the archive keep reading it
+            Schedule.objects.filter(pk=current.schedule_id).update(name=archive_name)
+            current.schedule = sandbox_schedule
+            current.save()
+
+            # readers of the current schedule have to load another one (and
+            # are told so when the pointer is saved, see signals.py)
+            record_reset(sandbox_schedule)
 
         return Response(
             f"Schedule '{sandbox_schedule.name}' promoted to current. Current main archived as '{archive_name}'.",
             status=200,
         )
 
+    @action(detail=False, methods=["get"])
+    def cache_stats(self, request):
+        """
+        Hits and misses of the response cache, per endpoint, and of this
+        process's decrypt cache.
+        """
+        return Response(
+            {**get_stats(), "decrypted-fields": get_decrypt_cache().get_stats()}
+        )
+
+    @action(detail=True, methods=["get"])
+    def snapshot(self, request, pk=None):
+        """
+        Everything needed to display (or export) a schedule, as flat lists
+        that reference each other by ID, built with a fixed number of queries
+        and streamed (see streaming.py).  Use "current" as the ID for the
+        current schedule.
+        """
+        schedule = self.get_schedule(pk)
+        context = {"request": request}
+
+        return stream_json(
+            {
+                "schedule": ScheduleSerializer(schedule, context=context).data,
+                "cursor": get_cursor(schedule),
+                "content_types": {
+                    "client": ContentType.objects.get_for_model(Client).pk,
+                    "technician": ContentType.objects.get_for_model(Technician).pk,
+                },
+                "blocks": Rows(Block.objects.all(), BlockSerialzier, context),
+                "clients": Rows(
+                    Client.objects.prefetch_related("past_technicians"),
+                    ClientBasicSerializer,
+                    context,
+                ),
+                "technicians": Rows(
+                    Technician.objects.all(), TechnicianBasicSerializer, context
+                ),
+                "availabilities": Rows(
+                    Availability.objects.in_schedule(schedule),
+                    AvailabilitySerializer,
+                    context,
+                ),
+                "appointments": Rows(
+                    Appointment.objects.in_schedule(schedule),
+                    AppointmentBasicSerializer,
+                    context,
+                ),
+                "therapy_appointments": Rows(
+                    TherapyAppointment.objects.in_schedule(schedule),
+                    TherapyAppointmentSerializer,
+                    context,
+                ),
+            }
+        )
+
+    @action(detail=True, methods=["get"])
+    def changes(self, request, pk=None):
+        """
+        The rows created, updated or deleted since the `cursor` of a previous
+        response (or of the snapshot), as in the snapshot, plus the IDs of the
+        deleted ones.  Use "current" as the ID for the current schedule.
+        """
+        try:
+            cursor = int(request.query_params["cursor"])
+        except (KeyError, ValueError):
+            raise exceptions.ParseError("A valid cursor is required.")
+
+        schedule = self.get_schedule(pk)
+        return Response(get_changes(schedule, cursor, context={"request": request}))
+
+    @action(detail=True, methods=["post"])
+    def auto_schedule(self, request, pk=None):
+        """
+        Fill this sandbox schedule with appointments from the availabilities.
+        """
+        try:
+            time_budget = float(request.data.get("time_budget", 10))
+            seed = request.data.get("seed")
+            seed = int(seed) if seed is not None else None
+        except (TypeError, ValueError):
+            raise exceptions.ParseError("Invalid time budget or seed.")
+
+        mode = request.data.get("mode", GREEDY)
+        if mode not in MODES:
+            raise exceptions.ParseError(f"Mode must be one of: {', '.join(MODES)}.")
+
+        if not 0 < time_budget <= MAX_AUTO_SCHEDULE_TIME_BUDGET:
+            raise exceptions.ParseError(
+                "Time budget must be between 0 and "
+                f"{MAX_AUTO_SCHEDULE_TIME_BUDGET} seconds."
+            )
+
+        schedule = self.get_object()
+        result = auto_schedule(schedule, time_budget=time_budget, seed=seed, mode=mode)
+
+        return Response(result, status=200)
 
-class AppointmentViewSet(viewsets.ModelViewSet):
+
+class AppointmentViewSet(
+    RevisionETagMixin,
+    CompactMixin,
+    DeferredNotesMixin,
+    ScheduleRowsMixin,
+    viewsets.ModelViewSet,
+):
     queryset = Appointment.objects.select_related("client", "technician").all()
     serializer_class = AppointmentSerializer
+    deferred_notes = [
+        "notes",
+        "client__notes",
+        "client__sub_notes",
+        "technician__notes",
+    ]
     permission_classes = [
         IsSuperUserOrReadOnlyAuthenticated,
     ]
 
-    def get_queryset(self):
-        qs = super().get_queryset()
-
-        qs = qs.filter(schedule=self.request.schedule)
-
-        return qs
-
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -193,10 +432,66 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         )
         return Response(warnings)
 
+    @action(detail=False, methods=["post"])
+    def batch_warnings(self, request):
+        """
+        Evaluate the warnings for many candidate placements at once.  The
+        response is a list of warnings for each placement, in the same order.
+        """
+        serializer = BatchWarningsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        warnings = get_batch_appointment_warnings(
+            serializer.validated_data["placements"],
+            schedule=request.schedule,
+        )
+        return Response(warnings)
+
+    @action(detail=False, methods=["post"])
+    def improve(self, request):
+        """
+        Look for improvements to this schedule's appointments.  Nothing is
+        saved: the response is a diff to review and pass to
+        `apply_improvements`.
+        """
+        try:
+            time_budget = float(request.data.get("time_budget", 5))
+            seed = request.data.get("seed")
+            seed = int(seed) if seed is not None else None
+        except (TypeError, ValueError):
+            raise exceptions.ParseError("Invalid time budget or seed.")
+
+        if not 0 < time_budget <= MAX_AUTO_SCHEDULE_TIME_BUDGET:
+            raise exceptions.ParseError(
+                "Time budget must be between 0 and "
+                f"{MAX_AUTO_SCHEDULE_TIME_BUDGET} seconds."
+            )
+
+        result = improve_schedule(request.schedule, time_budget=time_budget, seed=seed)
+        return Response(result)
+
+    @action(detail=False, methods=["post"])
+    def apply_improvements(self, request):
+        """
+        Save the changes of a diff from `improve`.
+        """
+        serializer = ApplyChangesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            result = apply_changes(
+                request.schedule, serializer.validated_data["changes"]
+            )
+        except StaleChangeError as e:
+            raise exceptions.ValidationError(str(e))
+
+        return Response(result)
+
     @action(detail=True, methods=["get"])
+    @cache_response("appointment-recommended-subs")
     def find_recommended_subs(self, request, pk=None):
         appointment = self.get_object()
-        recommended_subs = find_recommended_subs(appointment)
+        recommended_subs = find_recommended_subs(appointment, request.schedule)
 
         serializer = TechnicianBasicSerializer(
             recommended_subs,
@@ -208,6 +503,8 @@ class AppointmentViewSet(viewsets.ModelViewSet):
 
 
 class AvailabilityViewSet(
+    RevisionETagMixin,
+    ScheduleRowsMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     mixins.UpdateModelMixin,
@@ -220,15 +517,8 @@ class AvailabilityViewSet(
         IsSuperUserOrReadOnlyAuthenticated,
     ]
 
-    def get_queryset(self):
-        qs = super().get_queryset()
-
-        qs = qs.filter(schedule=self.request.schedule)
-
-        return qs
 
-
-class BlockViewSet(viewsets.ReadOnlyModelViewSet):
+class BlockViewSet(RevisionETagMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Block.objects.all()
     serializer_class = BlockSerialzier
     # NOTE: Unauthed users can see blocks
@@ -237,7 +527,13 @@ class BlockViewSet(viewsets.ReadOnlyModelViewSet):
     ]
 
 
-class ClientViewSet(viewsets.ModelViewSet):
+class ClientViewSet(
+    RevisionETagMixin,
+    CompactMixin,
+    DeferredNotesMixin,
+    ValuesListMixin,
+    viewsets.ModelViewSet,
+):
     queryset = Client.objects.prefetch_related(
         "availabilities",
         "appointments",
@@ -245,10 +541,24 @@ class ClientViewSet(viewsets.ModelViewSet):
         "past_technicians",
     ).all()
     serializer_class = ClientSerializer
+    filterset_class = ClientFilter
+    deferred_notes = ["notes", "sub_notes"]
     permission_classes = [
         IsSuperUserOrReadOnlyAuthenticated,
     ]
 
+    @cache_response("client-list")
+    def list_response(self, request, *args, **kwargs):
+        return super().list_response(request, *args, **kwargs)
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+
+        if self.request.query_params.get("expand_properties"):
+            qs = qs.with_hours(self.request.schedule)
+
+        return qs
+
     @action(detail=True, methods=["post"])
     def create_availability(self, request, pk=None):
         client = self.get_object()
@@ -266,6 +576,7 @@ class ClientViewSet(viewsets.ModelViewSet):
         raise exceptions.APIException("Failed to create availability for client.")
 
     @action(detail=True, methods=["get"])
+    @cache_response("client-available-techs")
     def available_techs(self, request, pk=None):
         client = self.get_object()
         day = request.query_params.get("day")
@@ -299,6 +610,7 @@ class ClientViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
     @action(detail=True, methods=["get"])
+    @cache_response("client-repeatable-days")
     def get_repeatable_appointment_days(self, request, pk=None):
         client = self.get_object()
         tech_id = request.query_params.get("tech_id")
@@ -325,16 +637,35 @@ class ClientViewSet(viewsets.ModelViewSet):
         return Response(repeatable_days)
 
 
-class TechnicianViewSet(viewsets.ModelViewSet):
+class TechnicianViewSet(
+    RevisionETagMixin,
+    CompactMixin,
+    DeferredNotesMixin,
+    ValuesListMixin,
+    viewsets.ModelViewSet,
+):
     queryset = Technician.objects.prefetch_related(
         "availabilities",
         "appointments",
     ).all()
     serializer_class = TechnicianSerializer
+    filterset_class = TechnicianFilter
     permission_classes = [
         IsSuperUserOrReadOnlyAuthenticated,
     ]
 
+    @cache_response("technician-list")
+    def list_response(self, request, *args, **kwargs):
+        return super().list_response(request, *args, **kwargs)
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+
+        if self.request.query_params.get("expand_properties"):
+            qs = qs.with_hours(self.request.schedule)
+
+        return qs
+
     @action(detail=True, methods=["post"])
     def create_availability(self, request, pk=None):
         technician = self.get_object()
@@ -352,16 +683,59 @@ class TechnicianViewSet(viewsets.ModelViewSet):
         raise exceptions.APIException("Failed to create availability for technician.")
 
 
-class TherapyAppointmentViewSet(viewsets.ModelViewSet):
+class TherapyAppointmentViewSet(
+    DeferredNotesMixin, ScheduleRowsMixin, viewsets.ModelViewSet
+):
     queryset = TherapyAppointment.objects.select_related("client").all()
     serializer_class = TherapyAppointmentSerializer
+    deferred_notes = ["notes", "client__notes", "client__sub_notes"]
     permission_classes = [
         IsSuperUserOrReadOnlyAuthenticated,
     ]
 
-    def get_queryset(self):
-        qs = super().get_queryset()
 
-        qs = qs.filter(schedule=self.request.schedule)
+async def schedule_events(request, pk):
+    """
+    Stream a schedule's change events as server-sent events.
 
-        return qs
+    NOTE: A stream is open for as long as the reader is, so this is only
+    served by the ASGI application: under WSGI it would hold a worker, so it
+    answers 501 and the frontend polls instead.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {"detail": "Schedule events are only served over ASGI."}, status=501
+        )
+
+    try:
+        authenticated = await sync_to_async(TokenAuthentication().authenticate)(request)
+    except exceptions.AuthenticationFailed as e:
+        return JsonResponse({"detail": str(e.detail)}, status=401)
+    if authenticated is None:
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided."}, status=401
+        )
+
+    if pk == "current":
+        schedule = await sync_to_async(get_current_schedule)()
+        # and end the stream when another schedule becomes current
+        keys = [get_key(schedule.pk), CURRENT]
+    else:
+        try:
+            schedule = await Schedule.objects.aget(id=pk)
+        except (Schedule.DoesNotExist, ValidationError):
+            return JsonResponse(
+                {"detail": "No Schedule matches the given query."}, status=404
+            )
+        keys = [get_key(schedule.pk)]
+    if schedule.is_overlay:
+        # it reads rows from its parent
+        keys.append(get_key(schedule.parent_id))
+
+    response = StreamingHttpResponse(
+        stream_events(keys), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # don't let a proxy buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
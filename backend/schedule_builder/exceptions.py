@@ -1,7 +1,11 @@
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError
 from rest_framework import exceptions
 from rest_framework.views import exception_handler as drf_exception_handler
 
+# Postgres error code of a write rejected by an exclusion constraint
+EXCLUSION_VIOLATION = "23P01"
+
 
 def exception_handler(exc, context):
 
@@ -10,4 +14,14 @@ def exception_handler(exc, context):
         args = exc.args
         exc = exceptions.NotFound(*(args))
 
+    # Convert double bookings rejected by the booking constraints to a
+    # validation error
+    if (
+        isinstance(exc, IntegrityError)
+        and getattr(exc.__cause__, "pgcode", None) == EXCLUSION_VIOLATION
+    ):
+        exc = exceptions.ValidationError(
+            "This overlaps another appointment of the same technician or client."
+        )
+
     return drf_exception_handler(exc, context)
@@ -1,9 +1,10 @@
-from apps.appointments.models import Schedule
+from apps.appointments.models import Schedule, get_current_schedule
 
 
 class ScheduleMiddleware:
     """
     Middleware to extract 'X-Schedule-ID' from request headers and attach it to the request object.
+    Requests without one get the current schedule.
     """
 
     def __init__(self, get_response):
@@ -16,9 +17,9 @@ class ScheduleMiddleware:
                 schedule = Schedule.objects.get(id=schedule_id)
                 request.schedule = schedule
             except Schedule.DoesNotExist:
-                request.schedule = None
+                request.schedule = get_current_schedule()
         else:
-            request.schedule = None
+            request.schedule = get_current_schedule()
 
         response = self.get_response(request)
         return response
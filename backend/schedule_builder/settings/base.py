@@ -173,8 +173,68 @@ DEFAULT_FROM_EMAIL = "admin@{}".format(SITE_DOMAIN)
 CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-    }
+    },
+    # Responses of the heavy read endpoints, see apps/appointments/response_cache.py
+    "responses": {
+        "BACKEND": os.environ.get(
+            "RESPONSE_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.environ.get("RESPONSE_CACHE_LOCATION", "responses"),
+        "TIMEOUT": 60 * 60,
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
 }
+RESPONSE_CACHE_ALIAS = "responses"
+
+# Key the response cache's entries are encrypted with, since they hold
+# decrypted fields.  It must differ from FIELD_ENCRYPTION_KEY.
+RESPONSE_CACHE_KEY = os.environ.get(
+    "RESPONSE_CACHE_KEY",
+    "y2hc4wGHZ_0MOOKk1hHhKl3-jF51x5LHvVSy_XMu0So=",  # DEVELOPMENT ONLY
+)
+
+
+# Auto scheduling
+
+# Processes the auto scheduler spreads its randomized restarts over
+AUTO_SCHEDULE_WORKERS = int(os.environ.get("AUTO_SCHEDULE_WORKERS", 1))
+
+
+# Schedule events
+
+# Fans schedule change events out to the event streams: LocalHub within this
+# process, PostgresHub across processes
+SCHEDULE_EVENTS_HUB = os.environ.get(
+    "SCHEDULE_EVENTS_HUB", "apps.appointments.events.LocalHub"
+)
+
+
+# Change feed
+
+# Days the change feed keeps its entries, see the `prune_changes` command.
+# Readers whose cursor is older get a reset.
+SCHEDULE_CHANGE_RETENTION_DAYS = int(
+    os.environ.get("SCHEDULE_CHANGE_RETENTION_DAYS", 30)
+)
+
+
+# Lists
+
+# Serve client and technician lists from `.values()` rows rather than through
+# their serializers (see apps/appointments/values_lists.py)
+VALUES_LISTS = not os.environ.get("DISABLE_VALUES_LISTS")
+
+
+# Blind indexes
+
+# Key of the HMACs that index the encrypted names (see blind_index.py).  It
+# must differ from FIELD_ENCRYPTION_KEY, and changing it means running the
+# `reindex_names` command.
+BLIND_INDEX_KEY = os.environ.get(
+    "BLIND_INDEX_KEY",
+    "3zsxiulAyA9l_dE8SHe10Tr-u6mh3TInTIRKzMZYlZg=",  # DEVELOPMENT ONLY
+)
 
 
 ####################################
@@ -212,3 +272,8 @@ FIELD_ENCRYPTION_KEY = os.environ.get(
     "FIELD_ENCRYPTION_KEY",
     "Z80Ja1Pn1AhFZmEnnMByEfZjVspYeAFs3jlb6IBQWFo=",  # DEVELOPMENT ONLY
 )
+
+# Decrypted values each process keeps in memory, and for how many seconds
+# (see apps/appointments/decrypt_cache.py).  0 entries disables the cache.
+DECRYPT_CACHE_MAX_ENTRIES = int(os.environ.get("DECRYPT_CACHE_MAX_ENTRIES", 20000))
+DECRYPT_CACHE_SECONDS = float(os.environ.get("DECRYPT_CACHE_SECONDS", 600))
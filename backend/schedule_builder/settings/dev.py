@@ -30,6 +30,7 @@ CSRF_TRUSTED_ORIGINS = [FRONTEND_URL]
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_HEADERS = list(default_headers) + [
     "X-Schedule-ID",
+    "X-Representation",
 ]
 
 
@@ -17,6 +17,29 @@ DATABASES = {
     }
 }
 
+# Cache
+# Shared by the server's processes.  Its entries are encrypted with
+# RESPONSE_CACHE_KEY.
+
+CACHES["responses"].update(
+    {
+        "BACKEND": os.environ.get(
+            "RESPONSE_CACHE_BACKEND",
+            "django.core.cache.backends.filebased.FileBasedCache",
+        ),
+        "LOCATION": os.environ.get(
+            "RESPONSE_CACHE_LOCATION", "/var/tmp/schedule_builder/responses"
+        ),
+    }
+)
+
+# Schedule events
+# Writes and event streams are served by different processes
+
+SCHEDULE_EVENTS_HUB = os.environ.get(
+    "SCHEDULE_EVENTS_HUB", "apps.appointments.events.PostgresHub"
+)
+
 # CSRF
 # https://docs.djangoproject.com/en/4.2/ref/settings/#csrf-trusted-origins
 
@@ -28,4 +51,5 @@ CSRF_TRUSTED_ORIGINS = [FRONTEND_URL]
 CORS_ALLOWED_ORIGINS = [FRONTEND_URL]
 CORS_ALLOW_HEADERS = list(default_headers) + [
     "X-Schedule-ID",
+    "X-Representation",
 ]
@@ -21,6 +21,7 @@ from apps.appointments.views import (
     ScheduleViewSet,
     TechnicianViewSet,
     TherapyAppointmentViewSet,
+    schedule_events,
 )
 
 router = routers.DefaultRouter()
@@ -39,6 +40,11 @@ router.register(
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path(
+        "api/schedules/<str:pk>/events/",
+        schedule_events,
+        name="schedule-events",
+    ),
     path("api/", include(router.urls)),
     path("api/token-auth/", LoginView.as_view(), name="knox_login"),
     path("api/token-auth/logout/", knox_views.LogoutView.as_view(), name="knox_logout"),
@@ -1,7 +1,10 @@
 /* eslint-disable react-refresh/only-export-components */
 
-import { BlockModel, ClientModel, ScheduleModel, TechnicianModel } from '@/api';
+import { ScheduleModel } from '@/api';
+import { subscribeScheduleEvents } from '@/lib/events';
 import { orderByFirstName } from '@/utils/order';
+import { useDebounce } from '@/utils/debounce';
+import { applyChanges, hydrateSnapshot } from '@/utils/snapshot';
 import { Loader } from 'lucide-react';
 import React from 'react';
 
@@ -29,17 +32,41 @@ export const ScheduleProvider = (props: ScheduleProviderProps) => {
   const [clients, setClients] = React.useState<Client[]>([]);
   const [technicians, setTechnicians] = React.useState<Technician[]>([]);
   const [loading, setLoading] = React.useState(true);
+  const snapshotRef = React.useRef<ScheduleSnapshot | null>(null);
+  const connectedRef = React.useRef(false);
+  const scheduleId = localStorage.getItem('schedule') || 'current';
+  const fetchChangesSoon = useDebounce(() => fetchSchedule(false), 500);
 
   React.useEffect(() => {
-    // Poll every minute
+    // Fetch the changes as they happen, and poll every minute and when the
+    // window regains focus while the event stream is down
+    const unsubscribe = subscribeScheduleEvents(scheduleId, fetchChangesSoon, (connected) => {
+      connectedRef.current = connected;
+      if (connected && snapshotRef.current) {
+        // Catch up with what changed while disconnected
+        fetchChangesSoon();
+      }
+    });
     const pollInterval = setInterval(() => {
-      fetchSchedule(false);
+      if (!connectedRef.current) {
+        fetchSchedule(false);
+      }
     }, 60 * 1000);
+    const onFocus = () => {
+      if (!connectedRef.current && snapshotRef.current) {
+        fetchChangesSoon();
+      }
+    };
+    window.addEventListener('focus', onFocus);
 
     // Initial fetch
     fetchSchedule(true);
 
-    return () => clearInterval(pollInterval);
+    return () => {
+      unsubscribe();
+      clearInterval(pollInterval);
+      window.removeEventListener('focus', onFocus);
+    };
   }, []);
 
   const fetchSchedules = async () => {
@@ -48,37 +75,41 @@ export const ScheduleProvider = (props: ScheduleProviderProps) => {
     });
   };
 
-  const fetchBlocks = async () => {
-    await BlockModel.all().then((blocks) => {
-      setBlocks(blocks);
-    });
+  const setSnapshot = (snapshot: ScheduleSnapshot) => {
+    snapshotRef.current = snapshot;
+    const hydrated = hydrateSnapshot(snapshot);
+    setBlocks(hydrated.blocks);
+    setClients(orderByFirstName<Client>(hydrated.clients));
+    setTechnicians(orderByFirstName<Technician>(hydrated.technicians));
   };
 
-  const fetchClients = async () => {
-    await ClientModel.all({
-      page_size: 1000,
-      expand_appointments: true,
-      expand_availabilities: true,
-    }).then((clients) => {
-      setClients(orderByFirstName<Client>(clients));
+  const fetchSnapshot = async () => {
+    await ScheduleModel.detailAction(scheduleId, 'snapshot', 'get').then((res) => {
+      setSnapshot(res.data);
     });
   };
 
-  const fetchTechnicians = async () => {
-    await TechnicianModel.all({
-      page_size: 1000,
-      expand_availabilities: true,
-      expand_appointments: true,
-    }).then((technicians) => {
-      setTechnicians(orderByFirstName<Technician>(technicians));
-    });
+  // Only fetch what changed since the last snapshot
+  const fetchChanges = async (snapshot: ScheduleSnapshot) => {
+    const res = await ScheduleModel.detailAction(scheduleId, 'changes', 'get', {}, { cursor: snapshot.cursor });
+    const changes: ScheduleChanges = res.data;
+    if (changes.reset) {
+      await fetchSnapshot();
+    } else if (Object.keys(changes.changes).length || Object.keys(changes.deleted).length) {
+      setSnapshot(applyChanges(snapshot, changes));
+    } else {
+      snapshotRef.current = { ...snapshot, cursor: changes.cursor ?? snapshot.cursor };
+    }
   };
 
   async function fetchSchedule(withLoader: boolean) {
     if (withLoader) {
       setLoading(true);
     }
-    await Promise.all([fetchSchedules(), fetchBlocks(), fetchClients(), fetchTechnicians()]).finally(() => {
+    // A full reload when showing the loader, otherwise only the changes
+    const snapshot = snapshotRef.current;
+    const fetchData = snapshot && !withLoader ? fetchChanges(snapshot) : fetchSnapshot();
+    await Promise.all([fetchSchedules(), fetchData]).finally(() => {
       setLoading(false);
     });
   }
@@ -0,0 +1,73 @@
+import { getHeaders } from '@/lib/http';
+
+const RETRY_DELAY = 5000;
+
+/**
+ * Listen to a schedule's change events, reconnecting whenever the stream
+ * closes. `onConnected` is called with whether the stream is open.
+ *
+ * The stream is only served over ASGI; a server without it answers 501, and
+ * then this gives up, leaving the stream closed.
+ *
+ * NOTE: EventSource can't send the auth header, so the stream is read with
+ * fetch instead.
+ */
+export function subscribeScheduleEvents(
+  scheduleId: string,
+  onEvent: (event: ScheduleEvent) => void,
+  onConnected: (connected: boolean) => void,
+): () => void {
+  const controller = new AbortController();
+  let retryDelay = RETRY_DELAY;
+  let unavailable = false;
+
+  const listen = async () => {
+    const res = await fetch(`${import.meta.env.VITE_API_HOST}/api/schedules/${scheduleId}/events/`, {
+      headers: getHeaders(),
+      signal: controller.signal,
+    });
+    if (res.status === 501) {
+      unavailable = true;
+    }
+    if (!res.ok || !res.body) {
+      throw new Error(`Failed to listen to schedule events: ${res.status}`);
+    }
+    onConnected(true);
+
+    const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) {
+        return;
+      }
+      buffer += value;
+      // Messages are separated by a blank line
+      const messages = buffer.split('\n\n');
+      buffer = messages.pop() ?? '';
+      messages.forEach((message) => {
+        message.split('\n').forEach((line) => {
+          if (line.startsWith('data:')) {
+            onEvent(JSON.parse(line.slice(5)));
+          } else if (line.startsWith('retry:')) {
+            retryDelay = Number(line.slice(6)) || RETRY_DELAY;
+          }
+        });
+      });
+    }
+  };
+
+  const connect = () => {
+    listen()
+      .catch(() => {})
+      .finally(() => {
+        onConnected(false);
+        if (!controller.signal.aborted && !unavailable) {
+          setTimeout(connect, retryDelay);
+        }
+      });
+  };
+  connect();
+
+  return () => controller.abort();
+}
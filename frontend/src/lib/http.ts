@@ -6,19 +6,30 @@ export const http = axios.create({
   baseURL: import.meta.env.VITE_API_HOST,
 });
 
-http.interceptors.request.use((config) => {
+/**
+ * The auth and schedule headers of every API request.
+ */
+export function getHeaders() {
   const token = localStorage.getItem('token');
   const impersonate = localStorage.getItem('impersonate');
   const schedule = localStorage.getItem('schedule');
+  const headers: Record<string, string> = {};
 
   if (impersonate) {
-    config.headers['Authorization'] = `Token ${impersonate}`;
+    headers['Authorization'] = `Token ${impersonate}`;
   } else if (token) {
-    config.headers['Authorization'] = `Token ${token}`;
+    headers['Authorization'] = `Token ${token}`;
   }
   if (schedule) {
-    config.headers['X-Schedule-ID'] = schedule;
+    headers['X-Schedule-ID'] = schedule;
   }
+  return headers;
+}
+
+http.interceptors.request.use((config) => {
+  Object.entries(getHeaders()).forEach(([name, value]) => {
+    config.headers[name] = value;
+  });
   return config;
 });
 
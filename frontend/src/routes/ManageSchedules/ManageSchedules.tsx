@@ -43,6 +43,7 @@ export const ManageSchedules = () => {
   const [creatingForm, setCreatingForm] = React.useState({
     name: '',
     copy_from_current: true,
+    is_overlay: false,
   });
   const [editing, setEditing] = React.useState<Schedule>();
   const [deleting, setDeleting] = React.useState<Schedule>();
@@ -61,6 +62,7 @@ export const ManageSchedules = () => {
     setCreatingForm({
       name: '',
       copy_from_current: true,
+      is_overlay: false,
     });
   }
 
@@ -78,6 +80,7 @@ export const ManageSchedules = () => {
       setCreatingForm({
         name: '',
         copy_from_current: true,
+        is_overlay: false,
       });
     });
   }
@@ -224,6 +227,7 @@ export const ManageSchedules = () => {
                     setCreatingForm({
                       ...creatingForm,
                       copy_from_current: !creatingForm.copy_from_current,
+                      is_overlay: false,
                     })
                   }
                 />
@@ -241,6 +245,33 @@ export const ManageSchedules = () => {
                 </Label>
               </div>
             </div>
+            <div className="form-group">
+              <div className="flex items-center gap-2">
+                <Checkbox
+                  id="overlay_current_create"
+                  checked={creatingForm.is_overlay}
+                  onCheckedChange={() =>
+                    setCreatingForm({
+                      ...creatingForm,
+                      is_overlay: !creatingForm.is_overlay,
+                      copy_from_current: false,
+                    })
+                  }
+                />
+                <Label htmlFor="overlay_current_create">
+                  Build on current schedule
+                  <Tooltip>
+                    <TooltipTrigger asChild>
+                      <Info size="16" />
+                    </TooltipTrigger>
+                    <TooltipContent className="w-64">
+                      Instead of copying the current schedule, the new one only stores what is changed in it, and shows
+                      the current schedule's data for everything else. Changes to the current schedule show through.
+                    </TooltipContent>
+                  </Tooltip>
+                </Label>
+              </div>
+            </div>
             <div className="flex justify-end gap-2">
               <Button onClick={cancelCreate} type="button" variant="ghost">
                 Cancel
@@ -3,4 +3,6 @@ type Schedule = {
   created_at: string;
   updated_at: string;
   name: string;
+  is_overlay: boolean;
+  parent: string | null;
 };
@@ -0,0 +1,6 @@
+type ScheduleChanges = {
+  cursor: number | null;
+  reset: boolean;
+  changes: Partial<Pick<ScheduleSnapshot, 'clients' | 'technicians' | 'availabilities' | 'appointments' | 'therapy_appointments'>>;
+  deleted: Partial<Record<'clients' | 'technicians' | 'availabilities' | 'appointments' | 'therapy_appointments', string[]>>;
+};
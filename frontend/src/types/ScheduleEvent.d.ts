@@ -0,0 +1,11 @@
+type ScheduleEvent =
+  | {
+      model: 'availabilities' | 'appointments' | 'therapy_appointments';
+      id: string;
+      action: 'upsert' | 'delete';
+    }
+  | {
+      action: 'reset';
+      // Another schedule was promoted to be current, and the stream ends
+      current_moved?: boolean;
+    };
@@ -0,0 +1,14 @@
+type ScheduleSnapshot = {
+  schedule: Schedule | null;
+  cursor: number;
+  content_types: {
+    client: number;
+    technician: number;
+  };
+  blocks: Block[];
+  clients: (Omit<Client, 'past_technicians'> & { past_technicians: string[] })[];
+  technicians: Technician[];
+  availabilities: Availability[];
+  appointments: (Omit<Appointment, 'client' | 'technician'> & { client: string; technician: string })[];
+  therapy_appointments: TherapyAppointment[];
+};
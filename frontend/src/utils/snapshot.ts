@@ -0,0 +1,80 @@
+/**
+ * Rebuild the nested clients and technicians of the expanded list endpoints
+ * from the flat lists of a schedule snapshot.
+ */
+export function hydrateSnapshot(snapshot: ScheduleSnapshot) {
+  const basicTechnicians = new Map<string, Technician>();
+  const technicians = new Map<string, Technician>();
+  snapshot.technicians.forEach((technician) => {
+    basicTechnicians.set(technician.id, technician);
+    technicians.set(technician.id, { ...technician, appointments: [], availabilities: [] });
+  });
+
+  const basicClients = new Map<string, Client>();
+  const clients = new Map<string, Client>();
+  snapshot.clients.forEach((client) => {
+    const basicClient = {
+      ...client,
+      past_technicians: client.past_technicians
+        .map((id) => basicTechnicians.get(id))
+        .filter((technician): technician is Technician => technician !== undefined),
+    };
+    basicClients.set(client.id, basicClient);
+    clients.set(client.id, { ...basicClient, appointments: [], therapy_appointments: [], availabilities: [] });
+  });
+
+  snapshot.appointments.forEach((appointment) => {
+    const hydrated: Appointment = {
+      ...appointment,
+      client: basicClients.get(appointment.client),
+      technician: basicTechnicians.get(appointment.technician),
+    };
+    clients.get(appointment.client)?.appointments?.push(hydrated);
+    technicians.get(appointment.technician)?.appointments?.push(hydrated);
+  });
+
+  snapshot.therapy_appointments.forEach((therapyAppointment) => {
+    clients.get(therapyAppointment.client)?.therapy_appointments?.push(therapyAppointment);
+  });
+
+  snapshot.availabilities.forEach((availability) => {
+    if (availability.content_type === snapshot.content_types.client) {
+      clients.get(availability.object_id)?.availabilities?.push(availability);
+    } else if (availability.content_type === snapshot.content_types.technician) {
+      technicians.get(availability.object_id)?.availabilities?.push(availability);
+    }
+  });
+
+  return {
+    blocks: snapshot.blocks,
+    clients: Array.from(clients.values()),
+    technicians: Array.from(technicians.values()),
+  };
+}
+
+type SnapshotList = keyof ScheduleChanges['changes'];
+
+const snapshotLists: SnapshotList[] = ['clients', 'technicians', 'availabilities', 'appointments', 'therapy_appointments'];
+
+/**
+ * Apply the rows changed and deleted since a snapshot's cursor, from the
+ * schedule change feed.
+ */
+export function applyChanges(snapshot: ScheduleSnapshot, changes: ScheduleChanges): ScheduleSnapshot {
+  const updated: ScheduleSnapshot = { ...snapshot, cursor: changes.cursor ?? snapshot.cursor };
+
+  snapshotLists.forEach((list) => {
+    const changed = changes.changes[list] ?? [];
+    const deleted = changes.deleted[list] ?? [];
+    if (!changed.length && !deleted.length) {
+      return;
+    }
+
+    const rows = new Map<string, { id: string }>(snapshot[list].map((row) => [row.id, row]));
+    deleted.forEach((id) => rows.delete(id));
+    changed.forEach((row) => rows.set(row.id, row));
+    Object.assign(updated, { [list]: Array.from(rows.values()) });
+  });
+
+  return updated;
+}